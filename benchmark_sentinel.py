@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+
+import io
+import gc
+import os
+import sys
+import random
+import glob
+import time
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+from sentinel_analysis import *
+import create_sql_stmts
+
+def generate_synthetic_cdfs( num_transitions: int, seed: int ) -> Tuple[np.ndarray, np.ndarray]:
+    """Generate two runs' worth of increasing percentile values, spread over a few orders of magnitude like real transition times"""
+    rng = np.random.default_rng( seed )
+    scale1 = 10. ** rng.integers( 0, 4, size=(num_transitions, 1) )
+    scale2 = scale1 * rng.lognormal( sigma=0.5, size=(num_transitions, 1) )
+    cdf_vals1 = np.sort( rng.lognormal( size=(num_transitions, len(CDF_PERCENTILES)) ), axis=1 ) * scale1
+    cdf_vals2 = np.sort( rng.lognormal( size=(num_transitions, len(CDF_PERCENTILES)) ), axis=1 ) * scale2
+    return cdf_vals1, cdf_vals2
+
+def bench_emd( args ):
+    cdf_vals1, cdf_vals2 = generate_synthetic_cdfs( args.transitions, args.seed )
+    dist_mat = generate_distance_matrix( CDF_PERCENTILES )
+
+    start = time.perf_counter()
+    pyemd_scores = np.array( [ do_emd( ( None, None, None, None, cdf_vals1[i], cdf_vals2[i], dist_mat, args.normalize ) )[0] for i in range( args.transitions ) ] )
+    pyemd_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    closed_form_scores = emd_closed_form_batch( cdf_vals1, cdf_vals2, CDF_PERCENTILES, args.normalize )
+    closed_form_time = time.perf_counter() - start
+
+    max_rel_err = np.max( np.abs( pyemd_scores - closed_form_scores ) / np.maximum( np.abs( pyemd_scores ), 1. ) )
+    print( "{:<15}\t{:<15}".format( "Backend", "Seconds" ) )
+    print( "-"*30 )
+    print( "{:<15}\t{:<15f}".format( "pyemd", pyemd_time ) )
+    print( "{:<15}\t{:<15f}".format( "closed_form", closed_form_time ) )
+    print( "Speedup: {:.1f}x, max relative difference: {}".format( pyemd_time / closed_form_time, max_rel_err ) )
+    if max_rel_err > 1e-9:
+        print( "EMD backends disagree!" )
+        sys.exit( 1 )
+
+def generate_synthetic_dump( fname: str, num_events: int, num_transitions: int, order: int, seed: int ):
+    """Write an im dump with num_events event count lines followed by num_transitions order <= k transition lines"""
+    rng = np.random.default_rng( seed )
+    with open( fname, "w" ) as f:
+        for event_id in range( num_events ):
+            f.write( "src/backend/file{}.c:{} = {}, {}\n".format( event_id % 50, event_id, event_id, rng.integers( 1, 100000 ) ) )
+        written = set() # type: Set[Tuple[int, ...]]
+        while len( written ) < num_transitions:
+            next_event = int( rng.integers( num_events ) )
+            prior_events = tuple( int( ev ) for ev in rng.integers( num_events, size=order ) )
+            if prior_events + ( next_event, ) in written:
+                continue
+            written.add( prior_events + ( next_event, ) )
+            f.write( "({})->{}: {}\n".format( ",".join( str( ev ) for ev in prior_events ), next_event, rng.integers( 1, 1000 ) ) )
+
+def read_im_dump_readlines( fname: str ) -> FileEventSummary:
+    """The previous parser, which materializes every line before processing"""
+    with open( fname, "r" ) as f:
+        f_lines = f.readlines()
+        return process_dump_lines( f_lines )
+
+def bench_parse( args ):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dump_fname = os.path.join( tmp_dir, "1.1.0.im.out" )
+        generate_synthetic_dump( dump_fname, args.events, args.transitions, args.order, args.seed )
+        print( "Dump size: {:.1f} MB".format( os.path.getsize( dump_fname ) / 1E6 ) )
+
+        results = {}
+        print( "{:<15}\t{:<15}\t{:<15}".format( "Parser", "Seconds", "Peak MB" ) )
+        print( "-"*45 )
+        for name, parse_func in [ ( "readlines", read_im_dump_readlines ), ( "streaming", read_single_im_dump ) ]:
+            tracemalloc.start()
+            start = time.perf_counter()
+            summary = parse_func( dump_fname )
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results[name] = summary
+            print( "{:<15}\t{:<15f}\t{:<15.1f}".format( name, elapsed, peak / 1E6 ) )
+
+    if results["readlines"].event_count_map != results["streaming"].event_count_map or \
+            results["readlines"].event_transition_map != results["streaming"].event_transition_map:
+        print( "Parsers disagree!" )
+        sys.exit( 1 )
+
+def generate_synthetic_trace( num_events: int, num_transitions: int, reservoir_size: int, seed: int ) -> Dict[str, np.ndarray]:
+    """Generate the columns of one thread's trace, as im_trace.c would hold them at dump time"""
+    rng = np.random.default_rng( seed )
+    transition_keys = rng.choice( num_events * num_events, size=num_transitions, replace=False )
+    transition_keys.sort()
+    reservoir_sizes = rng.integers( 1, reservoir_size + 1, size=num_transitions ).astype( np.uint64 )
+    return {
+        'event_ids': np.arange( num_events, dtype=np.int32 ),
+        'line_numbers': rng.integers( 1, 5000, size=num_events ).astype( np.int32 ),
+        'event_counts': rng.integers( 1, 1000000, size=num_events ).astype( np.uint64 ),
+        'fnames': [ "file{}.c".format( i % 200 ) for i in range( num_events ) ],
+        'transition_srcs': ( transition_keys // num_events ).astype( np.int32 ),
+        'transition_dsts': ( transition_keys % num_events ).astype( np.int32 ),
+        'transition_counts': rng.integers( 1, 100000, size=num_transitions ).astype( np.uint64 ),
+        'reservoir_offsets': np.concatenate( [ [0], np.cumsum( reservoir_sizes ) ] ).astype( np.uint64 ),
+        'reservoir_values': rng.lognormal( size=int( reservoir_sizes.sum() ) ) }
+
+def write_text_trace( trace: Dict[str, np.ndarray], dump_fname: str, flat_dir: str ):
+    """Write the trace the way im_trace.c does by default: a text dump plus one flat file per reservoir"""
+    with open( dump_fname, "w" ) as f:
+        for event_id, fname, line_number, count in zip( trace['event_ids'], trace['fnames'], trace['line_numbers'], trace['event_counts'] ):
+            f.write( "{}:{} = {}, {}\n".format( fname, line_number, event_id, count ) )
+        for src, dst, count in zip( trace['transition_srcs'], trace['transition_dsts'], trace['transition_counts'] ):
+            f.write( "{} -> {}: {}\n".format( src, dst, count ) )
+    offsets = trace['reservoir_offsets']
+    for i, ( src, dst ) in enumerate( zip( trace['transition_srcs'], trace['transition_dsts'] ) ):
+        with open( os.path.join( flat_dir, "event-flat-{}:{}-{}:{}-1-1-im".format( trace['fnames'][src], trace['line_numbers'][src],
+                                                                                   trace['fnames'][dst], trace['line_numbers'][dst] ) ), "w" ) as f:
+            f.write( "".join( "{:f}\n".format( val ) for val in trace['reservoir_values'][ offsets[i]:offsets[i+1] ] ) )
+
+def write_binary_trace( trace: Dict[str, np.ndarray], dump_fname: str ):
+    """Write the trace in the binary dump format, as im_trace.c does when SENTINEL_BINARY_DUMP is set"""
+    fname_data = "".join( trace['fnames'] ).encode()
+    fname_offsets = np.concatenate( [ [0], np.cumsum( [ len( fname ) for fname in trace['fnames'] ] ) ] ).astype( np.uint64 )
+    header = np.zeros( 1, dtype=BINARY_DUMP_HEADER )
+    header['magic'] = BINARY_DUMP_MAGIC
+    header['version'] = BINARY_DUMP_VERSION
+    header['num_columns'] = len( BINARY_DUMP_COLUMNS )
+    header['num_events'] = len( trace['event_ids'] )
+    header['num_transitions'] = len( trace['transition_srcs'] )
+    header['num_reservoirs'] = len( trace['transition_srcs'] )
+    columns = dict( trace, fname_offsets=fname_offsets, fname_data=np.frombuffer( fname_data, dtype=np.uint8 ),
+                    reservoir_srcs=trace['transition_srcs'], reservoir_dsts=trace['transition_dsts'] )
+    with open( dump_fname, "wb" ) as f:
+        f.write( header.tobytes() )
+        for name, dtype in BINARY_DUMP_COLUMNS:
+            data = np.ascontiguousarray( columns[name], dtype=dtype ).tobytes()
+            f.write( np.uint64( len( data ) ).tobytes() )
+            f.write( data )
+            f.write( b"\0" * ( -len( data ) % 8 ) )
+
+def load_text_trace( dump_fname: str, flat_dir: str ) -> Tuple[FileEventSummary, int]:
+    """Load a text trace: parse the dump and read every flat file's values into an array"""
+    summary = read_single_im_dump( dump_fname )
+    num_values = 0
+    for flat_fname in glob.iglob( os.path.join( flat_dir, "event-flat-*" ) ):
+        with open( flat_fname, "r" ) as f:
+            num_values += len( np.array( [ float( line ) for line in f ] ) )
+    return summary, num_values
+
+def load_binary_trace( dump_fname: str ) -> Tuple[FileEventSummary, int]:
+    """Load a binary trace: map the dump and view every reservoir"""
+    im_dump = read_binary_im_dump( dump_fname )
+    summary = binary_im_dump_to_summary( im_dump )
+    num_values = 0
+    for i in range( len( im_dump.reservoir_srcs ) ):
+        num_values += len( im_dump.get_reservoir( i ) )
+    return summary, num_values
+
+def generate_synthetic_dag( num_nodes: int, edge_prob: float, rng: random.Random ) -> List[MarkovNode]:
+    """Generate a random DAG of num_nodes nodes, with each edge along a random topological order present with probability
+    edge_prob. Transition probabilities are at least 0.7, so paths of up to 33 nodes stay above a cut off of 1E-5."""
+    nodes = [ MarkovNode( node_id, "synthetic.c", node_id ) for node_id in range( num_nodes ) ]
+    # Keep the first node first, as it is where the walks start
+    topo_order = nodes[:1] + rng.sample( nodes[1:], num_nodes-1 )
+    for i, node in enumerate( topo_order ):
+        for dst in topo_order[i+1:]:
+            if rng.random() < edge_prob:
+                node.add_transition( dst, rng.uniform( .7, 1. ), [ ( 1., 1. ) ] )
+        rng.shuffle( node.transitions )
+    return nodes
+
+def get_path_graphs( num_graphs: int, max_nodes: int, edge_prob: float, seed: int ) -> List[Tuple[List[MarkovNode], List[MarkovNode]]]:
+    """Generate random DAGs and their goal nodes, starting with the cyclic graph S->A, A->B, B->A, A->G where
+    A->B and B->A are on no simple path to G"""
+    nodes = [ MarkovNode( node_id, "synthetic.c", node_id ) for node_id in range( 4 ) ]
+    for src, dst, prob in [ ( 0, 1, 1. ), ( 1, 2, .5 ), ( 2, 1, 1. ), ( 1, 3, .5 ) ]:
+        nodes[src].add_transition( nodes[dst], prob, [ ( 1., 1. ) ] )
+    graphs = [ ( nodes, [ nodes[3] ] ) ]
+    rng = random.Random( seed )
+    while len( graphs ) < num_graphs:
+        nodes = generate_synthetic_dag( rng.randint( 2, max_nodes ), edge_prob, rng )
+        graphs.append( ( nodes, rng.sample( nodes[1:], min( len( nodes ) - 1, rng.randint( 1, 2 ) ) ) ) )
+    return graphs
+
+def get_good_path_flags( graphs: List[Tuple[List[MarkovNode], List[MarkovNode]]] ) -> List[List[bool]]:
+    flags = [ [ transition.is_good_path() for node in nodes for transition in node.transitions ] for nodes, goal_nodes in graphs ]
+    for nodes, goal_nodes in graphs:
+        for node in nodes:
+            for transition in node.transitions:
+                transition.set_bad_path()
+    return flags
+
+def bench_paths( args ):
+    graphs = get_path_graphs( args.graphs, args.nodes, args.edge_prob, args.seed )
+
+    start = time.perf_counter()
+    dfs_results = [ bounded_dfs( nodes[0], goal_nodes, cut_off=args.cut_off, nodes_seen_so_far=[], allow_loops=False ) for nodes, goal_nodes in graphs ]
+    dfs_time = time.perf_counter() - start
+    dfs_flags = get_good_path_flags( graphs )
+
+    start = time.perf_counter()
+    mark_results = [ mark_good_paths( nodes[0], goal_nodes, cut_off=args.cut_off ) for nodes, goal_nodes in graphs ]
+    mark_time = time.perf_counter() - start
+    mark_flags = get_good_path_flags( graphs )
+
+    print( "{:<15}\t{:<15}".format( "Method", "Seconds" ) )
+    print( "-"*30 )
+    print( "{:<15}\t{:<15f}".format( "bounded_dfs", dfs_time ) )
+    print( "{:<15}\t{:<15f}".format( "mark_good_paths", mark_time ) )
+    print( "Speedup: {:.1f}x".format( dfs_time / mark_time ) )
+    if dfs_results != mark_results or dfs_flags != mark_flags:
+        print( "Methods disagree!" )
+        sys.exit( 1 )
+
+def get_terminal_nodes_by_paths( node: MarkovNode, depth: int, nodes: Set[MarkovNode] ):
+    """Collect the nodes at the end of every path of depth transitions from node, as depth_bounded_mcmc used to"""
+    if depth == 0:
+        nodes.add( node )
+        return
+    for transition in node.transitions:
+        get_terminal_nodes_by_paths( transition.dst, depth-1, nodes )
+
+def generate_synthetic_markov_graph( num_nodes: int, branching: int, seed: int ) -> List[MarkovNode]:
+    """Generate a random graph of num_nodes nodes, which may have cycles, with branching transitions out of each node"""
+    rng = random.Random( seed )
+    nodes = [ MarkovNode( node_id, "synthetic.c", node_id ) for node_id in range( num_nodes ) ]
+    for node in nodes:
+        for dst in rng.sample( nodes, branching ):
+            node.add_transition( dst, 1. / branching, [ ( 1., 1. ) ] )
+    return nodes
+
+def bench_depth( args ):
+    nodes = generate_synthetic_markov_graph( args.nodes, args.branching, args.seed )
+    depths = list( range( args.depth+1 ) )
+
+    start = time.perf_counter()
+    path_sets = [ set() for depth in depths ] # type: List[Set[MarkovNode]]
+    for depth in depths:
+        get_terminal_nodes_by_paths( nodes[0], depth, path_sets[depth] )
+    path_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    frontier_sets = [ get_terminal_nodes_at_depth( nodes[0], depth ) for depth in depths ]
+    frontier_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cached_sets = [ get_terminal_nodes_at_depth( nodes[0], depth ) for depth in depths ]
+    cached_time = time.perf_counter() - start
+
+    print( "{:<15}\t{:<15}".format( "Method", "Seconds" ) )
+    print( "-"*30 )
+    print( "{:<15}\t{:<15f}".format( "paths", path_time ) )
+    print( "{:<15}\t{:<15f}".format( "frontier", frontier_time ) )
+    print( "{:<15}\t{:<15f}".format( "cached", cached_time ) )
+    print( "Speedup: {:.1f}x".format( path_time / frontier_time ) )
+    if path_sets != frontier_sets or path_sets != cached_sets:
+        print( "Methods disagree!" )
+        sys.exit( 1 )
+
+    # The graph is cyclic, so only the collector frees it, and with it the cache entry
+    del nodes, path_sets, frontier_sets, cached_sets
+    gc.collect()
+    if len( depth_frontier_cache ) != 0:
+        print( "Cache entry outlived its graph!" )
+        sys.exit( 1 )
+
+def bench_dump( args ):
+    trace = generate_synthetic_trace( args.events, args.transitions, args.reservoir_size, args.seed )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        text_dir = os.path.join( tmp_dir, "text" )
+        os.mkdir( text_dir )
+        text_fname = os.path.join( text_dir, "1.1.0.im.out" )
+        binary_fname = os.path.join( tmp_dir, "1.1.0.im.out" )
+        write_text_trace( trace, text_fname, text_dir )
+        write_binary_trace( trace, binary_fname )
+        text_size = sum( os.path.getsize( os.path.join( text_dir, fname ) ) for fname in os.listdir( text_dir ) )
+        print( "Text: {:.1f} MB in {} files, binary: {:.1f} MB".format( text_size / 1E6, len( os.listdir( text_dir ) ), os.path.getsize( binary_fname ) / 1E6 ) )
+
+        start = time.perf_counter()
+        text_summary, text_num_values = load_text_trace( text_fname, text_dir )
+        text_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        binary_summary, binary_num_values = load_binary_trace( binary_fname )
+        binary_time = time.perf_counter() - start
+
+    print( "{:<15}\t{:<15}".format( "Format", "Seconds" ) )
+    print( "-"*30 )
+    print( "{:<15}\t{:<15f}".format( "text", text_time ) )
+    print( "{:<15}\t{:<15f}".format( "binary", binary_time ) )
+    print( "Speedup: {:.1f}x".format( text_time / binary_time ) )
+    if text_summary.event_count_map != binary_summary.event_count_map or text_summary.event_transition_map != binary_summary.event_transition_map or \
+            text_num_values != binary_num_values:
+        print( "Formats disagree!" )
+        sys.exit( 1 )
+
+def generate_synthetic_run( num_events: int, num_transitions: int, seed: int ) -> Tuple[Dict[str,int], List[Tuple[str,str,int]], List[Tuple[str,str,List[float],List[float]]]]:
+    """Generate the events, transitions and CDFs of a run, as create_sql_stmts.py reads them"""
+    rng = np.random.default_rng( seed )
+    events = [ "file{}.c:{}".format( i % 200, i ) for i in range( num_events ) ]
+    event_map = dict( zip( events, rng.integers( 1, 1000000, size=num_events ).tolist() ) )
+    transition_keys = rng.choice( num_events * num_events, size=num_transitions, replace=False ).tolist()
+    transitions = [ ( events[ key // num_events ], events[ key % num_events ], int( rng.integers( 1, 1000 ) ) ) for key in transition_keys ]
+    ptls = [ float( ptl ) for ptl in CDF_PERCENTILES ]
+    cdf_vals = np.sort( rng.lognormal( size=( num_transitions, len( ptls ) ) ), axis=1 ).tolist()
+    cdfs = [ ( src, dst, ptls, vals ) for ( src, dst, count ), vals in zip( transitions, cdf_vals ) ]
+    return event_map, transitions, cdfs
+
+def bench_load( args ):
+    event_map, transitions, cdfs = generate_synthetic_run( args.events, args.transitions, args.seed )
+
+    start = time.perf_counter()
+    insert_text = io.StringIO()
+    create_sql_stmts.print_insert_stmts( args.run_id, event_map, transitions, cdfs, out=insert_text )
+    insert_text = insert_text.getvalue()
+    insert_format_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    copy_size = 0
+    for table, rows in create_sql_stmts.get_table_rows( args.run_id, event_map, transitions, cdfs ).items():
+        copy_size += len( create_sql_stmts.CopyStream( rows ).read() )
+    copy_format_time = time.perf_counter() - start
+    print( "INSERT text: {:.1f} MB, COPY text: {:.1f} MB".format( len( insert_text ) / 1E6, copy_size / 1E6 ) )
+
+    print( "{:<15}\t{:<15}\t{:<15}".format( "Loader", "Format Seconds", "Load Seconds" ) )
+    print( "-"*45 )
+    if args.dbname is None:
+        print( "{:<15}\t{:<15f}".format( "insert", insert_format_time ) )
+        print( "{:<15}\t{:<15f}".format( "copy", copy_format_time ) )
+        return
+
+    # Both loads are rolled back, so the run ID only needs to be unused
+    import psycopg2
+    conn = psycopg2.connect( 'host={} user={} dbname={}'.format( args.dbhost, args.dbuser, args.dbname ) )
+    cur = conn.cursor()
+    start = time.perf_counter()
+    cur.execute( insert_text )
+    insert_time = time.perf_counter() - start
+    conn.rollback()
+
+    start = time.perf_counter()
+    create_sql_stmts.copy_into_db( conn, args.run_id, create_sql_stmts.get_table_rows( args.run_id, event_map, transitions, cdfs ), commit=False )
+    copy_time = time.perf_counter() - start
+    conn.rollback()
+    conn.close()
+
+    print( "{:<15}\t{:<15f}\t{:<15f}".format( "insert", insert_format_time, insert_time ) )
+    print( "{:<15}\t{:<15f}\t{:<15f}".format( "copy", copy_format_time, copy_time ) )
+    print( "Speedup: {:.1f}x".format( ( insert_format_time + insert_time ) / ( copy_format_time + copy_time ) ) )
+
+def explain_query( conn, query: str, params, use_indexes: bool ) -> List[str]:
+    """EXPLAIN ANALYZE query, optionally with index scans disabled to plan it as the schema without indexes would"""
+    cur = conn.cursor()
+    try:
+        if not use_indexes:
+            for setting in [ "enable_indexscan", "enable_indexonlyscan", "enable_bitmapscan" ]:
+                cur.execute( "SET LOCAL {} = off".format( setting ) )
+        cur.execute( "EXPLAIN ( ANALYZE, BUFFERS ) " + query, params )
+        return [ row[0] for row in cur.fetchall() ]
+    finally:
+        cur.close()
+        conn.rollback()
+
+def bench_explain( args ):
+    import psycopg2
+    conn = psycopg2.connect( 'host={} user={} dbname={}'.format( args.dbhost, args.dbuser, args.dbname ) )
+    run_id1, run_id2 = args.run_ids
+    cur = conn.cursor()
+    cur.execute( "SELECT log_fname, log_line FROM log_line_probabilities WHERE run_id = %s LIMIT 1", ( run_id1, ) )
+    src_fname, src_line = cur.fetchone()
+    cur.close()
+    conn.rollback()
+
+    queries = [
+        ( "event probabilities", GET_EVENT_PROBS_QUERY, ( run_id1, ) ),
+        ( "run transitions", GET_RUN_TRANSITION_PROBS_QUERY, ( run_id1, ) ),
+        ( "node transitions", GET_TRANSITION_PROBS_QUERY, ( src_fname, src_line, run_id1 ) ),
+        ( "markov graph", GET_GRAPH_QUERY, ( run_id1, ) ),
+        ( "paired cdfs", PAIRED_CDF_QUERY, { "run_id1": run_id1, "run_id2": run_id2, "min_transition_count": 1000 } ) ]
+
+    print( "{:<20}\t{:<15}\t{:<15}".format( "Query", "No Index ms", "Index ms" ) )
+    print( "-"*50 )
+    for name, query, params in queries:
+        times = []
+        for use_indexes in [ False, True ]:
+            plan = explain_query( conn, query, params, use_indexes )
+            times.append( float( [ line for line in plan if line.lower().startswith( "execution time" ) ][0].split( ":" )[1].split()[0] ) )
+            if args.verbose:
+                print( "{} ({}):".format( name, "with indexes" if use_indexes else "without indexes" ) )
+                print( "\n".join( plan ) )
+        print( "{:<20}\t{:<15f}\t{:<15f}".format( name, times[0], times[1] ) )
+    conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser( description='benchmarks sentinel analysis kernels on synthetic data' )
+    subparsers = parser.add_subparsers( dest="benchmark" )
+    subparsers.required = True
+
+    emd_parser = subparsers.add_parser( 'emd', help="""compare the pyemd and closed_form EMD backends""" )
+    emd_parser.add_argument( '-n', type=int, action='store', help="""number of transitions""", dest="transitions", default=100000 )
+    emd_parser.add_argument( '-s', type=int, action='store', help="""random seed""", dest="seed", default=0 )
+    emd_parser.add_argument( '--normalize', action='store_true', help="""normalize CDFs before computing EMD""", dest="normalize" )
+    emd_parser.set_defaults( func=bench_emd )
+
+    parse_parser = subparsers.add_parser( 'parse', help="""compare parsing im dumps with readlines against streaming them""" )
+    parse_parser.add_argument( '-e', type=int, action='store', help="""number of events""", dest="events", default=5000 )
+    parse_parser.add_argument( '-n', type=int, action='store', help="""number of transitions""", dest="transitions", default=1000000 )
+    parse_parser.add_argument( '-k', type=int, action='store', help="""transition order""", dest="order", default=3 )
+    parse_parser.add_argument( '-s', type=int, action='store', help="""random seed""", dest="seed", default=0 )
+    parse_parser.set_defaults( func=bench_parse )
+
+    paths_parser = subparsers.add_parser( 'paths', help="""compare marking good paths with bounded_dfs against mark_good_paths on random DAGs and a cyclic graph""" )
+    paths_parser.add_argument( '-g', type=int, action='store', help="""number of graphs""", dest="graphs", default=100 )
+    paths_parser.add_argument( '-n', type=int, action='store', help="""maximum number of nodes per graph""", dest="nodes", default=24 )
+    paths_parser.add_argument( '-p', type=float, action='store', help="""probability of each edge""", dest="edge_prob", default=0.4 )
+    paths_parser.add_argument( '-c', type=float, action='store', help="""path probability cut off""", dest="cut_off", default=1E-5 )
+    paths_parser.add_argument( '-s', type=int, action='store', help="""random seed""", dest="seed", default=0 )
+    paths_parser.set_defaults( func=bench_paths )
+
+    depth_parser = subparsers.add_parser( 'depth', help="""compare finding depth_bounded_mcmc's terminal nodes by enumerating paths against expanding cached frontiers""" )
+    depth_parser.add_argument( '-n', type=int, action='store', help="""number of nodes""", dest="nodes", default=1000 )
+    depth_parser.add_argument( '-b', type=int, action='store', help="""number of transitions out of each node""", dest="branching", default=10 )
+    depth_parser.add_argument( '-k', type=int, action='store', help="""deepest depth to find terminal nodes at""", dest="depth", default=5 )
+    depth_parser.add_argument( '-s', type=int, action='store', help="""random seed""", dest="seed", default=0 )
+    depth_parser.set_defaults( func=bench_depth )
+
+    dump_parser = subparsers.add_parser( 'dump', help="""compare loading text and binary im dumps""" )
+    dump_parser.add_argument( '-e', type=int, action='store', help="""number of events""", dest="events", default=1000 )
+    dump_parser.add_argument( '-n', type=int, action='store', help="""number of transitions""", dest="transitions", default=20000 )
+    dump_parser.add_argument( '-r', type=int, action='store', help="""maximum reservoir size""", dest="reservoir_size", default=1000 )
+    dump_parser.add_argument( '-s', type=int, action='store', help="""random seed""", dest="seed", default=0 )
+    dump_parser.set_defaults( func=bench_dump )
+
+    load_parser = subparsers.add_parser( 'load', help="""compare loading a run with INSERT statements against COPY""" )
+    load_parser.add_argument( '-e', type=int, action='store', help="""number of events""", dest="events", default=5000 )
+    load_parser.add_argument( '-n', type=int, action='store', help="""number of transitions""", dest="transitions", default=200000 )
+    load_parser.add_argument( '-s', type=int, action='store', help="""random seed""", dest="seed", default=0 )
+    load_parser.add_argument( '-r', type=str, action='store', help="""DB Host Name""", dest="dbhost", default="localhost" )
+    load_parser.add_argument( '-d', type=str, action='store', help="""DB Name, to time loading into it as well as formatting""", dest="dbname", default=None )
+    load_parser.add_argument( '-u', type=str, action='store', help="""DB username""", dest="dbuser", default="postgres" )
+    load_parser.add_argument( '--run-id', type=int, action='store', help="""unused run ID to load under""", dest="run_id", default=999999 )
+    load_parser.set_defaults( func=bench_load )
+
+    explain_parser = subparsers.add_parser( 'explain', help="""compare the plans of the per-run queries with and without sent_schema.sql's indexes""" )
+    explain_parser.add_argument( '-r', type=str, action='store', help="""DB Host Name""", dest="dbhost", default="localhost" )
+    explain_parser.add_argument( '-d', type=str, action='store', help="""DB Name""", dest="dbname", default="sentdb" )
+    explain_parser.add_argument( '-u', type=str, action='store', help="""DB username""", dest="dbuser", default="postgres" )
+    explain_parser.add_argument( '-v', action='store_true', help="""print the full plans""", dest="verbose" )
+    explain_parser.add_argument( 'run_ids', type=int, nargs=2, action='store', help="""two loaded runs to query""" )
+    explain_parser.set_defaults( func=bench_explain )
+
+    args = parser.parse_args()
+    args.func( args )
@@ -0,0 +1,64 @@
+import numpy as np # type: ignore
+
+from typing import List, Dict
+
+# The binary im dump format written by im_trace.c when SENTINEL_BINARY_DUMP is set. See im_trace.h for the layout.
+# Kept apart from sentinel_analysis.py so that parse_im_dumps.py and merge_files.py only need numpy to read dumps.
+BINARY_DUMP_MAGIC = b"SNTLDMP1"
+BINARY_DUMP_VERSION = 1
+BINARY_DUMP_HEADER = np.dtype( [ ( 'magic', 'S8' ), ( 'version', np.uint32 ), ( 'num_columns', np.uint32 ),
+                                 ( 'num_events', np.uint64 ), ( 'num_transitions', np.uint64 ), ( 'num_reservoirs', np.uint64 ) ] )
+BINARY_DUMP_COLUMNS = [ ( 'event_ids', np.int32 ), ( 'line_numbers', np.int32 ), ( 'event_counts', np.uint64 ),
+                        ( 'fname_offsets', np.uint64 ), ( 'fname_data', np.uint8 ), ( 'transition_srcs', np.int32 ),
+                        ( 'transition_dsts', np.int32 ), ( 'transition_counts', np.uint64 ), ( 'reservoir_srcs', np.int32 ),
+                        ( 'reservoir_dsts', np.int32 ), ( 'reservoir_offsets', np.uint64 ), ( 'reservoir_values', np.float64 ) ]
+
+class BinaryIMDump:
+    """The columns of one binary im dump. Every column is a read-only view into the memory mapped file.
+    Event and transition ids are the tracer's per-thread slot numbers, as in the text dumps."""
+    def __init__( self, columns: Dict[str, np.ndarray] ):
+        self.event_ids = columns['event_ids']
+        self.line_numbers = columns['line_numbers']
+        self.event_counts = columns['event_counts']
+        self.fname_offsets = columns['fname_offsets']
+        self.fname_data = columns['fname_data']
+        self.transition_srcs = columns['transition_srcs']
+        self.transition_dsts = columns['transition_dsts']
+        self.transition_counts = columns['transition_counts']
+        self.reservoir_srcs = columns['reservoir_srcs']
+        self.reservoir_dsts = columns['reservoir_dsts']
+        self.reservoir_offsets = columns['reservoir_offsets']
+        self.reservoir_values = columns['reservoir_values']
+
+    def get_fnames( self ) -> List[str]:
+        """Decode the file name of every event, in event_ids order"""
+        fname_bytes = self.fname_data.tobytes()
+        offsets = self.fname_offsets.tolist()
+        return [ fname_bytes[ offsets[i]:offsets[i+1] ].decode() for i in range( len( self.event_ids ) ) ]
+
+    def get_reservoir( self, i: int ) -> np.ndarray:
+        """Get the sampled transition times of the i-th reservoir"""
+        return self.reservoir_values[ int( self.reservoir_offsets[i] ):int( self.reservoir_offsets[i+1] ) ]
+
+def is_binary_im_dump( filename: str ) -> bool:
+    with open( filename, "rb" ) as f:
+        return f.read( len( BINARY_DUMP_MAGIC ) ) == BINARY_DUMP_MAGIC
+
+def read_binary_im_dump( filename: str ) -> BinaryIMDump:
+    """Map a binary im dump into memory, without copying or parsing any of its columns"""
+    data = np.memmap( filename, dtype=np.uint8, mode="r" )
+    header = data[ :BINARY_DUMP_HEADER.itemsize ].view( BINARY_DUMP_HEADER )[0]
+    if header['magic'] != BINARY_DUMP_MAGIC:
+        raise ValueError( "{} is not a binary im dump".format( filename ) )
+    if header['version'] != BINARY_DUMP_VERSION or header['num_columns'] != len( BINARY_DUMP_COLUMNS ):
+        raise ValueError( "Unsupported binary im dump version {} in {}".format( header['version'], filename ) )
+
+    columns = {} # type: Dict[str, np.ndarray]
+    offset = BINARY_DUMP_HEADER.itemsize
+    for name, dtype in BINARY_DUMP_COLUMNS:
+        # Each column is prefixed by its length in bytes and padded to 8 bytes
+        nbytes = int( data[ offset:offset+8 ].view( np.uint64 )[0] )
+        offset += 8
+        columns[name] = data[ offset:offset+nbytes ].view( dtype )
+        offset += nbytes + ( -nbytes % 8 )
+    return BinaryIMDump( columns )
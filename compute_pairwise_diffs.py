@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import psycopg2
+import argparse
+import numpy as np
+from sentinel_analysis import *
+
+def write_matrix( fname: str, run_ids: List[int], matrix: np.ndarray ):
+    """Write an N x N matrix as CSV, with the run IDs as the header row and first column"""
+    with open( fname, "w" ) as f:
+        f.write( "run_id," + ",".join( str( run_id ) for run_id in run_ids ) + "\n" )
+        for run_id, row in zip( run_ids, matrix.tolist() ):
+            f.write( "{},".format( run_id ) + ",".join( repr( val ) for val in row ) + "\n" )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser( description='computes the aggregate differences and total EMDs between every pair of runs using sentinel' )
+    parser.add_argument( '-r', type=str, action='store', help="""DB Host Name""", dest="dbhost", default="localhost" )
+    parser.add_argument( '-d', type=str, action='store', help="""DB Name""", dest="dbname", default="sent_tmp" )
+    parser.add_argument( '-u', type=str, action='store', help="""DB username""", dest="dbuser", default="postgres" )
+    parser.add_argument( '-e', type=str, action='store', help="""EMD backend (pyemd or closed_form)""", dest="emd_backend", default="closed_form", choices=[ "pyemd", "closed_form" ] )
+    parser.add_argument( '-j', type=int, action='store', help="""the number of processes to compute EMDs with""", dest="procs", default=1 )
+    parser.add_argument( '-o', type=str, action='store', help="""prefix of the output files, <prefix>.agg.csv and <prefix>.emd.csv""", dest="out_prefix", default="pairwise" )
+    parser.add_argument( '--cache-dir', type=str, action='store', help="""directory to cache each run's events, transitions and CDFs in""", dest="cache_dir", default=os.path.expanduser( "~/.cache/sentinel" ) )
+    parser.add_argument( '--cache-size', type=int, action='store', help="""maximum size of the cache in MB, least recently used runs are evicted past it""", dest="cache_size", default=DEFAULT_RUN_MODEL_CACHE_BYTES >> 20 )
+    parser.add_argument( '--no-cache', action='store_false', help="""query every run from the database instead of the cache""", dest="use_cache" )
+
+    parser.add_argument( 'run_ids', type=int, nargs='+', action='store', help="""runs to compare""" )
+
+    args = parser.parse_args()
+    if len( set( args.run_ids ) ) != len( args.run_ids ):
+        parser.error( "run IDs must be unique" )
+
+    conn = psycopg2.connect( 'host={} user={} dbname={}'.format( args.dbhost, args.dbuser, args.dbname ) )
+
+    start = time.perf_counter()
+    if args.use_cache:
+        cache = RunModelCache( args.cache_dir, args.cache_size << 20 )
+        models = [ cache.get( conn, run_id ) for run_id in args.run_ids ]
+    else:
+        models = [ get_run_model_from_postgres( conn, run_id ) for run_id in args.run_ids ]
+    conn.close()
+    print( "Loading {} runs: {:.3f}s".format( len( models ), time.perf_counter() - start ), file=sys.stderr )
+
+    start = time.perf_counter()
+    agg_scores = compute_aggregate_score_matrix( models )
+    print( "Aggregate differences: {:.3f}s".format( time.perf_counter() - start ), file=sys.stderr )
+
+    start = time.perf_counter()
+    emd_totals = compute_emd_total_matrix( models, normalize=False, procs=args.procs, backend=args.emd_backend )
+    print( "EMD totals: {:.3f}s".format( time.perf_counter() - start ), file=sys.stderr )
+
+    write_matrix( args.out_prefix + ".agg.csv", args.run_ids, agg_scores )
+    write_matrix( args.out_prefix + ".emd.csv", args.run_ids, emd_totals )
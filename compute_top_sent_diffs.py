@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import os
 import sys
 import psycopg2
 import argparse
@@ -11,6 +12,11 @@ if __name__ == "__main__":
     parser.add_argument( '-r', type=str, action='store', help="""DB Host Name""", dest="dbhost", default="localhost" )
     parser.add_argument( '-d', type=str, action='store', help="""DB Name""", dest="dbname", default="sent_tmp" )
     parser.add_argument( '-u', type=str, action='store', help="""DB username""", dest="dbuser", default="postgres" )
+    parser.add_argument( '-e', type=str, action='store', help="""EMD backend (pyemd or closed_form)""", dest="emd_backend", default="closed_form", choices=[ "pyemd", "closed_form" ] )
+
+    parser.add_argument( '--cache-dir', type=str, action='store', help="""directory to cache each run's events, transitions and CDFs in""", dest="cache_dir", default=os.path.expanduser( "~/.cache/sentinel" ) )
+    parser.add_argument( '--cache-size', type=int, action='store', help="""maximum size of the cache in MB, least recently used runs are evicted past it""", dest="cache_size", default=DEFAULT_RUN_MODEL_CACHE_BYTES >> 20 )
+    parser.add_argument( '--no-cache', action='store_false', help="""query every run from the database instead of the cache""", dest="use_cache" )
 
     parser.add_argument( 'runid1', type=str, action='store', help="""First run"""  )
     parser.add_argument( 'runid2', type=str, action='store', help="""Second run""" )
@@ -19,15 +25,25 @@ if __name__ == "__main__":
 
     conn = psycopg2.connect( 'host={} user={} dbname={}'.format( args.dbhost, args.dbuser, args.dbname ) )
 
-    events1, event_transitions1 = get_data_from_postgres( conn, args.runid1 )
-    events2, event_transitions2 = get_data_from_postgres( conn, args.runid2 )
-
-    agg_score, prob_diffs, raw_trans_diffs, score_diffs = compute_difference( events1, event_transitions1, events2, event_transitions2 )
+    if args.use_cache:
+        cache = RunModelCache( args.cache_dir, args.cache_size << 20 )
+        model1 = cache.get( conn, int( args.runid1 ) )
+        model2 = cache.get( conn, int( args.runid2 ) )
+        events1, event_transitions1 = model1.get_data()
+        events2, event_transitions2 = model2.get_data()
+    else:
+        events1, event_transitions1 = get_data_from_postgres( conn, args.runid1 )
+        events2, event_transitions2 = get_data_from_postgres( conn, args.runid2 )
+
+    agg_score, prob_diffs, raw_trans_diffs, score_diffs = compute_difference( events1, event_transitions1, events2, event_transitions2, top_k=args.topkcount )
     pretty_print_differences( agg_score, prob_diffs, raw_trans_diffs, score_diffs, args.topkcount )
 
 
     print( "\nTop EMD Differences:\n" )
-    emd_scores = get_emd_scores_for_transitions( conn, args.runid1, args.runid2, normalize=False, procs=1 )
+    if args.use_cache:
+        emd_scores = get_emd_scores_for_run_models( model1, model2, normalize=False, procs=1, backend=args.emd_backend )
+    else:
+        emd_scores = get_emd_scores_for_transitions( conn, args.runid1, args.runid2, normalize=False, procs=1, backend=args.emd_backend )
     emd_scores.sort( key=lambda x: x[0], reverse=True )
     for i in range( min( len(emd_scores), args.topkcount) ):
         print( emd_scores[i] )
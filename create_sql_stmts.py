@@ -1,6 +1,34 @@
+#!/usr/bin/env python3
+
+import os
 import glob
 import math
 import sys
+import argparse
+
+# The columns each table is loaded with, in the order the row generators produce them
+COPY_COLUMNS = {
+    "log_line_probabilities": [ "run_id", "iteration_number", "log_fname", "log_line", "log_count", "log_probability" ],
+    "log_line_transitions": [ "run_id", "iteration_number", "log_initial_fname", "log_initial_line", "log_next_fname", "log_next_line", "transition_count", "transition_probability" ],
+    "transition_cdfs": [ "run_id", "iteration_number", "src_fname", "src_line", "dst_fname", "dst_line", "percentiles", "percentile_values" ],
+}
+
+# Create the run's partition of each table that sent_schema_partitioned.sql has partitioned by run_id,
+# and do nothing for unpartitioned tables
+CREATE_RUN_PARTITIONS_STMT = """DO $$
+DECLARE
+    t text;
+BEGIN
+    FOREACH t IN ARRAY ARRAY[ {tables} ] LOOP
+        IF EXISTS ( SELECT 1 FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+                    WHERE n.nspname = 'public' AND c.relname = t AND c.relkind = 'p' ) THEN
+            EXECUTE format( 'CREATE TABLE IF NOT EXISTS public.%I PARTITION OF public.%I FOR VALUES IN ( {run_id} )', t || '_{run_id}', t );
+        END IF;
+    END LOOP;
+END $$;"""
+
+def get_create_run_partitions_stmt( run_id: int ) -> str:
+    return CREATE_RUN_PARTITIONS_STMT.format( tables=", ".join( "'{}'".format( table ) for table in COPY_COLUMNS ), run_id=int( run_id ) )
 
 def list_to_array_syntax( l ):
     """Convert a python list to PGSQL array syntax for insertion"""
@@ -8,80 +36,198 @@ def list_to_array_syntax( l ):
     l_text = "'{" + l_text[1:-1] + "}'"
     return l_text
 
+def read_out_lines( fname: str ):
+    """Read parse_im_dumps.py output into a map from "fname:line" events to their frequencies and a list of
+    (from_event, to_event, frequency) transitions"""
+    with open( fname, "r" ) as f:
+        lines = [ l.strip() for l in f.readlines() ]
 
-lines = []
-with open( "out_lines.txt", "r" ) as f:
-    lines = [ l.strip() for l in f.readlines() ]
+    event_map = {}
+    line_number = 0
+    # Phase 1: Get the frequency
+    while line_number < len( lines ):
+        line = lines[ line_number ]
+        if line == "---":
+            line_number += 1
+            break
 
+        split_line = line.split(" ")
+        event = split_line[0]
+        freq = int(split_line[-1])
+        event_map[ event ] = freq
 
-total_event_count = 0
-event_map = {}
-line_number = 0
-run_id = int(sys.argv[1])
-# Phase 1: Get the frequency
-while line_number < len( lines ):
-    line = lines[ line_number ]
-    if line == "---":
         line_number += 1
-        break
-
-    split_line = line.split(" ")
-    event = split_line[0]
-    freq = int(split_line[-1])
-    event_msg = " ".join( split_line[1:-1] )
 
-    total_event_count += freq
-    event_map[ event ] = freq
-
-    line_number += 1
+    # Phase 2: Get the transitions
+    transitions = []
+    while line_number < len( lines ):
+        from_event, to_event, freq = lines[ line_number ].split( " " )
+        transitions.append( ( from_event, to_event, int( freq ) ) )
+        line_number += 1
 
-sql_str = "INSERT INTO run_identifier VALUES ( {}, NOW() );".format( run_id )
-print( sql_str )
-sql_str = "INSERT INTO exp_iterations VALUES ( {}, 0 );".format( run_id )
-print( sql_str )
+    return event_map, transitions
+
+def read_ln_files( ln_glob: str ):
+    """Yield (src_event, dst_event, percentiles, percentile_values) for each .ln percentile file merge_files.py wrote,
+    undoing the log of the values"""
+    for fname in glob.glob( ln_glob ):
+        lines = []
+        with open( fname, "r" ) as f:
+            lines = [ l.strip() for l in f.readlines() ]
+        ptls = []
+        vals = []
+        for line in lines:
+            ptl,val = line.split(",")
+            ptls.append( float(ptl) )
+            vals.append( math.exp(float(val)) )
+        fname_chunks = os.path.basename( fname ).split("-")
+        yield fname_chunks[2], fname_chunks[3], ptls, vals
+
+def get_probability_rows( run_id: int, event_map: dict ):
+    """Yield the log_line_probabilities rows of a run"""
+    total_event_count = sum( event_map.values() )
+    for event, freq in event_map.items():
+        event_file, event_line = event.split(":")
+        yield ( run_id, 0, event_file, event_line, freq, float(freq)/total_event_count )
+
+def get_transition_rows( run_id: int, event_map: dict, transitions ):
+    """Yield the log_line_transitions rows of a run"""
+    for from_event, to_event, freq in transitions:
+        from_event_file, from_event_line = from_event.split(":")
+        to_event_file, to_event_line = to_event.split(":")
+        yield ( run_id, 0, from_event_file, from_event_line, to_event_file, to_event_line, freq, float(freq) / event_map[ from_event ] )
+
+def get_cdf_rows( run_id: int, cdfs ):
+    """Yield the transition_cdfs rows of a run"""
+    for src_id, dst_id, ptls, vals in cdfs:
+        src_fname, src_ln = src_id.split(":")
+        dst_fname, dst_ln = dst_id.split(":")
+        yield ( run_id, 0, src_fname, src_ln, dst_fname, dst_ln, ptls, vals )
+
+def get_table_rows( run_id: int, event_map: dict, transitions, cdfs ):
+    """Map each loaded table to the generator of its rows"""
+    return {
+        "log_line_probabilities": get_probability_rows( run_id, event_map ),
+        "log_line_transitions": get_transition_rows( run_id, event_map, transitions ),
+        "transition_cdfs": get_cdf_rows( run_id, cdfs ),
+    }
+
+def print_insert_stmts( run_id: int, event_map: dict, transitions, cdfs, out=sys.stdout ):
+    """Print one INSERT statement per row of the run"""
+    sql_str = "INSERT INTO run_identifier VALUES ( {}, NOW() );".format( run_id )
+    print( sql_str, file=out )
+    sql_str = "INSERT INTO exp_iterations VALUES ( {}, 0 );".format( run_id )
+    print( sql_str, file=out )
+    print( get_create_run_partitions_stmt( run_id ), file=out )
 
-for event, freq in event_map.items():
-    event_prob = float(freq)/total_event_count
     sql_str = "INSERT INTO log_line_probabilities( run_id, iteration_number, log_fname, log_line, log_count, log_probability ) VALUES( {}, {}, {}, {}, {}, {} ) ON CONFLICT DO NOTHING;"
-    event_file, event_line = event.split(":")
-    formatted_sql_str = sql_str.format( run_id, 0, "'" + event_file + "'" , event_line, freq, event_prob )
-    print( formatted_sql_str )
-    
-
-# Phase 2: Get the transitions
-while line_number < len( lines ):
-    line = lines[ line_number ]
-    from_event, to_event, freq = line.split( " " )
-    from_event_file, from_event_line = from_event.split(":")
-    to_event_file, to_event_line = to_event.split(":")
-    transition_prob = float(freq) / event_map[ from_event ]
-    sql_str = "INSERT INTO log_line_transitions( run_id, iteration_number, log_initial_fname, log_initial_line, log_next_fname, log_next_line, transition_count, transition_probability ) VALUES( {}, {}, {}, {}, {}, {}, {}, {} ) ON CONFLICT DO NOTHING;"
-    formatted_sql_str = sql_str.format( run_id, 0, "'" + from_event_file + "'", from_event_line, "'" + to_event_file + "'", to_event_line, freq, transition_prob )
-    print( formatted_sql_str )
+    for run_id, iteration_number, event_file, event_line, freq, event_prob in get_probability_rows( run_id, event_map ):
+        print( sql_str.format( run_id, iteration_number, "'" + event_file + "'" , event_line, freq, event_prob ), file=out )
 
-    line_number += 1
-
-
-for fname in glob.glob("/tmp/*.ln"):
-    lines = []
-    with open( fname, "r" ) as f:
-        lines = [ l.strip() for l in f.readlines() ]
-    ptls = []
-    vals = []
-    for line in lines:
-        ptl,val = line.split(",")
-        ptls.append( float(ptl) )
-        vals.append( math.exp(float(val)) )
-    fname_chunks = fname.split("/")[-1]
-    fname_chunks = fname_chunks.split("-")
-    src_id = fname_chunks[2]
-    src_fname, src_ln = src_id.split(":")
-    src_fname = "'" + src_fname + "'"
-    dst_id = fname_chunks[3]
-    dst_fname, dst_ln = dst_id.split(":")
-    dst_fname = "'" + dst_fname + "'"
+    sql_str = "INSERT INTO log_line_transitions( run_id, iteration_number, log_initial_fname, log_initial_line, log_next_fname, log_next_line, transition_count, transition_probability ) VALUES( {}, {}, {}, {}, {}, {}, {}, {} ) ON CONFLICT DO NOTHING;"
+    for run_id, iteration_number, from_event_file, from_event_line, to_event_file, to_event_line, freq, transition_prob in get_transition_rows( run_id, event_map, transitions ):
+        print( sql_str.format( run_id, iteration_number, "'" + from_event_file + "'", from_event_line, "'" + to_event_file + "'", to_event_line, freq, transition_prob ), file=out )
 
     sql_stmt = "INSERT INTO transition_cdfs( run_id, iteration_number, src_fname, src_line, dst_fname, dst_line, percentiles, percentile_values ) VALUES( {}, {}, {}, {}, {}, {}, {}, {} );"
-
-    formatted_sql_stmt = sql_stmt.format( run_id, 0, src_fname, src_ln, dst_fname, dst_ln, list_to_array_syntax( ptls ), list_to_array_syntax( vals ) )
-    print( formatted_sql_stmt )
+    for run_id, iteration_number, src_fname, src_ln, dst_fname, dst_ln, ptls, vals in get_cdf_rows( run_id, cdfs ):
+        print( sql_stmt.format( run_id, iteration_number, "'" + src_fname + "'", src_ln, "'" + dst_fname + "'", dst_ln, list_to_array_syntax( ptls ), list_to_array_syntax( vals ) ), file=out )
+
+def format_copy_value( value ) -> str:
+    """Format a value in COPY's text format"""
+    if value is None:
+        return "\\N"
+    if isinstance( value, list ):
+        return "{" + ",".join( map( repr, value ) ) + "}"
+    if isinstance( value, float ):
+        return repr( value )
+    return str( value ).replace( "\\", "\\\\" ).replace( "\t", "\\t" ).replace( "\n", "\\n" )
+
+def get_copy_lines( rows ):
+    """Yield the rows as lines of COPY's text format"""
+    for row in rows:
+        yield "\t".join( format_copy_value( value ) for value in row ) + "\n"
+
+class CopyStream:
+    """A read-only file over the COPY text of rows, so that copy_expert can stream rows as they are generated
+    instead of having them all formatted in memory first"""
+    def __init__( self, rows ):
+        self.lines = get_copy_lines( rows )
+        self.buf = ""
+
+    def read( self, size=-1 ) -> str:
+        chunks = [ self.buf ]
+        buffered = len( self.buf )
+        while size < 0 or buffered < size:
+            line = next( self.lines, None )
+            if line is None:
+                break
+            chunks.append( line )
+            buffered += len( line )
+        data = "".join( chunks )
+        if size < 0:
+            self.buf = ""
+            return data
+        self.buf = data[size:]
+        return data[:size]
+
+def get_copy_stmt( table: str ) -> str:
+    return "COPY {}( {} ) FROM STDIN".format( table, ", ".join( COPY_COLUMNS[table] ) )
+
+def write_copy_files( copy_dir: str, run_id: int, table_rows: dict ):
+    """Write each table's rows to <table>.copy in copy_dir, with a load.sql that loads them in one transaction through psql"""
+    os.makedirs( copy_dir, exist_ok=True )
+    with open( os.path.join( copy_dir, "load.sql" ), "w" ) as load_f:
+        load_f.write( "BEGIN;\n" )
+        load_f.write( "INSERT INTO run_identifier VALUES ( {}, NOW() );\n".format( run_id ) )
+        load_f.write( "INSERT INTO exp_iterations VALUES ( {}, 0 );\n".format( run_id ) )
+        load_f.write( get_create_run_partitions_stmt( run_id ) + "\n" )
+        for table, rows in table_rows.items():
+            copy_fname = "{}.copy".format( table )
+            with open( os.path.join( copy_dir, copy_fname ), "w" ) as f:
+                f.writelines( get_copy_lines( rows ) )
+            # \copy reads the file client side, so paths are relative to where psql runs
+            load_f.write( "\\copy {}( {} ) FROM '{}'\n".format( table, ", ".join( COPY_COLUMNS[table] ), copy_fname ) )
+        load_f.write( "COMMIT;\n" )
+
+def copy_into_db( conn, run_id: int, table_rows: dict, commit=True ):
+    """Stream each table's rows into conn with COPY FROM STDIN. The run is loaded in one transaction, so a failed
+    load leaves nothing behind, and it goes into its own partitions if the tables are partitioned by run_id.
+    If commit is not set, the transaction is left open for the caller to finish."""
+    cur = conn.cursor()
+    try:
+        cur.execute( "INSERT INTO run_identifier VALUES ( %s, NOW() )", ( run_id, ) )
+        cur.execute( "INSERT INTO exp_iterations VALUES ( %s, 0 )", ( run_id, ) )
+        cur.execute( get_create_run_partitions_stmt( run_id ) )
+        for table, rows in table_rows.items():
+            cur.copy_expert( get_copy_stmt( table ), CopyStream( rows ) )
+        if commit:
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser( description='converts the output of parse_im_dumps.py and merge_files.py into SQL statements for a run, or loads it directly with COPY' )
+    parser.add_argument( '-i', type=str, action='store', help="""parse_im_dumps.py output""", dest="out_lines", default="out_lines.txt" )
+    parser.add_argument( '-l', type=str, action='store', help="""glob of the .ln percentile files""", dest="ln_glob", default="/tmp/*.ln" )
+    parser.add_argument( '--copy-dir', type=str, action='store', help="""write COPY files and a load.sql script to this directory instead of INSERT statements""", dest="copy_dir", default=None )
+    parser.add_argument( '-r', type=str, action='store', help="""DB Host Name""", dest="dbhost", default="localhost" )
+    parser.add_argument( '-d', type=str, action='store', help="""DB Name, to COPY the run straight into it instead of printing INSERT statements""", dest="dbname", default=None )
+    parser.add_argument( '-u', type=str, action='store', help="""DB username""", dest="dbuser", default="postgres" )
+    parser.add_argument( 'run_id', type=int, action='store', help="""run ID to store the results under""" )
+    args = parser.parse_args()
+
+    event_map, transitions = read_out_lines( args.out_lines )
+    cdfs = read_ln_files( args.ln_glob )
+
+    if args.dbname is not None:
+        import psycopg2
+        conn = psycopg2.connect( 'host={} user={} dbname={}'.format( args.dbhost, args.dbuser, args.dbname ) )
+        copy_into_db( conn, args.run_id, get_table_rows( args.run_id, event_map, transitions, cdfs ) )
+        conn.close()
+    elif args.copy_dir is not None:
+        write_copy_files( args.copy_dir, args.run_id, get_table_rows( args.run_id, event_map, transitions, cdfs ) )
+    else:
+        print_insert_stmts( args.run_id, event_map, transitions, cdfs )
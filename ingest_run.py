@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+import math
+import argparse
+from parse_im_dumps import read_all_im_dumps
+from merge_files import PERCENTILES_TO_WRITE, StageTimer, group_flat_files, group_binary_dump_reservoirs, \
+    get_reservoir_transitions, get_reservoir_batches, get_reservoir_batch_percentiles, map_batches
+import create_sql_stmts
+
+def get_run_events( log_dir: str, procs=1 ):
+    """Parse and merge the dumps in log_dir into a map from "fname:line" events to their frequencies and a list of
+    (from_event, to_event, frequency) transitions, as create_sql_stmts.read_out_lines reads them from parse_im_dumps.py's output"""
+    merged_summaries = read_all_im_dumps( log_dir, procs )
+    event_map = { str( loc ): merged_summaries.event_count_map[loc] for loc in merged_summaries.known_locs }
+    transitions = [ ( str( loc ), str( loc2 ), count ) for loc, dst_map in merged_summaries.event_transition_map.items() for loc2, count in dst_map.items() ]
+    return event_map, transitions
+
+def get_run_cdfs( log_dir: str, jobs=1 ):
+    """Compute the CDF of every transition's times in log_dir's flat files and binary dump reservoirs, as
+    create_sql_stmts.read_ln_files reads them from merge_files.py's .ln files"""
+    transitions = get_reservoir_transitions( group_flat_files( log_dir ), group_binary_dump_reservoirs( log_dir ) )
+    batches = get_reservoir_batches( transitions, jobs )
+    ptls = list( PERCENTILES_TO_WRITE )
+    cdfs = []
+    transitions_iter = iter( transitions )
+    for percentiles, messages in map_batches( get_reservoir_batch_percentiles, batches, jobs ):
+        for message in messages:
+            print( message )
+        for transition_percentiles, ( f_name_prefix, flat_files, reservoirs ) in zip( percentiles, transitions_iter ):
+            # Only the log percentiles are loaded, with their logs undone
+            if transition_percentiles is None or transition_percentiles[1] is None:
+                continue
+            src_loc, dst_loc = f_name_prefix.split( "-" )[2:4]
+            cdfs.append( ( src_loc, dst_loc, ptls, [ math.exp( val ) for val in transition_percentiles[1].tolist() ] ) )
+    return cdfs
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser( description='ingests the tracing Sentinel dumped for a run straight into sentdb, without intermediate files' )
+    parser.add_argument( '-l', type=str, action='store', help="""the directory Sentinel dumped its tracing to""", dest="log_dir", default="/tmp" )
+    parser.add_argument( '-j', type=int, action='store', help="""the number of processes to parse dumps and compute percentiles with""", dest="jobs", default=1 )
+    parser.add_argument( '-r', type=str, action='store', help="""DB Host Name""", dest="dbhost", default="localhost" )
+    parser.add_argument( '-d', type=str, action='store', help="""DB Name""", dest="dbname", default="sentdb" )
+    parser.add_argument( '-u', type=str, action='store', help="""DB username""", dest="dbuser", default="postgres" )
+    parser.add_argument( '--copy-dir', type=str, action='store', help="""write COPY files and a load.sql script to this directory instead of loading the run""", dest="copy_dir", default=None )
+    parser.add_argument( 'run_id', type=int, action='store', help="""run ID to store the results under""" )
+    args = parser.parse_args()
+
+    timer = StageTimer()
+    event_map, transitions = get_run_events( args.log_dir, args.jobs )
+    timer.end_stage( "Parsing dumps" )
+    cdfs = get_run_cdfs( args.log_dir, args.jobs )
+    timer.end_stage( "Computing percentiles" )
+
+    table_rows = create_sql_stmts.get_table_rows( args.run_id, event_map, transitions, cdfs )
+    if args.copy_dir is not None:
+        create_sql_stmts.write_copy_files( args.copy_dir, args.run_id, table_rows )
+        timer.end_stage( "Writing COPY files" )
+    else:
+        import psycopg2
+        conn = psycopg2.connect( 'host={} user={} dbname={}'.format( args.dbhost, args.dbuser, args.dbname ) )
+        create_sql_stmts.copy_into_db( conn, args.run_id, table_rows )
+        conn.close()
+        timer.end_stage( "Loading" )
+    timer.end()
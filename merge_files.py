@@ -1,53 +1,107 @@
+import os
+import stat
 import glob
 import logging
-import subprocess
-import sys
+import argparse
+import multiprocessing
+import time
 import math
 import numpy as np
+from binary_im_dump import is_binary_im_dump, read_binary_im_dump
 
-def compute_flat_file_percentiles(l_files: list):
-    all_percentiles = []
-    all_ln_percentiles = []
-    for filename in l_files:
-        with open( filename, 'r' ) as f:
-            for line in f:
-                try:
-                    all_percentiles.append( float(line.strip()) )
-                    all_ln_percentiles.append( math.log( float(line.strip() ) ) )
-                except:
-                    print( "Problem with file: {}".format( filename ) )
-
-    arr = np.array( all_percentiles )
-    arr2 = np.array( all_ln_percentiles )
-    percentiles = [ 5,10,15,20,25,30,35,40,45,50,55,60,65,70,75,80,85,90,95,99,99.9 ]
-    percentiles_to_write = [ 0.05,0.1,0.15,0.2,0.25,0.3,0.35,0.4,0.45,0.5,0.55,0.6,0.65,0.7,0.75,0.8,0.85,0.9,0.95,0.99,0.999 ]
-    try:
-        ptl_values = np.percentile( arr, percentiles )
-        ptl_ln_values = np.percentile( arr2, percentiles )
+PERCENTILES = [ 5,10,15,20,25,30,35,40,45,50,55,60,65,70,75,80,85,90,95,99,99.9 ]
+PERCENTILES_TO_WRITE = [ 0.05,0.1,0.15,0.2,0.25,0.3,0.35,0.4,0.45,0.5,0.55,0.6,0.65,0.7,0.75,0.8,0.85,0.9,0.95,0.99,0.999 ]
 
-        f_name = l_files[0]
-        if "/" in f_name:
-            f_name = f_name.split("/")[-1]
-        # event_flat_thing_thing
-        f_name_all_str = '-'.join( f_name.split("-")[:4] ) + "-cdf-values.csv"
+# The number of transitions whose percentiles are computed together in one batch
+BATCH_SIZE = 4096
 
-        with open(f_name_all_str, 'w+') as f:
-            for i in range(len(ptl_values)):
-                f.write( "{},{}\n".format( percentiles_to_write[i], ptl_values[i] ) )
+def write_percentile_files( f_name_prefix: str, ptl_values, ptl_ln_values ):
+    """Write the percentile values and log percentile values of one transition to its .csv and .csv.ln files,
+    each in a single write. If ptl_ln_values is None, no .csv.ln file is written."""
+    with open( f_name_prefix + "-cdf-values.csv", 'w+' ) as f:
+        f.write( "".join( "{},{}\n".format( pctl, val ) for pctl, val in zip( PERCENTILES_TO_WRITE, ptl_values.tolist() ) ) )
 
-        f_name_all_str = l_files[0].split("/")[-1]
-        f_name_all_str = '-'.join( f_name_all_str.split("-")[:4] ) + "-cdf-values.csv.ln"
+    if ptl_ln_values is not None:
+        with open( f_name_prefix + "-cdf-values.csv.ln", 'w+' ) as f:
+            f.write( "".join( "{},{}\n".format( pctl, val ) for pctl, val in zip( PERCENTILES_TO_WRITE, ptl_ln_values.tolist() ) ) )
 
-        with open(f_name_all_str, 'w+') as f:
-            for i in range(len(ptl_ln_values)):
-                f.write( "{},{}\n".format( percentiles_to_write[i], ptl_ln_values[i] ) )
-    except Exception as e:
-        print( "ERROR.")
-        print( "Computing flat file percentiles over {} failed.".format(  l_files ) )
-        print( all_percentiles )
-        print( all_ln_percentiles )
-        raise( e )
-        
+def sort_segments( values: np.ndarray, offsets: np.ndarray ) -> np.ndarray:
+    """Sort each segment values[offsets[i]:offsets[i+1]] in place of the others, in one sort"""
+    segment_ids = np.repeat( np.arange( len( offsets ) - 1 ), np.diff( offsets ) )
+    return values[ np.lexsort( ( values, segment_ids ) ) ]
+
+def segmented_percentiles( sorted_values: np.ndarray, offsets: np.ndarray, percentiles: list ) -> np.ndarray:
+    """Compute the percentiles of every sorted segment sorted_values[offsets[i]:offsets[i+1]] at once, as a
+    (num segments, num percentiles) array. Uses the same linear interpolation as np.percentile, and so gives the
+    same values. Empty segments get NaN."""
+    counts = np.diff( offsets )
+    starts = offsets[:-1]
+    nonempty = counts > 0
+    positions = ( np.maximum( counts, 1 ) - 1 )[:, None] * ( np.asarray( percentiles, dtype=np.float64 ) / 100. )[None, :]
+    lower = np.floor( positions ).astype( np.int64 )
+    upper = np.minimum( lower + 1, np.maximum( counts, 1 )[:, None] - 1 )
+    frac = positions - lower
+    if len( sorted_values ) == 0:
+        return np.full( positions.shape, np.nan )
+    lower_vals = sorted_values[ np.minimum( starts[:, None] + lower, len( sorted_values ) - 1 ) ]
+    upper_vals = sorted_values[ np.minimum( starts[:, None] + upper, len( sorted_values ) - 1 ) ]
+    diff = upper_vals - lower_vals
+    # np.percentile's interpolation, which measures from the nearer of the two values
+    ptl_values = np.where( frac >= 0.5, upper_vals - diff * ( 1 - frac ), lower_vals + diff * frac )
+    ptl_values[ ~nonempty ] = np.nan
+    return ptl_values
+
+def get_transition_percentiles( f_name_prefixes: list, values: np.ndarray, offsets: np.ndarray ) -> tuple:
+    """Compute the percentiles and log percentiles of a batch of transitions, where transition i's times
+    are values[offsets[i]:offsets[i+1]]. Non-positive times have no log, so they are left out of the log percentiles.
+    Returns a list of each transition's (percentile values, log percentile values), None for a transition without
+    times and None for the log percentile values of one without positive times, and the messages about the batch
+    to print, so that batches run in other processes can be reported in order."""
+    offsets = np.asarray( offsets, dtype=np.int64 )
+    sorted_values = sort_segments( np.asarray( values, dtype=np.float64 ), offsets )
+    ptl_values = segmented_percentiles( sorted_values, offsets, PERCENTILES )
+
+    # Sorting keeps each segment's positive values contiguous and in order, and so does taking logs
+    positive = sorted_values > 0
+    positive_offsets = np.concatenate( [ [0], np.cumsum( positive ) ] )[ offsets ]
+    ptl_ln_values = segmented_percentiles( np.log( sorted_values[ positive ] ), positive_offsets, PERCENTILES )
+
+    percentiles = []
+    messages = []
+    counts = np.diff( offsets ).tolist()
+    positive_counts = np.diff( positive_offsets ).tolist()
+    for i, f_name_prefix in enumerate( f_name_prefixes ):
+        if counts[i] == 0:
+            messages.append( "No transition times for {}, skipping.".format( f_name_prefix ) )
+            percentiles.append( None )
+            continue
+        if positive_counts[i] < counts[i]:
+            messages.append( "WARNING: {} of {} transition times for {} are not positive, leaving them out of the log percentiles.".format(
+                counts[i] - positive_counts[i], counts[i], f_name_prefix ) )
+        percentiles.append( ( ptl_values[i], ptl_ln_values[i] if positive_counts[i] > 0 else None ) )
+    return percentiles, messages
+
+def compute_transition_percentiles( f_name_prefixes: list, values: np.ndarray, offsets: np.ndarray ) -> list:
+    """Compute and write the percentiles and log percentiles of a batch of transitions, as get_transition_percentiles
+    does. If a transition has no positive times, its .csv.ln file is not written. Returns the messages about the batch."""
+    percentiles, messages = get_transition_percentiles( f_name_prefixes, values, offsets )
+    for f_name_prefix, transition_percentiles in zip( f_name_prefixes, percentiles ):
+        if transition_percentiles is not None:
+            write_percentile_files( f_name_prefix, *transition_percentiles )
+    return messages
+
+def concatenate_reservoirs( reservoirs: list ) -> tuple:
+    """Concatenate a batch of transitions' times, where reservoirs[i] is a list of arrays of transition i's times,
+    into values and the offsets of each transition's times in them"""
+    values = [ reservoir for transition_reservoirs in reservoirs for reservoir in transition_reservoirs ]
+    counts = [ sum( len( reservoir ) for reservoir in transition_reservoirs ) for transition_reservoirs in reservoirs ]
+    offsets = np.concatenate( [ [0], np.cumsum( counts ) ] )
+    return np.concatenate( values ) if values else np.zeros( 0 ), offsets
+
+def compute_reservoir_percentiles( f_name_prefixes: list, reservoirs: list ) -> list:
+    """Compute and write the percentiles of a batch of transitions, where reservoirs[i] is a list of arrays
+    of transition i's times"""
+    return compute_transition_percentiles( f_name_prefixes, *concatenate_reservoirs( reservoirs ) )
 
 def merge_files(l_files: list, flat_files: list):
         assert False
@@ -132,77 +186,289 @@ def merge_files(l_files: list, flat_files: list):
                 f.write(str('{}'.format(log_moments[i])) + "\n")
 
 
-if __name__ == "__main__":
-
-    # Here, we need to check if the files are "flat" or sketch files.
-    # For each event -> event, if one of them is a sketch than we must take all other
-    # flat files and merge them into the sketch.
-    # If they are all flat, then we can just merge them all together to compute the percentiles, no need to
-    # to use the sketch library
-    # Output should be merged sketch files or percentile files.
-    sketchList = None
-    flatlist = None
+def make_readable( filename: str ):
+    """The equivalent of chmod +r"""
+    os.chmod( filename, os.stat( filename ).st_mode | stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH )
 
-    if len(sys.argv) < 2:
-        print( "Not enough args to create_cdfs.sh!")
-        print( "{} logdir".format( sys.argv[0] ) )
-        sys.exit( 1 )
+def get_flat_file_transition( filename: str ) -> tuple:
+    """Get the (src_loc, dst_loc) of a flat file named like event-flat-src_loc-dst_loc-pid-tid-im"""
+    f_split = filename.split("/")[-1].split('-')
+    return f_split[2], f_split[3]
 
-    sketchList = glob.glob("{}/event-sketch*".format( sys.argv[1] ) )
-    flatList = glob.glob( "{}/event-flat*".format( sys.argv[1]) )
-    d_sketches = {}
+def group_flat_files( log_dir: str ) -> dict:
+    """Group the flat files in log_dir into a map from src_loc -> dst_loc -> [flat files]"""
     d_flats = {}
-    assert not sketchList
-
-    #for f in sketchList:
-    #    subprocess.run(["chmod", "+r", f])
-    #    f_split = f.split('-')
-    #    try:
-    #        src_loc = f_split[2]
-    #        dst_loc = f_split[3]
-    #        if src_loc not in d_sketches:
-    #            d_sketches[src_loc] = {}
-#
-#            if dst_loc not in d_sketches[src_loc]:
-#                d_sketches[src_loc][dst_loc] = [f]
-#            else:
-#                d_sketches[src_loc][dst_loc].append( f )
-#
-#        except Exception as e:
-#            logging.INFO(e)
-#            continue
-
-    for f in flatList:
-        subprocess.run(["chmod", "+r", f])
-        if "/" in f:
-            f_name = f.split("/")[-1]
-        else:
-            fname = f
-
-        f_split = f_name.split('-')
+    for f in glob.glob( "{}/event-flat*".format( log_dir ) ):
+        make_readable( f )
         try:
-            src_loc = f_split[2]
-            dst_loc = f_split[3]
-            if src_loc not in d_flats:
-                d_flats[src_loc] = {}
+            src_loc, dst_loc = get_flat_file_transition( f )
+        except Exception as e:
+            logging.info(e)
+            continue
+        if src_loc not in d_flats:
+            d_flats[src_loc] = {}
+        if dst_loc not in d_flats[src_loc]:
+            d_flats[src_loc][dst_loc] = [ f ]
+        else:
+            d_flats[src_loc][dst_loc].append( f )
+    return d_flats
 
-            if dst_loc not in d_flats[src_loc]:
-                d_flats[src_loc][dst_loc] = [ f ]
+def group_binary_dump_reservoirs( log_dir: str ) -> dict:
+    """Group the reservoirs in the binary dumps in log_dir into a map from src_loc -> dst_loc -> [reservoir value arrays]"""
+    d_reservoirs = {}
+    for f in glob.glob( "{}/*.im.out*".format( log_dir ) ):
+        if not is_binary_im_dump( f ):
+            continue
+        im_dump = read_binary_im_dump( f )
+        event_locs = {}
+        for event_id, fname, line_number in zip( im_dump.event_ids.tolist(), im_dump.get_fnames(), im_dump.line_numbers.tolist() ):
+            event_locs[event_id] = "{}:{}".format( fname, line_number )
+        for i, ( src_id, dst_id ) in enumerate( zip( im_dump.reservoir_srcs.tolist(), im_dump.reservoir_dsts.tolist() ) ):
+            src_loc = event_locs[src_id]
+            dst_loc = event_locs[dst_id]
+            if src_loc not in d_reservoirs:
+                d_reservoirs[src_loc] = {}
+            if dst_loc not in d_reservoirs[src_loc]:
+                d_reservoirs[src_loc][dst_loc] = [ im_dump.get_reservoir( i ) ]
             else:
-                d_flats[src_loc][dst_loc].append( f )
+                d_reservoirs[src_loc][dst_loc].append( im_dump.get_reservoir( i ) )
+    return d_reservoirs
 
-        except Exception as e:
-            logging.INFO(e)
-            continue
+def read_flat_file_values( filename: str ) -> np.ndarray:
+    """Read all of the transition times in a flat file, skipping lines that are not numbers"""
+    if os.path.getsize( filename ) == 0:
+        return np.zeros( 0 )
+    try:
+        return np.loadtxt( filename, dtype=np.float64, ndmin=1 )
+    except ValueError:
+        print( "Problem with file: {}".format( filename ) )
+        values = []
+        with open( filename, 'r' ) as f:
+            for line in f:
+                try:
+                    values.append( float( line ) )
+                except ValueError:
+                    pass
+        return np.array( values, dtype=np.float64 )
+
+# A reservoir archive holds every sampled transition time of a run, grouped by transition:
+#   header    ARCHIVE_HEADER
+#   index     ARCHIVE_INDEX_ENTRY[num_transitions], in name order
+#   names     the src_loc then dst_loc of every index entry, utf-8, padded to 8 bytes
+#   values    float64[num_values], each transition's times contiguous at value_offset
+ARCHIVE_MAGIC = b"SNTLRES1"
+ARCHIVE_VERSION = 1
+ARCHIVE_HEADER = np.dtype( [ ( 'magic', 'S8' ), ( 'version', '<u4' ), ( 'reserved', '<u4' ), ( 'num_transitions', '<u8' ),
+                             ( 'num_values', '<u8' ), ( 'names_bytes', '<u8' ) ] )
+ARCHIVE_INDEX_ENTRY = np.dtype( [ ( 'name_offset', '<u8' ), ( 'src_len', '<u4' ), ( 'dst_len', '<u4' ),
+                                  ( 'value_offset', '<u8' ), ( 'count', '<u8' ) ] )
+
+def write_reservoir_archive( archive_fname: str, d_flats: dict, d_reservoirs: dict ) -> int:
+    """Write every transition's flat file and binary dump reservoir values into one archive.
+    Returns the number of transitions archived."""
+    transitions = set()
+    for d_sources in ( d_flats, d_reservoirs ):
+        for src_loc in d_sources:
+            for dst_loc in d_sources[src_loc]:
+                transitions.add( ( src_loc, dst_loc ) )
+    transitions = sorted( transitions )
+
+    index = np.zeros( len( transitions ), dtype=ARCHIVE_INDEX_ENTRY )
+    names = bytearray()
+    for i, ( src_loc, dst_loc ) in enumerate( transitions ):
+        src_name = src_loc.encode()
+        dst_name = dst_loc.encode()
+        index[i]['name_offset'] = len( names )
+        index[i]['src_len'] = len( src_name )
+        index[i]['dst_len'] = len( dst_name )
+        names += src_name + dst_name
+    names += b"\0" * ( -len( names ) % 8 )
+
+    header = np.zeros( 1, dtype=ARCHIVE_HEADER )
+    header['magic'] = ARCHIVE_MAGIC
+    header['version'] = ARCHIVE_VERSION
+    header['num_transitions'] = len( transitions )
+    header['names_bytes'] = len( names )
+
+    with open( archive_fname, "wb" ) as f:
+        # Stream the values in after space for the header, index and names, then go back and fill those in
+        f.seek( ARCHIVE_HEADER.itemsize + index.nbytes + len( names ) )
+        num_values = 0
+        for i, ( src_loc, dst_loc ) in enumerate( transitions ):
+            values = [ read_flat_file_values( flat_file ) for flat_file in d_flats.get( src_loc, {} ).get( dst_loc, [] ) ]
+            values += d_reservoirs.get( src_loc, {} ).get( dst_loc, [] )
+            values = np.concatenate( values ).astype( '<f8' ) if values else np.zeros( 0, dtype='<f8' )
+            f.write( values.tobytes() )
+            index[i]['value_offset'] = num_values
+            index[i]['count'] = len( values )
+            num_values += len( values )
+        header['num_values'] = num_values
+        f.seek( 0 )
+        f.write( header.tobytes() )
+        f.write( index.tobytes() )
+        f.write( bytes( names ) )
+    return len( transitions )
+
+def map_reservoir_archive( archive_fname: str ) -> tuple:
+    """Map a reservoir archive into memory. Returns its index, its names region and its values region, none of
+    which are read until they are used."""
+    data = np.memmap( archive_fname, dtype=np.uint8, mode="r" )
+    header = data[ :ARCHIVE_HEADER.itemsize ].view( ARCHIVE_HEADER )[0]
+    if header['magic'] != ARCHIVE_MAGIC or header['version'] != ARCHIVE_VERSION:
+        raise ValueError( "{} is not a reservoir archive".format( archive_fname ) )
+    offset = ARCHIVE_HEADER.itemsize
+    index = data[ offset:offset + int( header['num_transitions'] ) * ARCHIVE_INDEX_ENTRY.itemsize ].view( ARCHIVE_INDEX_ENTRY )
+    offset += index.nbytes
+    names = data[ offset:offset + int( header['names_bytes'] ) ]
+    offset += int( header['names_bytes'] )
+    values = data[ offset:offset + int( header['num_values'] ) * 8 ].view( '<f8' )
+    return index, names, values
+
+def get_archive_transitions( index: np.ndarray, names: np.ndarray, start: int, end: int ) -> list:
+    """Decode the (src_loc, dst_loc) of the index entries [start, end)"""
+    transitions = []
+    for name_offset, src_len, dst_len in zip( index['name_offset'][start:end].tolist(), index['src_len'][start:end].tolist(), index['dst_len'][start:end].tolist() ):
+        name = names[ name_offset:name_offset + src_len + dst_len ].tobytes()
+        transitions.append( ( name[ :src_len ].decode(), name[ src_len: ].decode() ) )
+    return transitions
+
+def read_reservoir_batch( batch: list ) -> tuple:
+    """Read the times of a batch of (f_name_prefix, flat files, reservoir arrays) transitions"""
+    f_name_prefixes = [ f_name_prefix for f_name_prefix, flat_files, reservoirs in batch ]
+    reservoirs = [ [ read_flat_file_values( f ) for f in flat_files ] + reservoirs for f_name_prefix, flat_files, reservoirs in batch ]
+    return f_name_prefixes, reservoirs
+
+def compute_reservoir_batch( args ) -> list:
+    """Compute and write the percentiles of a batch of (f_name_prefix, flat files, reservoir arrays) transitions"""
+    batch, = args
+    return compute_reservoir_percentiles( *read_reservoir_batch( batch ) )
+
+def get_reservoir_batch_percentiles( args ) -> tuple:
+    """Compute the percentiles of a batch of (f_name_prefix, flat files, reservoir arrays) transitions without
+    writing them, as get_transition_percentiles does"""
+    batch, = args
+    f_name_prefixes, reservoirs = read_reservoir_batch( batch )
+    return get_transition_percentiles( f_name_prefixes, *concatenate_reservoirs( reservoirs ) )
+
+# This process's mapping of the archive being merged, as map_reservoir_archive returns it, set by init_archive_worker
+worker_archive = None # type: tuple
+
+def init_archive_worker( archive_fname: str ):
+    """Map the archive once per process, rather than once per batch"""
+    global worker_archive
+    worker_archive = map_reservoir_archive( archive_fname )
+
+def compute_archive_batch( args ) -> list:
+    """Compute the percentiles of the archived transitions [start, end) of worker_archive"""
+    start, end = args
+    index, names, values = worker_archive
+    f_name_prefixes = [ "event-flat-{}-{}".format( src_loc, dst_loc ) for src_loc, dst_loc in get_archive_transitions( index, names, start, end ) ]
+    # Transitions are stored contiguously in index order
+    value_offsets = np.append( index['value_offset'][start:end], values.size if end == len( index ) else index['value_offset'][end] ).astype( np.int64 )
+    offsets = value_offsets - value_offsets[0]
+    return compute_transition_percentiles( f_name_prefixes, values[ value_offsets[0]:value_offsets[-1] ], offsets )
+
+def get_batch_size( num_transitions: int, jobs: int ) -> int:
+    """Split transitions into batches of at most BATCH_SIZE, with enough of them to keep jobs processes busy"""
+    if jobs <= 1:
+        return BATCH_SIZE
+    return max( 1, min( BATCH_SIZE, -( -num_transitions // ( jobs * 4 ) ) ) )
+
+def map_batches( batch_func, batches: list, jobs: int, initializer=None, initargs=() ):
+    """Yield batch_func's result for each batch in order, running them in a pool of jobs processes if jobs > 1.
+    initializer( *initargs ) is run once in each process that runs batches, including this one if jobs <= 1."""
+    if jobs > 1:
+        with multiprocessing.Pool( jobs, initializer=initializer, initargs=initargs ) as proc_pool:
+            yield from proc_pool.imap( batch_func, batches )
+    else:
+        if initializer is not None:
+            initializer( *initargs )
+        for batch in batches:
+            yield batch_func( batch )
+
+def run_batches( batch_func, batches: list, jobs: int, initializer=None, initargs=() ):
+    """Run batch_func over batches with map_batches. Every batch writes its own transitions' files, so the output
+    does not depend on jobs; messages are printed in batch order."""
+    for messages in map_batches( batch_func, batches, jobs, initializer, initargs ):
+        for message in messages:
+            print( message )
 
-    #for src_loc in d_sketches:
-    #    for dst_loc in d_sketches[src_loc]:
-    #        if src_loc in d_flats and dst_loc in d_flats[src_loc]:
-    #            merge_files( d_sketches[src_loc][dst_loc], d_flats[src_loc][dst_loc] )
-    #        else:
-    #            merge_files( d_sketches[src_loc][dst_loc], [] )
+def compute_archive_percentiles( archive_fname: str, jobs=1 ):
+    """Compute and write the percentiles of every transition in a reservoir archive in one pass over its values,
+    a batch of transitions at a time"""
+    index, names, values = map_reservoir_archive( archive_fname )
+    batch_size = get_batch_size( len( index ), jobs )
+    batches = [ ( start, min( start + batch_size, len( index ) ) ) for start in range( 0, len( index ), batch_size ) ]
+    run_batches( compute_archive_batch, batches, jobs, init_archive_worker, ( archive_fname, ) )
 
+def get_reservoir_transitions( d_flats: dict, d_reservoirs: dict ) -> list:
+    """List the (f_name_prefix, flat files, reservoir arrays) of every transition in the flat files and binary dump reservoirs"""
+    transitions = []
     for src_loc in d_flats:
         for dst_loc in d_flats[src_loc]:
-            if src_loc not in d_sketches or dst_loc not in d_sketches[src_loc]:
-                compute_flat_file_percentiles( d_flats[src_loc][dst_loc] )
+            transitions.append( ( "event-flat-{}-{}".format( src_loc, dst_loc ), d_flats[src_loc][dst_loc], d_reservoirs.get( src_loc, {} ).get( dst_loc, [] ) ) )
+    for src_loc in d_reservoirs:
+        for dst_loc in d_reservoirs[src_loc]:
+            if src_loc not in d_flats or dst_loc not in d_flats[src_loc]:
+                transitions.append( ( "event-flat-{}-{}".format( src_loc, dst_loc ), [], d_reservoirs[src_loc][dst_loc] ) )
+    return transitions
+
+def get_reservoir_batches( transitions: list, jobs: int ) -> list:
+    """Split transitions into batches for compute_reservoir_batch or get_reservoir_batch_percentiles"""
+    batch_size = get_batch_size( len( transitions ), jobs )
+    return [ ( transitions[ start:start + batch_size ], ) for start in range( 0, len( transitions ), batch_size ) ]
+
+def compute_all_flat_file_percentiles( d_flats: dict, d_reservoirs: dict, jobs=1 ):
+    """Compute and write the percentiles of every transition in the flat files and binary dump reservoirs"""
+    run_batches( compute_reservoir_batch, get_reservoir_batches( get_reservoir_transitions( d_flats, d_reservoirs ), jobs ), jobs )
+
+class StageTimer:
+    """Time the stages of a merge and report each as it finishes"""
+    def __init__( self ):
+        self.stage_start = time.perf_counter()
+        self.start = self.stage_start
+
+    def end_stage( self, stage_name: str ):
+        now = time.perf_counter()
+        print( "{}: {:.3f}s".format( stage_name, now - self.stage_start ) )
+        self.stage_start = now
+
+    def end( self ):
+        print( "Total: {:.3f}s".format( time.perf_counter() - self.start ) )
+
+if __name__ == "__main__":
+
+    # Here, we need to check if the files are "flat" or sketch files.
+    # For each event -> event, if one of them is a sketch than we must take all other
+    # flat files and merge them into the sketch.
+    # If they are all flat, then we can just merge them all together to compute the percentiles, no need to
+    # to use the sketch library
+    # Output should be merged sketch files or percentile files.
+    parser = argparse.ArgumentParser( description="Combines the reservoirs of transition times in logdir and writes the percentiles of each transition's times." )
+    parser.add_argument( "log_dir", nargs="?", help="the directory Sentinel dumped its tracing to" )
+    parser.add_argument( "-a", "--archive", action="store", dest="archive", default=None,
+                         help="consolidate all of the reservoirs in log_dir into this archive and compute the percentiles from it. Without log_dir, compute them from an existing archive." )
+    parser.add_argument( "-j", "--jobs", type=int, action="store", dest="jobs", default=1,
+                         help="the number of processes to compute percentiles with" )
+    args = parser.parse_args()
+
+    if args.log_dir is None and args.archive is None:
+        parser.error( "log_dir is required unless an existing archive is given" )
+
+    timer = StageTimer()
+    if args.log_dir is not None:
+        sketchList = glob.glob("{}/event-sketch*".format( args.log_dir ) )
+        assert not sketchList
+        d_flats = group_flat_files( args.log_dir )
+        d_reservoirs = group_binary_dump_reservoirs( args.log_dir )
+        timer.end_stage( "Grouping reservoirs" )
+
+    if args.archive is not None:
+        if args.log_dir is not None:
+            write_reservoir_archive( args.archive, d_flats, d_reservoirs )
+            timer.end_stage( "Writing archive" )
+        compute_archive_percentiles( args.archive, args.jobs )
+    else:
+        compute_all_flat_file_percentiles( d_flats, d_reservoirs, args.jobs )
+    timer.end_stage( "Computing percentiles" )
+    timer.end()
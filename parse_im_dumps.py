@@ -1,12 +1,14 @@
 import os
 import glob
 import argparse
+import multiprocessing
+from binary_im_dump import is_binary_im_dump, read_binary_im_dump
 
 class FileEventSummary:
     def __init__( self, known_locs : list, event_count_map, event_transition_map ):
 
-        # Known Locs
-        self.known_locs = known_locs
+        # Known Locs, kept as the keys of a dict so that it is an ordered set
+        self.known_locs = dict.fromkeys( known_locs )
 
         # Map from locs to counts
         self.event_count_map = event_count_map
@@ -23,35 +25,44 @@ class FileEventSummary:
         assert( False )
 
     def merge_in( self, other_summary ):
+        """ Sum other_summary's counts into this summary. Nested transition maps are copied, never shared."""
 
         # Merge in the event_ids we don't know about
-        for known_loc in other_summary.known_locs:
-            if known_loc not in self.known_locs:
-                self.known_locs.append( known_loc )
-
-        for loc in self.event_count_map.keys():
-            if loc in other_summary.event_count_map.keys():
-                self.event_count_map[loc] += other_summary.event_count_map[loc]
-
-        for loc in other_summary.event_count_map.keys():
-            if loc not in self.event_count_map.keys():
-                self.event_count_map[loc] = other_summary.event_count_map[loc]
-
-
-        for loc in self.event_transition_map.keys():
-            if loc in other_summary.event_transition_map.keys():
-                for loc2 in self.event_transition_map[loc].keys():
-                    if loc2 in other_summary.event_transition_map[loc]:
-                        self.event_transition_map[loc][loc2] += other_summary.event_transition_map[loc][loc2]
-
-        for loc in other_summary.event_transition_map.keys():
-            if loc not in self.event_transition_map:
-                self.event_transition_map[loc] = other_summary.event_transition_map[loc]
-            else:
-                for loc2 in other_summary.event_transition_map[loc].keys():
-                    if loc2 not in self.event_transition_map[loc]:
-                        self.event_transition_map[loc][loc2] = other_summary.event_transition_map[loc][loc2]
-                       
+        self.known_locs.update( other_summary.known_locs )
+
+        event_count_map_get = self.event_count_map.get
+        for loc, count in other_summary.event_count_map.items():
+            self.event_count_map[loc] = event_count_map_get( loc, 0 ) + count
+
+        for loc, other_dst_map in other_summary.event_transition_map.items():
+            dst_map = self.event_transition_map.get( loc )
+            if dst_map is None:
+                dst_map = {}
+                self.event_transition_map[loc] = dst_map
+            dst_map_get = dst_map.get
+            for loc2, count in other_dst_map.items():
+                dst_map[loc2] = dst_map_get( loc2, 0 ) + count
+
+def merge_file_event_summaries( summaries, merged_summary ):
+    """ Merge many summaries in order into merged_summary with its merge_in, and return it. The inputs are not modified,
+    and summaries may be a generator so that they are merged as they are produced. sentinel_analysis.py merges its
+    own FileEventSummaries with this too, so that both scripts merge dumps the same way."""
+    for summary in summaries:
+        merged_summary.merge_in( summary )
+    return merged_summary
+
+def tree_merge_file_event_summaries( summaries: list ):
+    """ Merge a non-empty list of summaries pairwise in a tree reduction, each merge keeping the left summary's order,
+    so that the result is the same as merging them in order. The summaries are merged into each other."""
+    while len( summaries ) > 1:
+        merged_summaries = []
+        for i in range( 0, len( summaries ) - 1, 2 ):
+            summaries[i].merge_in( summaries[i+1] )
+            merged_summaries.append( summaries[i] )
+        if len( summaries ) % 2 == 1:
+            merged_summaries.append( summaries[-1] )
+        summaries = merged_summaries
+    return summaries[0]
 
 class FileLocation:
     def __init__( self, fname: str, line_number: int ):
@@ -67,28 +78,28 @@ class FileLocation:
         return hash(self.fname) ^ hash(self.line_number)
 
 def process_dump_lines( lines ):
-    i = 0
+    """ Convert the lines of a dump into a FileEventSummary in a single pass. lines may be any iterable of lines,
+    such as an open file, so the dump never needs to be held in memory"""
     event_count_map = {}
     event_file_map = {}
     event_transition_map = {}
-    while i < len(lines):
-        # This is a transition line, break into transition processing
-        if "->" in lines[i]:
-            break
-        # This is still an event count line
-        left, right = lines[i].split("=")
-        fname, line_number = left.split(":")
-        loc = FileLocation( fname, int( line_number.strip() ) )
-        identifier, count = right.lstrip().split(",")
-        identifier = int( identifier )
-        count = int( count.strip() )
-        assert identifier not in event_file_map
-        event_file_map[identifier] = loc
-        event_count_map[loc] = count
-        i += 1
-
-    while i < len(lines):
-        left, right = lines[i].split("->")
+    in_transitions = False
+    for line in lines:
+        # Event count lines come first, the first transition line starts the transitions
+        if not in_transitions and "->" not in line:
+            left, right = line.split("=")
+            fname, line_number = left.split(":")
+            loc = FileLocation( fname, int( line_number.strip() ) )
+            identifier, count = right.lstrip().split(",")
+            identifier = int( identifier )
+            count = int( count.strip() )
+            assert identifier not in event_file_map
+            event_file_map[identifier] = loc
+            event_count_map[loc] = count
+            continue
+
+        in_transitions = True
+        left, right = line.split("->")
         left_id = int( left.strip() )
         transition, count = right.lstrip().split(":")
         transition_id = int( transition.lstrip() )
@@ -102,22 +113,51 @@ def process_dump_lines( lines ):
         
         event_transition_map[left_loc][right_loc] =  count
 
-        i += 1
-
     return FileEventSummary( [ v for k,v in event_file_map.items() ], event_count_map, event_transition_map )
         
+def process_binary_dump( im_dump ):
+    """ Convert a BinaryIMDump into a FileEventSummary"""
+    event_count_map = {}
+    event_file_map = {}
+    event_transition_map = {}
+    for identifier, fname, line_number, count in zip( im_dump.event_ids.tolist(), im_dump.get_fnames(),
+                                                      im_dump.line_numbers.tolist(), im_dump.event_counts.tolist() ):
+        loc = FileLocation( fname, line_number )
+        event_file_map[identifier] = loc
+        event_count_map[loc] = count
+
+    for left_id, transition_id, count in zip( im_dump.transition_srcs.tolist(), im_dump.transition_dsts.tolist(), im_dump.transition_counts.tolist() ):
+        left_loc = event_file_map[ left_id ]
+        if left_loc not in event_transition_map:
+            event_transition_map[left_loc] = {}
+        event_transition_map[left_loc][ event_file_map[ transition_id ] ] = count
+
+    return FileEventSummary( [ v for k,v in event_file_map.items() ], event_count_map, event_transition_map )
+
 def read_single_im_dump( filename: str ):
+    """ Read a text or binary dump, telling them apart by the binary format's magic number"""
+    if is_binary_im_dump( filename ):
+        return process_binary_dump( read_binary_im_dump( filename ) )
     with open( filename, "r" ) as f:
-        f_lines = f.readlines()
-        f_event_summary = process_dump_lines( f_lines )
-        return( f_event_summary )
-
-def read_all_im_dumps( im_dir: str ):
-    f_event_summary = FileEventSummary( [], {}, {} )
-    for fname in glob.iglob( "{}/*.im.out*".format( im_dir ) ):
-        next_f_event_summary = read_single_im_dump( fname )
-        f_event_summary.merge_in( next_f_event_summary )
-    return f_event_summary
+        return process_dump_lines( f )
+
+def read_im_dump_chunk( fnames ):
+    """ Parse and merge a contiguous chunk of dumps in a worker process"""
+    return merge_file_event_summaries( ( read_single_im_dump( fname ) for fname in fnames ), FileEventSummary( [], {}, {} ) )
+
+def read_all_im_dumps( im_dir: str, procs=1 ):
+    """ Read and merge every dump in im_dir. If procs > 1, contiguous chunks of dumps are parsed over a pool of procs
+    processes and the partial summaries are combined pairwise in a tree reduction, giving the same result as the serial merge."""
+    fnames = list( glob.iglob( "{}/*.im.out*".format( im_dir ) ) )
+    if procs <= 1:
+        return read_im_dump_chunk( fnames )
+
+    # Several chunks per process to even out differences in dump sizes
+    num_chunks = max( 1, min( len( fnames ), procs * 4 ) )
+    chunks = [ fnames[ len( fnames ) * i // num_chunks : len( fnames ) * (i+1) // num_chunks ] for i in range( num_chunks ) ]
+    with multiprocessing.Pool( procs ) as proc_pool:
+        partial_summaries = proc_pool.map( read_im_dump_chunk, chunks )
+    return tree_merge_file_event_summaries( partial_summaries )
 
 def find( path: str, name: str ):
     for root, dirs, files in os.walk( path ):
@@ -177,22 +217,24 @@ def get_log_lines_for_im_dumps( merged_summaries: FileEventSummary, postgres_src
         msg_map[loc] = get_log_line_from_location( loc, postgres_src_dir )
     merged_summaries.msg_map = msg_map
 
-parser = argparse.ArgumentParser( "Read dumped postgres in memory tracing files and computes the transition graphs." )
-parser.add_argument( "-p", action="store", dest="postgres_dir", default="/tmp/postgresql_source", help="sets the postgres source directory" )
-parser.add_argument( "-d", action="store", dest="im_dir", default="/tmp", help="sets the directory in which in memory tracing files were dumped" )
-parser.add_argument( "-m", action="store", dest="max_id", default=1000, help="sets the maximum RID value." )
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser( "Read dumped postgres in memory tracing files and computes the transition graphs." )
+    parser.add_argument( "-p", action="store", dest="postgres_dir", default="/tmp/postgresql_source", help="sets the postgres source directory" )
+    parser.add_argument( "-d", action="store", dest="im_dir", default="/tmp", help="sets the directory in which in memory tracing files were dumped" )
+    parser.add_argument( "-m", action="store", dest="max_id", default=1000, help="sets the maximum RID value." )
+    parser.add_argument( "-j", type=int, action="store", dest="procs", default=1, help="sets the number of processes used to parse dumps" )
 
-args = parser.parse_args()
-merged_summaries = read_all_im_dumps( args.im_dir )
-get_log_lines_for_im_dumps( merged_summaries, args.postgres_dir )
+    args = parser.parse_args()
+    merged_summaries = read_all_im_dumps( args.im_dir, args.procs )
+    get_log_lines_for_im_dumps( merged_summaries, args.postgres_dir )
 
-for loc in merged_summaries.msg_map:
-    print( loc, merged_summaries.msg_map[loc].strip(), merged_summaries.event_count_map[loc] )
+    for loc in merged_summaries.msg_map:
+        print( loc, merged_summaries.msg_map[loc].strip(), merged_summaries.event_count_map[loc] )
 
-print( "---" )
+    print( "---" )
 
-for loc in merged_summaries.event_transition_map:
-    for loc2 in merged_summaries.event_transition_map[loc]:
-        print( loc, loc2, merged_summaries.event_transition_map[loc][loc2] )
+    for loc in merged_summaries.event_transition_map:
+        for loc2 in merged_summaries.event_transition_map[loc]:
+            print( loc, loc2, merged_summaries.event_transition_map[loc][loc2] )
 
-#print( merged_summaries.event_id_map['456'].fname, merged_summaries.event_id_map['456'].line_number )
+    #print( merged_summaries.event_id_map['456'].fname, merged_summaries.event_id_map['456'].line_number )
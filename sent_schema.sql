@@ -674,6 +674,27 @@ ALTER TABLE ONLY public.transition_cdfs
 CREATE INDEX distance_weights_last_updated_idx ON public.distance_weights USING btree (run_id_last_updated);
 
 
+--
+-- Name: log_line_probabilities_run_event_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX log_line_probabilities_run_event_idx ON public.log_line_probabilities USING btree (run_id, log_fname, log_line);
+
+
+--
+-- Name: log_line_transitions_run_src_dst_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX log_line_transitions_run_src_dst_idx ON public.log_line_transitions USING btree (run_id, log_initial_fname, log_initial_line, log_next_fname, log_next_line);
+
+
+--
+-- Name: transition_cdfs_run_src_dst_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX transition_cdfs_run_src_dst_idx ON public.transition_cdfs USING btree (run_id, src_fname, src_line, dst_fname, dst_line);
+
+
 --
 -- Name: benchmarkdatahook_run_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: postgres
 --
@@ -0,0 +1,17 @@
+--
+-- Brings a sentdb created from an older sent_schema.sql up to date with its indexes on
+-- (run_id, src, dst) lookups. Indexes are built concurrently so that loads and comparisons can
+-- continue while they build, so run this outside of a transaction:
+--
+--   psql -h dbhost -U postgres sentdb < sent_schema_add_indexes.sql
+--
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS log_line_probabilities_run_event_idx ON public.log_line_probabilities USING btree (run_id, log_fname, log_line);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS log_line_transitions_run_src_dst_idx ON public.log_line_transitions USING btree (run_id, log_initial_fname, log_initial_line, log_next_fname, log_next_line);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS transition_cdfs_run_src_dst_idx ON public.transition_cdfs USING btree (run_id, src_fname, src_line, dst_fname, dst_line);
+
+ANALYZE public.log_line_probabilities;
+ANALYZE public.log_line_transitions;
+ANALYZE public.transition_cdfs;
@@ -0,0 +1,105 @@
+--
+-- Optionally list partitions log_line_probabilities, log_line_transitions and transition_cdfs by
+-- run_id, so that each run's rows are stored (and scanned, and dropped) on their own. Requires
+-- PostgreSQL 11 or later. Apply it after sent_schema.sql (and sent_schema_add_indexes.sql for older
+-- databases):
+--
+--   psql -h dbhost -U postgres sentdb < sent_schema_partitioned.sql
+--
+-- Each existing table becomes the default partition of its new partitioned table, so rows already
+-- loaded stay where they are. create_sql_stmts.py and ingest_run.py create a partition for each run
+-- they load; runs loaded some other way land in the default partition.
+--
+
+BEGIN;
+
+--
+-- Name: log_line_probabilities; Type: TABLE; Schema: public; Owner: postgres
+--
+
+ALTER TABLE public.log_line_probabilities RENAME TO log_line_probabilities_default;
+ALTER INDEX IF EXISTS public.log_line_probabilities_run_event_idx RENAME TO log_line_probabilities_default_run_event_idx;
+ALTER TABLE public.log_line_probabilities_default DROP CONSTRAINT log_line_probabilities_run_id_fkey;
+
+CREATE TABLE public.log_line_probabilities (
+    run_id integer,
+    iteration_number integer,
+    log_fname character varying(64),
+    log_line bigint,
+    log_probability double precision,
+    log_count bigint
+) PARTITION BY LIST (run_id);
+
+
+ALTER TABLE public.log_line_probabilities OWNER TO postgres;
+
+ALTER TABLE public.log_line_probabilities ATTACH PARTITION public.log_line_probabilities_default DEFAULT;
+
+CREATE INDEX log_line_probabilities_run_event_idx ON public.log_line_probabilities USING btree (run_id, log_fname, log_line);
+
+ALTER TABLE public.log_line_probabilities
+    ADD CONSTRAINT log_line_probabilities_run_id_fkey FOREIGN KEY (run_id, iteration_number) REFERENCES public.exp_iterations(run_id, iteration_number);
+
+--
+-- Name: log_line_transitions; Type: TABLE; Schema: public; Owner: postgres
+--
+
+ALTER TABLE public.log_line_transitions RENAME TO log_line_transitions_default;
+ALTER INDEX IF EXISTS public.log_line_transitions_run_src_dst_idx RENAME TO log_line_transitions_default_run_src_dst_idx;
+ALTER TABLE public.log_line_transitions_default DROP CONSTRAINT log_line_transitions_run_id_fkey;
+
+CREATE TABLE public.log_line_transitions (
+    run_id integer,
+    iteration_number integer,
+    log_initial_fname character varying(64),
+    log_initial_line bigint,
+    log_next_fname character varying(64),
+    log_next_line bigint,
+    transition_probability double precision,
+    transition_count bigint
+) PARTITION BY LIST (run_id);
+
+
+ALTER TABLE public.log_line_transitions OWNER TO postgres;
+
+ALTER TABLE public.log_line_transitions ATTACH PARTITION public.log_line_transitions_default DEFAULT;
+
+CREATE INDEX log_line_transitions_run_src_dst_idx ON public.log_line_transitions USING btree (run_id, log_initial_fname, log_initial_line, log_next_fname, log_next_line);
+
+ALTER TABLE public.log_line_transitions
+    ADD CONSTRAINT log_line_transitions_run_id_fkey FOREIGN KEY (run_id, iteration_number) REFERENCES public.exp_iterations(run_id, iteration_number);
+
+--
+-- Name: transition_cdfs; Type: TABLE; Schema: public; Owner: postgres
+--
+
+ALTER TABLE public.transition_cdfs RENAME TO transition_cdfs_default;
+ALTER INDEX public.transition_cdfs_pkey RENAME TO transition_cdfs_default_pkey;
+ALTER INDEX IF EXISTS public.transition_cdfs_run_src_dst_idx RENAME TO transition_cdfs_default_run_src_dst_idx;
+ALTER TABLE public.transition_cdfs_default DROP CONSTRAINT transition_cdfs_run_id_fkey;
+
+CREATE TABLE public.transition_cdfs (
+    run_id integer NOT NULL,
+    iteration_number integer NOT NULL,
+    src_fname character varying(64) NOT NULL,
+    src_line bigint NOT NULL,
+    dst_fname character varying(64) NOT NULL,
+    dst_line bigint NOT NULL,
+    percentiles double precision[],
+    percentile_values double precision[]
+) PARTITION BY LIST (run_id);
+
+
+ALTER TABLE public.transition_cdfs OWNER TO postgres;
+
+ALTER TABLE public.transition_cdfs ATTACH PARTITION public.transition_cdfs_default DEFAULT;
+
+ALTER TABLE public.transition_cdfs
+    ADD CONSTRAINT transition_cdfs_pkey PRIMARY KEY (run_id, iteration_number, src_fname, src_line, dst_fname, dst_line);
+
+CREATE INDEX transition_cdfs_run_src_dst_idx ON public.transition_cdfs USING btree (run_id, src_fname, src_line, dst_fname, dst_line);
+
+ALTER TABLE public.transition_cdfs
+    ADD CONSTRAINT transition_cdfs_run_id_fkey FOREIGN KEY (run_id, iteration_number) REFERENCES public.exp_iterations(run_id, iteration_number);
+
+COMMIT;
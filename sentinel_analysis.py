@@ -5,14 +5,26 @@ import numpy as np # type: ignore
 import pyemd # type: ignore
 import multiprocessing
 import glob 
+import os
+import hashlib
+import zipfile
 import pickle
+import math
+import bisect
+import heapq
+import weakref
 import scipy.stats # type: ignore
+import scipy.sparse # type: ignore
 
 from typing import List, Dict, Tuple, Set, Any, Iterable
 from colorama import Fore, Style # type: ignore
+from parse_im_dumps import merge_file_event_summaries, tree_merge_file_event_summaries
+from binary_im_dump import BINARY_DUMP_MAGIC, BINARY_DUMP_VERSION, BINARY_DUMP_HEADER, BINARY_DUMP_COLUMNS, \
+    BinaryIMDump, is_binary_im_dump, read_binary_im_dump
 
 class FileLocation:
     """A location in a file for a given event (filename,line_number)"""
+    __slots__ = ( 'fname', 'line_number' )
     def __init__( self, fname: str, line_number: int ):
         self.fname = fname
         self.line_number = line_number
@@ -25,23 +37,64 @@ class FileLocation:
     def __hash__( self ) -> int:
         return hash( (self.fname, self.line_number) )
 
+class EventInterner:
+    """Maps each (fname, line) event location to a dense int id, once per session.
+    Events are keyed by these ids everywhere; locations are only looked up again for display."""
+    def __init__( self ):
+        self.loc_ids = {} # type: Dict[Tuple[str,int], int]
+        self.locs = [] # type: List[FileLocation]
+
+    def get_id( self, fname: str, line_number: int ) -> int:
+        key = ( fname, line_number )
+        event_id = self.loc_ids.get( key )
+        if event_id is None:
+            event_id = len( self.locs )
+            self.loc_ids[key] = event_id
+            self.locs.append( FileLocation( fname, line_number ) )
+        return event_id
+
+    def get_location( self, event_id: int ) -> FileLocation:
+        return self.locs[ event_id ]
+
+    def get_name( self, event_id: int ) -> str:
+        return self.locs[ event_id ].__repr__()
+
+    def __len__( self ) -> int:
+        return len( self.locs )
+
+event_interner = EventInterner()
+
 class EventRecord:
     def __init__( self, fname: str , ln: int, prob: float  ):
         self.event_loc = FileLocation( fname, ln )
+        self.event_id = event_interner.get_id( fname, ln )
         self.prob =  prob
 
-    def get_id( self ):
-        return self.event_loc.__repr__()
+    def get_id( self ) -> int:
+        return self.event_id
     def __repr__(self):
-        return "<{}, Prob: {}>".format(self.get_id(), self.prob)
+        return "<{}, Prob: {}>".format(self.event_loc, self.prob)
 
 class TransitionRecord:
-    """ A transition record between markov nodes. node == dest."""
+    """ A transition record between markov nodes. node == dest.
+    The transition time CDF is kept as two tuples: ascending percentiles and the values at them. They are plain
+    tuples rather than arrays since sampling one time at a time is faster with bisect than with np.searchsorted."""
+    __slots__ = ( 'dst', 'prob', 'cdf_percentiles', 'cdf_values', 'good_path' )
     def __init__( self, dst: 'MarkovNode', prob: float, transition_time_cdf: List[Tuple[float,float]] ):
         self.dst = dst
         self.prob = prob
-        self.transition_time_cdf = transition_time_cdf
+        self.cdf_percentiles = tuple( float( pctl ) for pctl, val in transition_time_cdf )
+        self.cdf_values = tuple( float( val ) for pctl, val in transition_time_cdf )
         self.good_path = False
+    @property
+    def transition_time_cdf( self ) -> List[Tuple[float,float]]:
+        return list( zip( self.cdf_percentiles, self.cdf_values ) )
+    def sample_time( self, cdf_draw: float ) -> float:
+        """ Get the value at the first percentile >= cdf_draw, or the last value if there is none"""
+        ind = bisect.bisect_left( self.cdf_percentiles, cdf_draw )
+        if ind == len( self.cdf_values ):
+            ind -= 1
+        return self.cdf_values[ ind ]
     def is_good_path( self ) -> bool:
         return self.good_path
     def set_good_path( self ):
@@ -51,36 +104,37 @@ class TransitionRecord:
 
 class MarkovNode:
     """A Node in a MarkovGraph"""
+    __slots__ = ( 'node_id', 'event_id', 'transitions', 'transition_index', 'event_loc', '__weakref__' )
     def __init__( self, node_id: int, fname: str, line: int ):
         self.node_id = node_id
+        self.event_id = event_interner.get_id( fname, line )
         self.transitions = [] # type: List[TransitionRecord]
+        # Index from destination event id to the first transition to it
+        self.transition_index = {} # type: Dict[int, TransitionRecord]
         self.event_loc = FileLocation( fname, line )
     
     def add_transition( self, dst: 'MarkovNode', prob: float, transition_time_cdf: List[Tuple[float,float]]):
         """ Add a transition from this node to dst with probability prob and transition_time_cdf"""
         tr = TransitionRecord( dst, prob, transition_time_cdf )
         self.transitions.append( tr )
+        self.transition_index.setdefault( dst.event_id, tr )
 
     def get_transition( self, dst_name: str, dst_line: int ) -> 'MarkovNode':
-        for transition in self.transitions:
-            if transition.dst.event_loc.fname == dst_name and transition.dst.event_loc.line_number == dst_line:
-                return transition.dst
-        raise KeyError( "No such transition found: {}:{} from {}:{}".format( dst_name, dst_line, self.event_loc.fname, self.event_loc.line_number ) )
+        tr = self.transition_index.get( event_interner.loc_ids.get( ( dst_name, dst_line ) ) )
+        if tr is None:
+            raise KeyError( "No such transition found: {}:{} from {}:{}".format( dst_name, dst_line, self.event_loc.fname, self.event_loc.line_number ) )
+        return tr.dst
     
     def sample_transition_time( self, dst: 'MarkovNode' ) -> float:
         """ Sample a transition time from the current node to dst"""
-        for tr in self.transitions:
-            if dst != tr.dst:
-                continue
-            cdf_draw = random.random()
-            if not tr.transition_time_cdf:
-                print( "Unknown Transition!")
-                return 0.0
-            for pctl, val in tr.transition_time_cdf:
-                if cdf_draw <= pctl:
-                    return val
-            return tr.transition_time_cdf[-1][1]
-        raise KeyError( "Could not find transition for dst: {}".format( dst ) )
+        tr = self.transition_index.get( dst.event_id )
+        if tr is None or tr.dst is not dst:
+            raise KeyError( "Could not find transition for dst: {}".format( dst ) )
+        cdf_draw = random.random()
+        if len( tr.cdf_values ) == 0:
+            print( "Unknown Transition!")
+            return 0.0
+        return tr.sample_time( cdf_draw )
     
     def __str__( self ):
         return "MarkovNode-{}".format( self.node_id )
@@ -94,20 +148,45 @@ class MarkovNode:
 class MarkovGraph:
     """A graph of MarkovNodes"""
     def __init__( self, nodes: List[MarkovNode] ):
-        self.node_map = {}
+        self.node_map = {} # type: Dict[int, MarkovNode]
         for node in nodes:
-            self.node_map[node.get_key()] = node
+            self.node_map[node.event_id] = node
     def get_node( self, fname, line ) -> MarkovNode:
-        return self.node_map[ FileLocation( fname, line ).__repr__() ]
+        event_id = event_interner.loc_ids.get( ( fname, line ) )
+        if event_id not in self.node_map:
+            raise KeyError( "No such node: {}:{}".format( fname, line ) )
+        return self.node_map[ event_id ]
     def __repr__( self ):
         return str(self.node_map)
 
+# The queries that look up a run's events, transitions and CDFs, which sent_schema.sql's indexes are built for
+GET_TRANSITION_PROBS_QUERY = "SELECT log_next_fname, log_next_line, transition_probability FROM log_line_transitions WHERE log_initial_fname = %s AND log_initial_line = %s AND run_id = %s"
+
+GET_GRAPH_QUERY = """SELECT t.log_initial_fname, t.log_initial_line, t.log_next_fname, t.log_next_line, t.transition_probability,
+    c.percentiles, c.percentile_values FROM log_line_transitions t LEFT JOIN transition_cdfs c ON
+    c.run_id = t.run_id AND c.iteration_number = t.iteration_number AND c.src_fname = t.log_initial_fname AND
+    c.src_line = t.log_initial_line AND c.dst_fname = t.log_next_fname AND c.dst_line = t.log_next_line
+    WHERE t.run_id = %s"""
+
+GET_EVENT_PROBS_QUERY = "SELECT log_fname, log_line, log_probability FROM log_line_probabilities WHERE run_id = %s"
+
+GET_RUN_TRANSITION_PROBS_QUERY = "SELECT log_initial_fname,log_initial_line, log_next_fname, log_next_line, transition_probability FROM log_line_transitions WHERE run_id = %s"
+
+PAIRED_CDF_QUERY = """SELECT DISTINCT ON (c1.src_fname, c1.src_line, c1.dst_fname, c1.dst_line)
+    c1.src_fname, c1.src_line, c1.dst_fname, c1.dst_line, c1.percentile_values, c2.percentile_values
+    FROM transition_cdfs c1 JOIN transition_cdfs c2 ON
+    c2.src_fname = c1.src_fname AND c2.src_line = c1.src_line AND c2.dst_fname = c1.dst_fname AND c2.dst_line = c1.dst_line
+    WHERE c1.run_id = %(run_id1)s AND c2.run_id = %(run_id2)s AND EXISTS (
+        SELECT 1 FROM log_line_transitions t, log_line_probabilities p
+        WHERE t.run_id IN (%(run_id1)s, %(run_id2)s) AND p.run_id = t.run_id AND
+        t.log_initial_fname = c1.src_fname AND t.log_initial_line = c1.src_line AND
+        t.log_next_fname = c1.dst_fname AND t.log_next_line = c1.dst_line AND
+        p.log_fname = c1.src_fname AND p.log_line = c1.src_line AND t.transition_count > %(min_transition_count)s )"""
+
 def get_log_transitions( pg_conn, src_fname: str, src_line: int, run_id: int ) -> List[Tuple[str,int,float]]:
     """Get the transitions from event src_fname:src_line in run_id using the provided postgres connection"""
     cur = pg_conn.cursor()
-    get_transition_probs_query = "SELECT log_next_fname, log_next_line, transition_probability FROM log_line_transitions WHERE log_initial_fname = %s AND log_initial_line = %s AND run_id = %s"
-
-    cur.execute( get_transition_probs_query, ( src_fname, src_line, run_id ) )
+    cur.execute( GET_TRANSITION_PROBS_QUERY, ( src_fname, src_line, run_id ) )
     results = cur.fetchall()
     cur.close()
     return results
@@ -122,33 +201,43 @@ def get_log_transition_time( pg_conn, src_fname: str, src_line: int, dst_fname:
     cur.close()
     return results
 
-def build_full_markov_graph( pg_conn, run_id: int ) -> MarkovGraph:
-    """ Build a markov graph for run_id using the provided postgres connection"""
-    get_all_nodes_query = """SELECT log_initial_fname, log_initial_line FROM log_line_transitions WHERE run_id = %s UNION SELECT log_next_fname, log_next_line FROM log_line_transitions WHERE run_id = %s"""
-    
-    nodes = [] # type: List[MarkovNode]
-    cur = pg_conn.cursor()
-    cur.execute( get_all_nodes_query, ( run_id, run_id ) )
-    data = cur.fetchall() # type: List[Tuple[str,int]]
-    cur.close()
-    for entry in data:
-        node = MarkovNode( hash(entry[0]) ^ hash(entry[1]), entry[0], entry[1] )
-        nodes.append( node )
-    
-    for node in nodes:
-        src_fname = node.event_loc.fname
-        src_line = node.event_loc.line_number
-        transitions = get_log_transitions( pg_conn, src_fname, src_line, run_id )
-        for dst_name, dst_line, dst_prob in transitions:
-            dst_node = node.get_transition( dst_name, dst_line )
-            cdf_data = get_log_transition_time( pg_conn, node.event_loc.fname, node.event_loc.line_number, dst_node.event_loc.fname, dst_node.event_loc.line_number, run_id )
-            if len(cdf_data) < 1:
-                raise KeyError( "No transition for: {}:{} -> {}:{}".format( node.event_loc.fname, node.event_loc.line_number, dst_node.event_loc.fname, dst_node.event_loc.line_number) )
-            else:
-                cdf_data= cdf_data[0]
-                node.add_transition( dst_node, dst_prob, list(zip(cdf_data[0],cdf_data[1])) )
-            
-    return MarkovGraph(nodes)
+def get_markov_graph_rows( pg_conn, run_id: int, stream=False, itersize=10000 ) -> Iterable[Tuple[str,int,str,int,float,List[float],List[float]]]:
+    """Get every transition in run_id together with its transition time CDF in a single query.
+    If stream is set, rows are pulled through a server-side cursor itersize rows at a time instead of
+    being materialized on the client."""
+    if stream:
+        cur = pg_conn.cursor( name="markov_graph_{}".format( run_id ) )
+        cur.itersize = itersize
+    else:
+        cur = pg_conn.cursor()
+    try:
+        cur.execute( GET_GRAPH_QUERY, ( run_id, ) )
+        for row in cur:
+            yield row
+    finally:
+        cur.close()
+
+def build_full_markov_graph( pg_conn, run_id: int, stream=False ) -> MarkovGraph:
+    """ Build a markov graph for run_id using the provided postgres connection.
+    Set stream to pull transitions through a server-side cursor for very large runs."""
+    node_map = {} # type: Dict[int, MarkovNode]
+
+    def get_or_create_node( fname: str, line: int ) -> MarkovNode:
+        event_id = event_interner.get_id( fname, line )
+        node = node_map.get( event_id )
+        if node is None:
+            node = MarkovNode( hash(fname) ^ hash(line), fname, line )
+            node_map[event_id] = node
+        return node
+
+    for src_fname, src_line, dst_fname, dst_line, dst_prob, percentiles, percentile_values in get_markov_graph_rows( pg_conn, run_id, stream ):
+        node = get_or_create_node( src_fname, src_line )
+        dst_node = get_or_create_node( dst_fname, dst_line )
+        if percentiles is None:
+            raise KeyError( "No transition for: {}:{} -> {}:{}".format( src_fname, src_line, dst_fname, dst_line ) )
+        node.add_transition( dst_node, dst_prob, list(zip(percentiles,percentile_values)) )
+
+    return MarkovGraph( list(node_map.values()) )
 
 def bounded_dfs( node: MarkovNode, goal_nodes: List[MarkovNode], cur_prob=1., cut_off=1E-5, nodes_seen_so_far=[], allow_loops=True ) -> bool:
 
@@ -173,6 +262,65 @@ def bounded_dfs( node: MarkovNode, goal_nodes: List[MarkovNode], cur_prob=1., cu
                 transition.set_bad_path()
     return is_good_path
 
+def mark_good_paths( start_node: MarkovNode, goal_nodes: List[MarkovNode], cut_off=1E-5 ) -> bool:
+    """Iterative, set-based replacement for bounded_dfs( start_node, goal_nodes, cut_off=cut_off, allow_loops=False )
+    that visits each transition a constant number of times.
+
+    A DFS from start_node, which stops at goal nodes, drops every transition back into a node on the current DFS path,
+    since a walk taking it would revisit a node. The transitions left form a DAG whose DFS post-order is a reverse
+    topological order. One pass in topological order finds the most probable path from start_node to every node, and
+    one pass in post-order (a reverse BFS from the goal nodes over the DAG) finds the most probable path from every
+    node to a goal node. A transition is marked good if the most probable path through it has probability >= cut_off,
+    and bad otherwise. Walks over good transitions never revisit a node or get stranded. On a DAG where no path
+    drops below cut_off, the marks are the same as bounded_dfs's. Returns whether start_node can reach a goal node."""
+    goal_set = set( goal_nodes )
+    if start_node in goal_set:
+        return True
+
+    # Iterative DFS, keeping the transitions that do not lead back into the current path
+    dag_transitions = { start_node: [] } # type: Dict[MarkovNode, List[TransitionRecord]]
+    on_path = set( [ start_node ] )
+    post_order = [] # type: List[MarkovNode]
+    stack = [ ( start_node, iter( start_node.transitions ) ) ]
+    while stack:
+        node, transitions = stack[-1]
+        for transition in transitions:
+            dst = transition.dst
+            if dst in on_path:
+                continue
+            dag_transitions[ node ].append( transition )
+            if dst not in goal_set and dst not in dag_transitions:
+                dag_transitions[ dst ] = []
+                on_path.add( dst )
+                stack.append( ( dst, iter( dst.transitions ) ) )
+                break
+        else:
+            stack.pop()
+            on_path.remove( node )
+            post_order.append( node )
+
+    # Forward: most probable path from start_node to every node
+    reach_prob = { start_node: 1. } # type: Dict[MarkovNode, float]
+    for node in reversed( post_order ):
+        for transition in dag_transitions[ node ]:
+            next_prob = reach_prob[ node ] * transition.prob
+            if next_prob > reach_prob.get( transition.dst, 0. ):
+                reach_prob[ transition.dst ] = next_prob
+
+    # Backward: most probable path from every node to a goal node
+    goal_prob = dict.fromkeys( goal_set, 1. ) # type: Dict[MarkovNode, float]
+    for node in post_order:
+        best_prob = max( [ transition.prob * goal_prob[ transition.dst ] for transition in dag_transitions[ node ] if transition.dst in goal_prob ], default=0. )
+        if best_prob > 0.:
+            goal_prob[ node ] = best_prob
+
+    for node in post_order:
+        for transition in node.transitions:
+            transition.set_bad_path()
+        for transition in dag_transitions[ node ]:
+            if transition.dst in goal_prob and reach_prob[ node ] * transition.prob * goal_prob[ transition.dst ] >= cut_off:
+                transition.set_good_path()
+    return start_node in goal_prob and goal_prob[ start_node ] >= cut_off
 
 def get_transition_node( valid_transitions: List[TransitionRecord] ) -> MarkovNode:
     """Given a set of valid transitions, determine which transition we will walk next
@@ -191,13 +339,60 @@ def get_transition_node( valid_transitions: List[TransitionRecord] ) -> MarkovNo
         prob -= adj_prob
     raise ArithmeticError( "Ran out of normalized transition probabilities to walk! Normalization error?" )
 
-def bounded_random_walk( start_node: MarkovNode, terminal_nodes: List[MarkovNode], num_walks=1.E6 ) -> Tuple[Dict[MarkovNode,int],Dict[MarkovNode,List[float]]]:
+class ElapsedTimeSketch:
+    """A fixed-size, mergeable quantile sketch of elapsed times. Values are counted in logarithmically sized buckets, so
+    every quantile is within relative_accuracy of a recorded value. Values at or below min_value share one bucket
+    and are reported as 0, values above max_value are counted in the last bucket."""
+    def __init__( self, relative_accuracy=0.01, min_value=1E-4, max_value=1E8 ):
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.max_value = max_value
+        self.gamma = ( 1 + relative_accuracy ) / ( 1 - relative_accuracy )
+        self.log_gamma = math.log( self.gamma )
+        num_buckets = int( math.ceil( math.log( max_value / min_value ) / self.log_gamma ) )
+        # Bucket 0 holds values <= min_value, bucket i holds (min_value * gamma^(i-1), min_value * gamma^i]
+        self.bucket_counts = np.zeros( num_buckets+1, dtype=np.int64 )
+        self.count = 0
+
+    def add( self, values ):
+        """Add one elapsed time or an array of them"""
+        values = np.atleast_1d( np.asarray( values, dtype=np.float64 ) )
+        buckets = np.zeros( len(values), dtype=np.int64 )
+        above_min = values > self.min_value
+        buckets[above_min] = np.ceil( np.log( values[above_min] / self.min_value ) / self.log_gamma ).astype( np.int64 )
+        buckets = np.clip( buckets, 0, len(self.bucket_counts)-1 )
+        self.bucket_counts += np.bincount( buckets, minlength=len(self.bucket_counts) )
+        self.count += len(values)
+
+    def merge_in( self, other_sketch: 'ElapsedTimeSketch' ):
+        if ( self.relative_accuracy, self.min_value, self.max_value ) != ( other_sketch.relative_accuracy, other_sketch.min_value, other_sketch.max_value ):
+            raise ValueError( "Cannot merge sketches with different parameters" )
+        self.bucket_counts += other_sketch.bucket_counts
+        self.count += other_sketch.count
+
+    def percentiles( self, percentiles ) -> np.ndarray:
+        """Estimate the given percentiles (0-100, like np.percentile) of the added values"""
+        percentiles = np.asarray( percentiles, dtype=np.float64 )
+        if self.count == 0:
+            return np.full( len(percentiles), np.nan )
+        ranks = percentiles / 100. * ( self.count - 1 )
+        buckets = np.searchsorted( np.cumsum( self.bucket_counts ), ranks, side="right" )
+        # Midpoint (in relative terms) of each bucket
+        values = 2 * self.min_value * self.gamma ** buckets / ( 1 + self.gamma )
+        values[ buckets == 0 ] = 0.
+        return values
+
+    def __len__( self ) -> int:
+        return self.count
+
+def bounded_random_walk( start_node: MarkovNode, terminal_nodes: List[MarkovNode], num_walks=1.E6, sketch=False ) -> Tuple[Dict[MarkovNode,int],Dict[MarkovNode,List[float]]]:
     """ Conduct num_walks bound random walks from the start_node to one of the terminal_nodes. Normalizes probabilities
     by pruning away paths that do not reach terminal nodes. Returns a tuple where the first item is a dictionary of the number times we've hit the terminal
-    nodes and a dictionary representing the elapsed durations of how long it took to hit those terminal nodes (determined by MCMC)"""
+    nodes and a dictionary representing the elapsed durations of how long it took to hit those terminal nodes (determined by MCMC).
+    If sketch is set, each terminal node's elapsed durations are summarized into an ElapsedTimeSketch once the walks are done."""
 
     # Mark up the transitions so we have "railings" and know where we can go during our walk
-    bounded_dfs( start_node, terminal_nodes, allow_loops=False )
+    mark_good_paths( start_node, terminal_nodes )
     
     cur_walk = 0
     terminal_node_count = {} # type: Dict[MarkovNode, int]
@@ -226,55 +421,257 @@ def bounded_random_walk( start_node: MarkovNode, terminal_nodes: List[MarkovNode
             sampled_transition_time = cur_node.sample_transition_time( next_node )
             elapsed_ms += sampled_transition_time
             cur_node = next_node
-            
+
+    if sketch:
+        # Add each terminal node's times in one batch, since the sketch is built for adding arrays
+        for tn in terminal_nodes:
+            tn_sketch = ElapsedTimeSketch()
+            tn_sketch.add( node_elapsed_times[tn] )
+            node_elapsed_times[tn] = tn_sketch
+    return terminal_node_count, node_elapsed_times
+
+class CompiledWalkGraph:
+    """The good-path subgraph reachable from start_node, flattened into CSR-style arrays so that many bounded random
+    walks can be advanced at once. Run mark_good_paths from start_node to terminal_nodes before compiling.
+
+    Within each node's (and each edge's) segment, the cumulative probabilities (and CDF percentiles) are offset
+    by twice the segment number. That keeps every segment sorted and disjoint from its neighbours, so a single
+    searchsorted over the flat array picks the next transition (or transition time) for every walker at once."""
+
+    def __init__( self, start_node: MarkovNode, terminal_nodes: List[MarkovNode] ):
+        terminal_set = set( terminal_nodes )
+        self.nodes = [ start_node ] # type: List[MarkovNode]
+        node_index = { start_node: 0 } # type: Dict[MarkovNode, int]
+
+        node_edge_starts = [ 0 ]
+        edge_dsts = [] # type: List[int]
+        edge_keys = [] # type: List[float]
+        cdf_starts = [ 0 ]
+        cdf_keys = [] # type: List[np.ndarray]
+        cdf_vals = [] # type: List[np.ndarray]
+
+        # Breadth-first over good transitions, stopping at terminal nodes since walks end there
+        i = 0
+        while i < len( self.nodes ):
+            node = self.nodes[i]
+            valid_transitions = [] # type: List[TransitionRecord]
+            if node not in terminal_set:
+                valid_transitions = [ transition for transition in node.transitions if transition.is_good_path() ]
+            normalization_factor = sum( transition.prob for transition in valid_transitions )
+            assert( normalization_factor <= 1.1 ) # to handle floating point error
+
+            cum_prob = 0.
+            for transition in valid_transitions:
+                if transition.dst not in node_index:
+                    node_index[ transition.dst ] = len( self.nodes )
+                    self.nodes.append( transition.dst )
+                edge_id = len( edge_dsts )
+                edge_dsts.append( node_index[ transition.dst ] )
+                cum_prob += transition.prob / normalization_factor
+                edge_keys.append( 2*i + cum_prob )
+
+                if len( transition.cdf_values ) == 0:
+                    print( "Unknown Transition!" )
+                cdf_keys.append( 2*edge_id + np.array( transition.cdf_percentiles, dtype=np.float64 ) )
+                cdf_vals.append( np.array( transition.cdf_values, dtype=np.float64 ) )
+                cdf_starts.append( cdf_starts[-1] + len( transition.cdf_values ) )
+            node_edge_starts.append( len( edge_dsts ) )
+            i += 1
+
+        self.is_terminal = np.array( [ node in terminal_set for node in self.nodes ], dtype=bool )
+        self.node_edge_starts = np.array( node_edge_starts, dtype=np.int64 )
+        self.edge_dsts = np.array( edge_dsts, dtype=np.int64 )
+        self.edge_keys = np.array( edge_keys, dtype=np.float64 )
+        self.cdf_starts = np.array( cdf_starts, dtype=np.int64 )
+        self.cdf_keys = np.concatenate( cdf_keys + [ np.zeros( 0 ) ] )
+        self.cdf_vals = np.concatenate( cdf_vals + [ np.zeros( 0 ) ] )
+
+    def run_walks( self, num_walks: int, rng: np.random.Generator ) -> Tuple[np.ndarray, np.ndarray]:
+        """Walk num_walks walkers from the start node until each hits a terminal node. Returns the index (into self.nodes)
+        of the terminal node each walk ended at and its elapsed time."""
+        cur_nodes = np.zeros( num_walks, dtype=np.int64 )
+        elapsed_ms = np.zeros( num_walks, dtype=np.float64 )
+        active = np.nonzero( ~self.is_terminal[ cur_nodes ] )[0]
+
+        while len( active ) > 0:
+            nodes = cur_nodes[ active ]
+            edge_starts = self.node_edge_starts[ nodes ]
+            edge_ends = self.node_edge_starts[ nodes+1 ]
+            if np.any( edge_starts == edge_ends ):
+                raise ArithmeticError( "Ran out of normalized transition probabilities to walk! Normalization error?" )
+
+            # Pick the first transition whose cumulative probability covers the draw
+            edges = np.searchsorted( self.edge_keys, 2*nodes + rng.random( len( active ) ), side="left" )
+            edges = np.minimum( edges, edge_ends-1 )
+
+            # Pick the first percentile that covers the draw, or the last one if none do
+            cdf_starts = self.cdf_starts[ edges ]
+            cdf_ends = self.cdf_starts[ edges+1 ]
+            cdf_pos = np.searchsorted( self.cdf_keys, 2*edges + rng.random( len( active ) ), side="left" )
+            cdf_pos = np.minimum( cdf_pos, cdf_ends-1 )
+            has_cdf = cdf_starts != cdf_ends
+            elapsed_ms[ active[has_cdf] ] += self.cdf_vals[ cdf_pos[has_cdf] ]
+
+            cur_nodes[ active ] = self.edge_dsts[ edges ]
+            active = active[ ~self.is_terminal[ cur_nodes[ active ] ] ]
+
+        return cur_nodes, elapsed_ms
+
+    def __getstate__( self ):
+        # Walker processes only need the arrays, not the MarkovNodes (and everything they link to)
+        state = self.__dict__.copy()
+        del state['nodes']
+        return state
+
+# This process's copy of the CompiledWalkGraph, set by init_walk_worker. Pool workers each get their own copy,
+# pickled once through the pool's initargs rather than shared.
+worker_walk_graph = None # type: CompiledWalkGraph
+
+def init_walk_worker( walk_graph: CompiledWalkGraph ):
+    global worker_walk_graph
+    worker_walk_graph = walk_graph
+
+def run_walk_batch( args ):
+    """Run one batch of walks over worker_walk_graph with its own seeded random stream. Returns the terminal node
+    index and elapsed time of every walk, or with sketch set, an ElapsedTimeSketch per terminal node index."""
+    num_walks, seed_seq, sketch = args
+    end_nodes, end_times = worker_walk_graph.run_walks( num_walks, np.random.default_rng( seed_seq ) )
+    if not sketch:
+        return end_nodes, end_times
+
+    # Summarize here so only fixed-size sketches leave the worker
+    batch_sketches = {} # type: Dict[int, ElapsedTimeSketch]
+    for node_id in np.unique( end_nodes ):
+        batch_sketches[ int(node_id) ] = ElapsedTimeSketch()
+        batch_sketches[ int(node_id) ].add( end_times[ end_nodes == node_id ] )
+    return batch_sketches
+
+def bounded_random_walk_vectorized( start_node: MarkovNode, terminal_nodes: List[MarkovNode], num_walks=1.E6, batch_size=100000, seed=None, procs=1, sketch=False ) -> Tuple[Dict[MarkovNode,int],Dict[MarkovNode,Any]]:
+    """ Same as bounded_random_walk, but compiles the pruned graph into a CompiledWalkGraph and advances batch_size
+    walks at a time with NumPy. Elapsed times are returned as arrays rather than lists, or as an ElapsedTimeSketch
+    per terminal node if sketch is set, in which case memory no longer grows with num_walks.
+
+    Every batch draws from its own random stream spawned from seed, and batches are merged in order, so the
+    results for a given seed and batch_size are the same whether the batches are run here (procs=1) or spread
+    over a pool of procs processes."""
+
+    # Mark up the transitions so we have "railings" and know where we can go during our walk
+    mark_good_paths( start_node, terminal_nodes )
+    walk_graph = CompiledWalkGraph( start_node, terminal_nodes )
+
+    num_walks = int( num_walks )
+    batch_sizes = [ min( batch_size, num_walks - start ) for start in range( 0, num_walks, batch_size ) ]
+    batch_seeds = np.random.SeedSequence( seed ).spawn( len( batch_sizes ) )
+    batch_args = [ ( batch_walks, batch_seed, sketch ) for batch_walks, batch_seed in zip( batch_sizes, batch_seeds ) ]
+
+    if procs > 1:
+        with multiprocessing.Pool( procs, initializer=init_walk_worker, initargs=( walk_graph, ) ) as proc_pool:
+            return collect_walk_batches( walk_graph, terminal_nodes, proc_pool.imap( run_walk_batch, batch_args ), sketch )
+    init_walk_worker( walk_graph )
+    return collect_walk_batches( walk_graph, terminal_nodes, map( run_walk_batch, batch_args ), sketch )
+
+def collect_walk_batches( walk_graph: CompiledWalkGraph, terminal_nodes: List[MarkovNode], batch_results: Iterable[Any], sketch: bool ) -> Tuple[Dict[MarkovNode,int],Dict[MarkovNode,Any]]:
+    """Combine the run_walk_batch results, in batch order, into the dictionaries bounded_random_walk returns"""
+    if not sketch:
+        batch_results = list( batch_results )
+        end_nodes = np.concatenate( [ result[0] for result in batch_results ] + [ np.zeros( 0, dtype=np.int64 ) ] )
+        end_times = np.concatenate( [ result[1] for result in batch_results ] + [ np.zeros( 0 ) ] )
+        return group_walk_results( walk_graph, terminal_nodes, end_nodes, end_times )
+
+    terminal_node_count = {} # type: Dict[MarkovNode, int]
+    node_elapsed_times = {} # type: Dict[MarkovNode, Any]
+    for tn in terminal_nodes:
+        terminal_node_count[tn] = 0
+        node_elapsed_times[tn] = ElapsedTimeSketch()
+    for batch_sketches in batch_results:
+        for node_id, batch_sketch in batch_sketches.items():
+            tn = walk_graph.nodes[ node_id ]
+            node_elapsed_times[tn].merge_in( batch_sketch )
+            terminal_node_count[tn] += batch_sketch.count
+    return terminal_node_count, node_elapsed_times
+
+def group_walk_results( walk_graph: CompiledWalkGraph, terminal_nodes: List[MarkovNode], end_nodes: np.ndarray, end_times: np.ndarray ) -> Tuple[Dict[MarkovNode,int],Dict[MarkovNode,np.ndarray]]:
+    """Split per-walk terminal node indices and elapsed times into the per-terminal-node dictionaries bounded_random_walk returns"""
+    terminal_node_count = {} # type: Dict[MarkovNode, int]
+    node_elapsed_times = {} # type: Dict[MarkovNode, np.ndarray]
+    for tn in terminal_nodes:
+        terminal_node_count[tn] = 0
+        node_elapsed_times[tn] = np.zeros( 0 )
+
+    order = np.argsort( end_nodes, kind="stable" )
+    sorted_nodes = end_nodes[ order ]
+    node_ids, starts, counts = np.unique( sorted_nodes, return_index=True, return_counts=True )
+    for node_id, start, count in zip( node_ids, starts, counts ):
+        tn = walk_graph.nodes[ node_id ]
+        terminal_node_count[tn] = int( count )
+        node_elapsed_times[tn] = end_times[ order[ start:start+count ] ]
     return terminal_node_count, node_elapsed_times
 
-def depth_bounded_mcmc( start_node: MarkovNode, target_depth: int ) -> Tuple[Dict[MarkovNode, int], Dict[MarkovNode, List[float]]]:
+# Per start node, the sets of nodes reachable in exactly 1, 2, 3, ... transitions. See get_terminal_nodes_at_depth.
+# The levels hold weak references, since a strong one to the start node (or any node that leads back to it) from
+# its own entry would keep the entry, and the whole graph, alive forever.
+depth_frontier_cache = weakref.WeakKeyDictionary() # type: weakref.WeakKeyDictionary
+
+def get_terminal_nodes_at_depth( start_node: MarkovNode, target_depth: int ) -> Set[MarkovNode]:
+    """Get the set of nodes reachable from start_node in exactly target_depth transitions. The frontier is expanded
+    one level at a time with duplicates removed, and every level is cached per start node so that exploring other
+    depths from the same start node only expands the levels not seen yet. The cache entry goes away with the graph,
+    but does not track later changes to it; call depth_frontier_cache.clear() after adding transitions."""
+    if target_depth == 0:
+        return set( [ start_node ] )
+    frontiers = depth_frontier_cache.get( start_node )
+    if frontiers is None:
+        frontiers = [ frozenset( weakref.ref( transition.dst ) for transition in start_node.transitions ) ]
+        depth_frontier_cache[ start_node ] = frontiers
+    while len( frontiers ) < target_depth:
+        frontiers.append( frozenset( weakref.ref( transition.dst ) for node_ref in frontiers[-1] for transition in node_ref().transitions ) )
+    # Every node reachable from start_node is kept alive by it, so none of the references are dead
+    return set( node_ref() for node_ref in frontiers[ target_depth-1 ] )
+
+def depth_bounded_mcmc( start_node: MarkovNode, target_depth: int, vectorized=False, seed=None, procs=1, sketch=False ) -> Tuple[Dict[MarkovNode, int], Dict[MarkovNode, Any]]:
     """Do bounded random walks MCMC with terminal nodes equal to the set of all possible nodes at depth k.
-    If these nodes are also available at a higher depth, may terminate earlier (e.g. loops)"""
-    def get_terminal_nodes_at_k_depth( cur_node: MarkovNode, nodes, cur_depth, target_depth ):
-        if cur_depth == target_depth:
-            nodes.add( cur_node )
-            return
-        next_nodes = [ t.dst for t in cur_node.transitions ] # type: List[MarkovNode]
-        for nn in next_nodes:
-            get_terminal_nodes_at_k_depth( nn, nodes, cur_depth+1, target_depth )
-
-    nodes = set() # type: Set[MarkovNode]
-    cur_depth = 0
-    get_terminal_nodes_at_k_depth( start_node, nodes, 0, target_depth )
-    counts, elapsed_time = bounded_random_walk( start_node, list(nodes) )
+    If these nodes are also available at a higher depth, may terminate earlier (e.g. loops).
+    vectorized selects bounded_random_walk_vectorized over the pure Python bounded_random_walk. It is reproducible
+    for a given seed and can spread the walks over procs processes, but returns the elapsed times as arrays rather
+    than lists. If sketch is set, elapsed times are kept in fixed-size ElapsedTimeSketches either way."""
+    nodes = get_terminal_nodes_at_depth( start_node, target_depth )
+    if vectorized:
+        counts, elapsed_time = bounded_random_walk_vectorized( start_node, list(nodes), seed=seed, procs=procs, sketch=sketch )
+    else:
+        counts, elapsed_time = bounded_random_walk( start_node, list(nodes), sketch=sketch )
     return counts, elapsed_time
     
-def compute_percentiles_from_mcmc_results( timer_results: Dict[MarkovNode, List[float]] ) -> Dict[MarkovNode, List[float]]:
-    """ Compute percentiles from a dictionary of terminal nodes to elapsed times"""
+def compute_percentiles_from_mcmc_results( timer_results: Dict[MarkovNode, Any] ) -> Dict[MarkovNode, List[float]]:
+    """ Compute percentiles from a dictionary of terminal nodes to elapsed times (or ElapsedTimeSketches)"""
     percentiles = np.arange( 5,100, 5 )
     percentile_results = {} # type: Dict[MarkovNode, List[float]]
     for node, times in timer_results.items():
+        if isinstance( times, ElapsedTimeSketch ):
+            percentile_results[ node ] = times.percentiles( percentiles )
+            continue
         times_array = np.array( times )
         percentile_results[ node ] = np.percentile( times_array, percentiles )
     return percentile_results
 
-def get_data_from_postgres( conn, run_id ) -> Tuple[Dict[str,EventRecord], Dict[str,Dict[str,float]]]:
-    sql_stmt = "SELECT log_fname, log_line, log_probability FROM log_line_probabilities WHERE run_id = %s"
+def get_data_from_postgres( conn, run_id ) -> Tuple[Dict[int,EventRecord], Dict[int,Dict[int,float]]]:
+    """Get the event probabilities and transition probabilities of run_id, keyed by interned event id"""
     cur = conn.cursor()
-    cur.execute( sql_stmt, (run_id,) )
+    cur.execute( GET_EVENT_PROBS_QUERY, (run_id,) )
     rs = cur.fetchall()
-    events = {} # type: Dict[str, EventRecord]
+    events = {} # type: Dict[int, EventRecord]
     for row in rs:
         fname, ln, count = row
         event = EventRecord( fname, ln, count )
         events[event.get_id()] = event
         
-    sql_stmt = "SELECT log_initial_fname,log_initial_line, log_next_fname, log_next_line, transition_probability FROM log_line_transitions WHERE run_id = %s"
     cur = conn.cursor()
-    cur.execute( sql_stmt, (run_id,) )
+    cur.execute( GET_RUN_TRANSITION_PROBS_QUERY, (run_id,) )
     rs = cur.fetchall()
-    event_transitions = {} # type: Dict[str,Dict[str,float]]
+    event_transitions = {} # type: Dict[int,Dict[int,float]]
     for row in rs:
         initial_fname, initial_line, next_fname, next_line, prob = row
-        from_event_id = "{}:{}".format( initial_fname, initial_line )
-        to_event_id = "{}:{}".format( next_fname, next_line )
+        from_event_id = event_interner.get_id( initial_fname, initial_line )
+        to_event_id = event_interner.get_id( next_fname, next_line )
         if not from_event_id in event_transitions:
             event_transitions[from_event_id] = {}
         event_transitions[from_event_id][to_event_id] = prob
@@ -339,7 +736,42 @@ def do_calc_prob_diff( k: Any, events_1: Dict[Any, EventRecord], events_2: Dict[
         ratio_diff = 1.0
         return create_prob_diff_record( ratio_diff, event1_prob, event2_prob, event_fname, event_ln, is_left_greater)
 
-def compute_prob_diff( events_1: Dict[Any, EventRecord], events_2: Dict[Any, EventRecord] ) -> List[ProbDiffRecord]:
+class TopKRecords:
+    """Keep the k diff records with the largest diff seen so far in a bounded min-heap.
+    Records with equal diffs are kept in the order they were added."""
+    def __init__( self, k: int ):
+        self.k = k
+        self.heap = [] # type: List[Tuple[float, int, Any]]
+        self.num_added = 0
+
+    def accepts( self, diff: float ) -> bool:
+        """Would a record with this diff make it into the top k?"""
+        if self.k <= 0:
+            return False
+        return len(self.heap) < self.k or diff > self.heap[0][0]
+
+    def add( self, record ):
+        if self.k <= 0:
+            return
+        self.num_added += 1
+        entry = ( record.diff, -self.num_added, record )
+        if len(self.heap) < self.k:
+            heapq.heappush( self.heap, entry )
+        elif entry[:2] > self.heap[0][:2]:
+            heapq.heapreplace( self.heap, entry )
+
+    def get_sorted_records( self ) -> List[Any]:
+        return [ entry[2] for entry in sorted( self.heap, key=lambda entry: entry[:2], reverse=True ) ]
+
+def compute_prob_diff( events_1: Dict[Any, EventRecord], events_2: Dict[Any, EventRecord], top_k=None ) -> List[ProbDiffRecord]:
+    """Compute the probability differences for all events, sorted by decreasing ratio.
+    If top_k is set, only the top_k largest differences are kept."""
+    if top_k is not None:
+        top_prob_diffs = TopKRecords( top_k )
+        for k in set(events_1.keys()).union(events_2.keys()):
+            top_prob_diffs.add( do_calc_prob_diff( k, events_1, events_2 ) )
+        return top_prob_diffs.get_sorted_records()
+
     prob_diffs = [] # type: List[ProbDiffRecord]
     for k in set(events_1.keys()).union(events_2.keys()):
         p_diff = do_calc_prob_diff( k, events_1, events_2)
@@ -347,10 +779,15 @@ def compute_prob_diff( events_1: Dict[Any, EventRecord], events_2: Dict[Any, Eve
     prob_diffs.sort(key=lambda diff_record: diff_record.diff, reverse=True)
     return prob_diffs
 
-def compute_transition_diff( events_1: Dict[int, EventRecord], events_2: Dict[int, EventRecord], event_transitions1: Dict[int, Dict[int, float]], event_transitions2: Dict[int, Dict[int,float]] ) -> Tuple[float, List[TransitionDiffRecord], List[TransitionDiffRecord]]:
+def compute_transition_diff( events_1: Dict[int, EventRecord], events_2: Dict[int, EventRecord], event_transitions1: Dict[int, Dict[int, float]], event_transitions2: Dict[int, Dict[int,float]], top_k=None ) -> Tuple[float, List[TransitionDiffRecord], List[TransitionDiffRecord]]:
+    """Compute the aggregate score and the score/transition ratio differences over every pair of events.
+    If top_k is set, Inf ratios are dropped as they are computed and only the top_k largest ratios of
+    each kind are kept in bounded heaps instead of sorting every pair."""
     agg_score = 0.
     score_diffs = []
     raw_transition_diffs = []
+    top_score_diffs = TopKRecords( top_k ) if top_k is not None else None
+    top_raw_transition_diffs = TopKRecords( top_k ) if top_k is not None else None
     for k in set(events_1).union(events_2):
         for k2 in set(events_1).union(events_2):
             events_1_prob = 0.0
@@ -383,24 +820,125 @@ def compute_transition_diff( events_1: Dict[int, EventRecord], events_2: Dict[in
             else:
                 trans_ratio_diff = max_transition_score / min_transition_score
             
+            if top_k is not None:
+                keep_score = ratio_diff != float('Inf') and top_score_diffs.accepts( ratio_diff )
+                keep_trans = trans_ratio_diff != float('Inf') and top_raw_transition_diffs.accepts( trans_ratio_diff )
+                if not keep_score and not keep_trans:
+                    continue
+
             fname_1 = events_1[k].event_loc.fname if k in events_1 else events_2[k].event_loc.fname
             line_1 = events_1[k].event_loc.line_number if k in events_1 else events_2[k].event_loc.line_number
             fname_2 = events_1[k2].event_loc.fname if k2 in events_1 else events_2[k2].event_loc.fname
             line_2 = events_1[k2].event_loc.line_number if k2 in events_1 else events_2[k2].event_loc.line_number
             
+            if top_k is not None:
+                if keep_score:
+                    top_score_diffs.add( create_transition_diff_record( ratio_diff, events_1_score, events_2_score, fname_1, line_1,
+                                                                        fname_2, line_2, is_left_greater ) )
+                if keep_trans:
+                    top_raw_transition_diffs.add( create_transition_diff_record( trans_ratio_diff, events_1_trans_prob, events_2_trans_prob,
+                                                                                 fname_1, line_1, fname_2, line_2, is_left_greater ) )
+                continue
+
             score_diffs.append( create_transition_diff_record( ratio_diff, events_1_score, events_2_score, fname_1, line_1,
                                                               fname_2, line_2, is_left_greater ) )
             raw_transition_diffs.append( create_transition_diff_record( trans_ratio_diff, events_1_trans_prob, events_2_trans_prob,
                                                                        fname_1, line_1, fname_2, line_2, is_left_greater ))
+    if top_k is not None:
+        return agg_score, top_score_diffs.get_sorted_records(), top_raw_transition_diffs.get_sorted_records()
     score_diffs.sort(key=lambda diff_record: diff_record.diff, reverse=True)
     raw_transition_diffs.sort(key=lambda diff_record: diff_record.diff, reverse=True)
     return agg_score, score_diffs, raw_transition_diffs
                 
-def compute_difference( events_1: Dict[int, EventRecord], event_t_1: Dict[int, Dict[int, float]], events_2: Dict[int, EventRecord], event_t_2: Dict[int, Dict[int, float]] ) -> Tuple[ float, List[ProbDiffRecord], List[TransitionDiffRecord], List[TransitionDiffRecord]]:
+def build_sparse_transition_scores( events: Dict[int, EventRecord], event_transitions: Dict[int, Dict[int, float]], event_index: Dict[Any, int] ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Flatten the transitions of one run into parallel arrays of (src_index * num_events + dst_index) keys,
+    transition probabilities and scores (event probability * transition probability). Only transitions between
+    events in event_index whose source event is in events are kept, matching compute_transition_diff."""
+    num_events = len( event_index )
+    keys = [] # type: List[int]
+    trans_probs = [] # type: List[float]
+    event_probs = [] # type: List[float]
+    for k, dsts in event_transitions.items():
+        if k not in events:
+            continue
+        src_index = event_index[k] * num_events
+        event_prob = events[k].prob
+        for k2, trans_prob in dsts.items():
+            dst_index = event_index.get( k2 )
+            if dst_index is None:
+                continue
+            keys.append( src_index + dst_index )
+            trans_probs.append( trans_prob )
+            event_probs.append( event_prob )
+    trans_prob_arr = np.array( trans_probs, dtype=np.float64 )
+    return np.array( keys, dtype=np.int64 ), trans_prob_arr, trans_prob_arr * np.array( event_probs, dtype=np.float64 )
+
+def compute_transition_diff_sparse( events_1: Dict[int, EventRecord], events_2: Dict[int, EventRecord], event_transitions1: Dict[int, Dict[int, float]], event_transitions2: Dict[int, Dict[int,float]], top_k=None ) -> Tuple[float, List[TransitionDiffRecord], List[TransitionDiffRecord]]:
+    """Compute the same differences as compute_transition_diff over only the transitions present in either run.
+    Pairs that neither run has contribute nothing to agg_score and only ever produce Inf ratios, so they are never
+    materialized. Records with Inf ratios are left out of the returned lists. If top_k is set, records are only
+    built for the top_k largest ratios."""
+    all_events = list( set(events_1).union(events_2) )
+    event_index = { k: i for i, k in enumerate( all_events ) }
+    num_events = len( all_events )
+
+    keys1, trans_probs1, scores1 = build_sparse_transition_scores( events_1, event_transitions1, event_index )
+    keys2, trans_probs2, scores2 = build_sparse_transition_scores( events_2, event_transitions2, event_index )
+
+    # Align both runs on the union of their non-zero transitions
+    all_keys = np.union1d( keys1, keys2 )
+    left_trans = np.zeros( len(all_keys) )
+    right_trans = np.zeros( len(all_keys) )
+    left_scores = np.zeros( len(all_keys) )
+    right_scores = np.zeros( len(all_keys) )
+    pos1 = np.searchsorted( all_keys, keys1 )
+    pos2 = np.searchsorted( all_keys, keys2 )
+    left_trans[pos1] = trans_probs1
+    left_scores[pos1] = scores1
+    right_trans[pos2] = trans_probs2
+    right_scores[pos2] = scores2
+
+    agg_score = float( np.sum( ( left_scores - right_scores ) ** 2 ) )
+    is_left_greater = left_scores > right_scores
+
+    def get_loc( k ) -> FileLocation:
+        return events_1[k].event_loc if k in events_1 else events_2[k].event_loc
+
+    def build_records( lefts: np.ndarray, rights: np.ndarray ) -> List[TransitionDiffRecord]:
+        min_vals = np.minimum( lefts, rights )
+        finite = np.nonzero( min_vals > 0.0 )[0]
+        ratios = np.maximum( lefts[finite], rights[finite] ) / min_vals[finite]
+        if top_k is not None and top_k < len(ratios):
+            # Find the k-th largest ratio without sorting everything, then order just the ratios at least as large.
+            # Ties at the cut are kept in transition order, as TopKRecords keeps them, instead of argpartition's order.
+            kth_ratio = -np.partition( -ratios, top_k - 1 )[ top_k - 1 ]
+            top = np.nonzero( ratios >= kth_ratio )[0]
+            order = top[ np.argsort( -ratios[top], kind="stable" ) ][:top_k]
+        else:
+            order = np.argsort( -ratios, kind="stable" )
+        records = [] # type: List[TransitionDiffRecord]
+        for i in order:
+            pos = finite[i]
+            src_loc = get_loc( all_events[ all_keys[pos] // num_events ] )
+            dst_loc = get_loc( all_events[ all_keys[pos] % num_events ] )
+            records.append( create_transition_diff_record( float(ratios[i]), float(lefts[pos]), float(rights[pos]), src_loc.fname, src_loc.line_number,
+                                                           dst_loc.fname, dst_loc.line_number, bool(is_left_greater[pos]) ) )
+        return records
+
+    score_diffs = build_records( left_scores, right_scores )
+    raw_transition_diffs = build_records( left_trans, right_trans )
+    return agg_score, score_diffs, raw_transition_diffs
+
+def compute_difference( events_1: Dict[int, EventRecord], event_t_1: Dict[int, Dict[int, float]], events_2: Dict[int, EventRecord], event_t_2: Dict[int, Dict[int, float]], sparse=True, top_k=None ) -> Tuple[ float, List[ProbDiffRecord], List[TransitionDiffRecord], List[TransitionDiffRecord]]:
+    """Compute the aggregate difference and the ranked difference lists between two runs.
+    If top_k is set, each ranked list holds at most top_k records and is selected without a full sort."""
     
-    prob_diffs = compute_prob_diff( events_1, events_2 )
+    prob_diffs = compute_prob_diff( events_1, events_2, top_k )
     
-    agg_score, score_diffs, raw_transition_diffs = compute_transition_diff( events_1, events_2, event_t_1, event_t_2 )
+    if sparse:
+        agg_score, score_diffs, raw_transition_diffs = compute_transition_diff_sparse( events_1, events_2, event_t_1, event_t_2, top_k )
+    else:
+        agg_score, score_diffs, raw_transition_diffs = compute_transition_diff( events_1, events_2, event_t_1, event_t_2, top_k )
     
     # Prune out transitions that don't exist in one for the purposes of ranked list
     #prob_diffs = list(filter(lambda x: x[0] != float('Inf'), prob_diffs))
@@ -471,33 +1009,36 @@ def show_transition_graph( start_node: MarkovNode, depth=1, filter_function=lamb
 
 def show_mcmc_graph( start_event_id, events, event_transitions, target_depth, depth_bounded_mcmc_results ):
     def remap_event_id( event_id ):
-        return event_id.replace(":", "-")
+        return event_interner.get_name( event_id ).replace(":", "-")
 
     def build_transition_graph( graph, event_id, events, event_transitions, mcmc_results, depth ):
         event = events[event_id]
-        graph.node( remap_event_id( event_id ), event_id )
+        graph.node( remap_event_id( event_id ), event_interner.get_name( event_id ) )
         transitions = event_transitions[ event_id ]
         if depth == 0:
             return
         for transition in transitions:
-            graph.node( remap_event_id( transition ), transition )
+            graph.node( remap_event_id( transition ), event_interner.get_name( transition ) )
             # 50th percentile
             edge_label = "{:<5f}".format( mcmc_results[ event_id ][ transition ][ 9 ] )
             graph.edge( remap_event_id( event_id ), remap_event_id( transition ), label=edge_label )
             build_transition_graph( graph, transition, events, event_transitions, mcmc_results, depth-1 )
 
-    graph = graphviz.Digraph(comment="{} Event MCMC, Depth={}".format( start_event_id, target_depth ) )
+    graph = graphviz.Digraph(comment="{} Event MCMC, Depth={}".format( event_interner.get_name( start_event_id ), target_depth ) )
 
     mcmc_dict = {}
     for key in depth_bounded_mcmc_results:
         ptls = depth_bounded_mcmc_results[ key ]
-        dst_id = key.get_key()
+        dst_id = key.event_id
         if not start_event_id in mcmc_dict:
             mcmc_dict[ start_event_id ] = {}
         mcmc_dict[ start_event_id ][ dst_id ] = ptls
     build_transition_graph( graph, start_event_id, events, event_transitions, mcmc_dict, target_depth )
     return graph
 
+# The percentile positions at which transition time CDFs are stored
+CDF_PERCENTILES = [ 0.05, 0.1, 0.15, 0.2, 0.25, 0.3, 0.35, 0.4, 0.45, 0.5, 0.55, 0.6, 0.65, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95, 0.99, 0.999 ]
+
 def generate_distance_matrix( percentile_vec ):
     """Compute the pairwise distance between every set of percentile "positions". Since the percentiles
     are not equally spread, some may be farther apart than others, which corresponds to more "distance" in terms of EMD"""
@@ -511,6 +1052,19 @@ def get_cdf( conn, src_fname: str, src_line: int, dst_fname: str, dst_line: int,
     results = cur.fetchall()
     return results
 
+def get_paired_cdfs( conn, run_id1: int, run_id2: int, min_transition_count=1000, itersize=2000 ) -> Iterable[Tuple[str,int,str,int,List[float],List[float]]]:
+    """Get the CDF percentile values of every transition that has a CDF in both runs and occurred more than
+    min_transition_count times in either of them, as (src_fname, src_line, dst_fname, dst_line, cdf_vals1, cdf_vals2).
+    Rows are streamed through a server-side cursor."""
+    cur = conn.cursor( name="paired_cdfs_{}_{}".format( run_id1, run_id2 ) )
+    cur.itersize = itersize
+    try:
+        cur.execute( PAIRED_CDF_QUERY, { "run_id1": run_id1, "run_id2": run_id2, "min_transition_count": min_transition_count } )
+        for row in cur:
+            yield row
+    finally:
+        cur.close()
+
 def do_emd( args ):
     src_fname, src_line, dst_fname, dst_line, cdf_vals1, cdf_vals2, dist_mat, normalize = args
     
@@ -527,71 +1081,414 @@ def do_emd( args ):
     return (emd_score, src_fname, src_line, dst_fname, dst_line )
 
 
-def get_emd_scores_for_transitions( conn, run_id1: int, run_id2: int, normalize=True, procs=1 ):
-    percentiles = [0.05,
-         0.1,
-         0.15,
-         0.2,
-         0.25,
-         0.3,
-         0.35,
-         0.4,
-         0.45,
-         0.5,
-         0.55,
-         0.6,
-         0.65,
-         0.7,
-         0.75,
-         0.8,
-         0.85,
-         0.9,
-         0.95,
-         0.99,
-         0.999 ]
-    dist_mat = generate_distance_matrix( percentiles )
-    transition_cdf_query = """SELECT DISTINCT(src_fname, src_line, dst_fname, dst_line) FROM transition_cdfs,
-        log_line_transitions, log_line_probabilities
-        WHERE src_fname = log_initial_fname and src_line = log_initial_line and dst_fname = log_next_fname and dst_line = log_next_line
-        and log_line_transitions.run_id = transition_cdfs.run_id and log_line_transitions.run_id = log_line_probabilities.run_id and 
-        log_fname = src_fname and log_line = src_line and transition_count > 1000 and 
-        (transition_cdfs.run_id = %s OR transition_cdfs.run_id = %s)"""
+def emd_closed_form_batch( cdf_vals1: np.ndarray, cdf_vals2: np.ndarray, percentile_vec, normalize=True ) -> np.ndarray:
+    """Compute the same EMD as do_emd for every row of two (n_transitions x len(percentile_vec)) arrays at once.
+
+    The percentile positions lie on a line, so the transport can be written as flows across the gaps between
+    adjacent positions. pyemd charges unmatched mass the maximum ground distance, which we model as a dummy bin
+    that is that far from every position. The only choice left is where along the line the unmatched mass leaves
+    (or enters), i.e. a non-decreasing cumulative profile X in [0, |mass difference|]; the cost
+    sum_k gap_k * |net_k - X_k| is then minimized by a small dynamic program over the candidate values of X
+    (the clipped cumulative net flows and the two bounds), run for all rows in lock step."""
+    cdf_vals1 = np.asarray( cdf_vals1, dtype=np.float64 )
+    cdf_vals2 = np.asarray( cdf_vals2, dtype=np.float64 )
+    positions = np.asarray( percentile_vec, dtype=np.float64 )
+    if normalize:
+        max_vals = np.maximum( cdf_vals1[:,-1], cdf_vals2[:,-1] )[:,None]
+        cdf_vals1 = cdf_vals1 / max_vals
+        cdf_vals2 = cdf_vals2 / max_vals
+
+    gaps = np.diff( positions )
+    extra_mass_penalty = positions.max() - positions.min()
+
+    net_flow = np.cumsum( cdf_vals1 - cdf_vals2, axis=1 )
+    mass_diff = net_flow[:,-1]
+    extra_mass = np.abs( mass_diff )[:,None]
+    # Orient each row so that the unmatched mass always leaves the line
+    net_flow = np.where( mass_diff[:,None] >= 0, net_flow[:,:-1], -net_flow[:,:-1] )
+
+    levels = np.concatenate( [ np.clip( net_flow, 0., extra_mass ), np.zeros_like( extra_mass ), extra_mass ], axis=1 )
+    levels.sort( axis=1 )
+
+    cost = gaps[0] * np.abs( net_flow[:,0:1] - levels )
+    for k in range( 1, len(gaps) ):
+        cost = np.minimum.accumulate( cost, axis=1 ) + gaps[k] * np.abs( net_flow[:,k:k+1] - levels )
+    return extra_mass_penalty * extra_mass[:,0] + cost.min( axis=1 )
+
+def get_emd_scores_for_transitions( conn, run_id1: int, run_id2: int, normalize=True, procs=1, backend="pyemd", batch_size=10000 ):
+    """Compute the EMD between the transition time CDFs of run_id1 and run_id2 for every frequent transition they share.
+    backend selects pyemd (one transport solve per transition, spread over procs processes) or closed_form
+    (emd_closed_form_batch over batch_size transitions at a time)."""
+    if backend == "closed_form":
+        emd_scores = []
+        batch = [] # type: List[Tuple[str,int,str,int,List[float],List[float]]]
+
+        def score_batch():
+            scores = emd_closed_form_batch( [ row[4] for row in batch ], [ row[5] for row in batch ], CDF_PERCENTILES, normalize )
+            for score, row in zip( scores, batch ):
+                emd_scores.append( ( float(score), row[0], row[1], row[2], row[3] ) )
+            batch.clear()
+
+        for row in get_paired_cdfs( conn, run_id1, run_id2 ):
+            batch.append( row )
+            if len(batch) >= batch_size:
+                score_batch()
+        if batch:
+            score_batch()
+        return emd_scores
+
+    if backend != "pyemd":
+        raise ValueError( "Unknown EMD backend: {}".format( backend ) )
+
+    dist_mat = generate_distance_matrix( CDF_PERCENTILES )
+    emd_args = ( (src_fname, src_line, dst_fname, dst_line, cdf_vals1, cdf_vals2, dist_mat, normalize)
+        for src_fname, src_line, dst_fname, dst_line, cdf_vals1, cdf_vals2 in get_paired_cdfs( conn, run_id1, run_id2 ) )
+
+    # Feed transitions to the pool as the rows arrive rather than after all of them have been fetched
+    with multiprocessing.Pool( procs ) as proc_pool:
+        emd_scores = list( proc_pool.imap( do_emd, emd_args, chunksize=64 ) )
+    return emd_scores
+
+RUN_MODEL_CACHE_VERSION = 1
+DEFAULT_RUN_MODEL_CACHE_BYTES = 1 << 30
+
+GET_RUN_TRANSITIONS_QUERY = "SELECT log_initial_fname, log_initial_line, log_next_fname, log_next_line, transition_probability, transition_count FROM log_line_transitions WHERE run_id = %s"
+
+GET_RUN_CDFS_QUERY = """SELECT DISTINCT ON (src_fname, src_line, dst_fname, dst_line) src_fname, src_line, dst_fname, dst_line, percentile_values
+    FROM transition_cdfs WHERE run_id = %s"""
+
+class RunModel:
+    """A run's events, transitions and transition time CDFs as arrays over a table of the event locations in the run,
+    so that it can be saved to and loaded from a single .npz file"""
+    ARRAYS = [ 'loc_fnames', 'loc_lines', 'event_locs', 'event_probs', 'transition_srcs', 'transition_dsts',
+               'transition_probs', 'transition_counts', 'cdf_srcs', 'cdf_dsts', 'cdf_values' ]
+
+    def __init__( self, **arrays ):
+        for name in RunModel.ARRAYS:
+            setattr( self, name, arrays[name] )
+
+    @staticmethod
+    def from_rows( event_rows: Iterable[Tuple[str,int,float]], transition_rows: Iterable[Tuple[str,int,str,int,float,int]],
+                   cdf_rows: Iterable[Tuple[str,int,str,int,List[float]]] ) -> 'RunModel':
+        """Build a model from the rows of the run's log_line_probabilities, log_line_transitions and transition_cdfs"""
+        loc_ids = {} # type: Dict[Tuple[str,int],int]
+        def get_loc_id( fname: str, line: int ) -> int:
+            return loc_ids.setdefault( ( fname, line ), len( loc_ids ) )
+
+        event_rows = list( event_rows )
+        transition_rows = list( transition_rows )
+        cdf_rows = list( cdf_rows )
+        event_locs = [ get_loc_id( fname, ln ) for fname, ln, prob in event_rows ]
+        transition_srcs = [ get_loc_id( src_fname, src_line ) for src_fname, src_line, dst_fname, dst_line, prob, count in transition_rows ]
+        transition_dsts = [ get_loc_id( dst_fname, dst_line ) for src_fname, src_line, dst_fname, dst_line, prob, count in transition_rows ]
+        cdf_srcs = [ get_loc_id( src_fname, src_line ) for src_fname, src_line, dst_fname, dst_line, vals in cdf_rows ]
+        cdf_dsts = [ get_loc_id( dst_fname, dst_line ) for src_fname, src_line, dst_fname, dst_line, vals in cdf_rows ]
+        return RunModel(
+            loc_fnames=np.array( [ fname for fname, line in loc_ids ], dtype=np.str_ ),
+            loc_lines=np.array( [ line for fname, line in loc_ids ], dtype=np.int64 ),
+            event_locs=np.array( event_locs, dtype=np.int64 ),
+            event_probs=np.array( [ prob for fname, ln, prob in event_rows ], dtype=np.float64 ),
+            transition_srcs=np.array( transition_srcs, dtype=np.int64 ),
+            transition_dsts=np.array( transition_dsts, dtype=np.int64 ),
+            transition_probs=np.array( [ row[4] for row in transition_rows ], dtype=np.float64 ),
+            transition_counts=np.array( [ row[5] for row in transition_rows ], dtype=np.int64 ),
+            cdf_srcs=np.array( cdf_srcs, dtype=np.int64 ),
+            cdf_dsts=np.array( cdf_dsts, dtype=np.int64 ),
+            cdf_values=np.array( [ vals for src_fname, src_line, dst_fname, dst_line, vals in cdf_rows ], dtype=np.float64 ) if cdf_rows else np.zeros( ( 0, len( CDF_PERCENTILES ) ) ) )
+
+    def save( self, fname: str, metadata: Dict[str,str] ):
+        with open( fname, "wb" ) as f:
+            np.savez( f, **{ name: getattr( self, name ) for name in RunModel.ARRAYS },
+                      **{ "meta_" + key: np.array( value, dtype=np.str_ ) for key, value in metadata.items() } )
+
+    @staticmethod
+    def load( fname: str ) -> Tuple['RunModel', Dict[str,str]]:
+        with np.load( fname, allow_pickle=False ) as npz:
+            model = RunModel( **{ name: npz[name] for name in RunModel.ARRAYS } )
+            metadata = { key[len("meta_"):]: str( npz[key] ) for key in npz.files if key.startswith( "meta_" ) }
+        return model, metadata
+
+    def get_loc_ids( self ) -> np.ndarray:
+        """Intern every location of the run, giving the interned event id of each"""
+        return np.array( [ event_interner.get_id( fname, line ) for fname, line in zip( self.loc_fnames.tolist(), self.loc_lines.tolist() ) ], dtype=np.int64 )
+
+    def get_data( self ) -> Tuple[Dict[int,EventRecord], Dict[int,Dict[int,float]]]:
+        """Get the event probabilities and transition probabilities of the run, as get_data_from_postgres does"""
+        loc_fnames = self.loc_fnames.tolist()
+        loc_lines = self.loc_lines.tolist()
+        events = {} # type: Dict[int, EventRecord]
+        for loc, prob in zip( self.event_locs.tolist(), self.event_probs.tolist() ):
+            event = EventRecord( loc_fnames[loc], loc_lines[loc], prob )
+            events[event.get_id()] = event
+
+        loc_ids = self.get_loc_ids().tolist()
+        event_transitions = {} # type: Dict[int,Dict[int,float]]
+        for src, dst, prob in zip( self.transition_srcs.tolist(), self.transition_dsts.tolist(), self.transition_probs.tolist() ):
+            from_event_id = loc_ids[src]
+            if not from_event_id in event_transitions:
+                event_transitions[from_event_id] = {}
+            event_transitions[from_event_id][loc_ids[dst]] = prob
+        return events, event_transitions
+
+    def get_frequent_transitions( self, min_transition_count: int ) -> Set[Tuple[int,int]]:
+        """Get the interned (src, dst) event ids of the transitions that occurred more than min_transition_count times
+        from an event with a probability in the run"""
+        loc_ids = self.get_loc_ids()
+        frequent = ( self.transition_counts > min_transition_count ) & np.isin( self.transition_srcs, self.event_locs )
+        return set( zip( loc_ids[ self.transition_srcs[frequent] ].tolist(), loc_ids[ self.transition_dsts[frequent] ].tolist() ) )
+
+    def get_cdf_index( self ) -> Dict[Tuple[int,int],int]:
+        """Map the interned (src, dst) event ids of each transition with a CDF to its row in cdf_values"""
+        loc_ids = self.get_loc_ids()
+        return dict( zip( zip( loc_ids[ self.cdf_srcs ].tolist(), loc_ids[ self.cdf_dsts ].tolist() ), range( len( self.cdf_srcs ) ) ) )
+
+def get_run_model_from_postgres( conn, run_id: int ) -> RunModel:
+    """Get everything compute_top_sent_diffs.py compares about run_id in three queries"""
     cur = conn.cursor()
-    cur.execute( transition_cdf_query, (run_id1, run_id2) )
-    results = cur.fetchall()
+    cur.execute( GET_EVENT_PROBS_QUERY, ( run_id, ) )
+    event_rows = cur.fetchall()
+    cur.execute( GET_RUN_TRANSITIONS_QUERY, ( run_id, ) )
+    transition_rows = cur.fetchall()
+    cur.execute( GET_RUN_CDFS_QUERY, ( run_id, ) )
+    cdf_rows = cur.fetchall()
     cur.close()
+    return RunModel.from_rows( event_rows, transition_rows, cdf_rows )
 
-    proc_pool = multiprocessing.Pool( procs )
-    all_args = []
-    for result in results:
-        field = result[0]
-        
-        # DB merges these fields together in distinct, need to split them out
-        src_fname, src_line, dst_fname, dst_line = field.split(",")
-        dst_line = dst_line[:-1] #Remove trailing commas
-        src_fname = src_fname[1:] #Remove leading (
-        
-        # Get CDFs
-        cdf_vals1 = get_cdf( conn, src_fname, int(src_line), dst_fname, int(dst_line), run_id1 )
-        cdf_vals2 = get_cdf( conn, src_fname, int(src_line), dst_fname, int(dst_line), run_id2 )
-        if not cdf_vals1 or not cdf_vals2:
-            continue
+def get_db_identity( conn ) -> str:
+    dsn_params = conn.get_dsn_parameters()
+    return "{}:{}/{}".format( dsn_params.get( "host", "" ), dsn_params.get( "port", "" ), dsn_params.get( "dbname", "" ) )
 
-        cdf_vals1 = cdf_vals1[0][0]
-        cdf_vals2 = cdf_vals2[0][0]
+def get_run_creation_time( conn, run_id: int ) -> str:
+    """Get when run_id was loaded, which changes if the run is deleted and loaded again"""
+    cur = conn.cursor()
+    cur.execute( "SELECT creation_time FROM run_identifier WHERE id = %s", ( run_id, ) )
+    row = cur.fetchone()
+    cur.close()
+    return str( row[0] ) if row is not None else ""
+
+class RunModelCache:
+    """An on-disk cache of RunModels, one .npz file per run named by a hash of the database and run ID.
+    Finished runs do not change, but a cached model is still refetched if its run's creation_time in run_identifier
+    no longer matches, i.e. the run was reloaded. Files are touched when used, and the least recently used files
+    are evicted whenever the cache grows past max_bytes."""
+
+    def __init__( self, cache_dir: str, max_bytes: int = DEFAULT_RUN_MODEL_CACHE_BYTES ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs( cache_dir, exist_ok=True )
+
+    def get_cache_fname( self, db_identity: str, run_id: int ) -> str:
+        key = "{}\0{}\0{}".format( RUN_MODEL_CACHE_VERSION, db_identity, run_id )
+        return os.path.join( self.cache_dir, hashlib.sha256( key.encode() ).hexdigest() + ".npz" )
+
+    def get( self, conn, run_id: int ) -> RunModel:
+        """Get run_id's model from the cache, fetching and caching it if it is missing or stale"""
+        db_identity = get_db_identity( conn )
+        creation_time = get_run_creation_time( conn, run_id )
+        cache_fname = self.get_cache_fname( db_identity, run_id )
+        if os.path.exists( cache_fname ):
+            try:
+                model, metadata = RunModel.load( cache_fname )
+                if metadata == { "db_identity": db_identity, "run_id": str( run_id ), "creation_time": creation_time }:
+                    os.utime( cache_fname )
+                    return model
+            except ( OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile ):
+                # Truncated or from an older version, so refetch it
+                pass
+
+        model = get_run_model_from_postgres( conn, run_id )
+        # Write to a temporary file first, so that a concurrent reader never sees a partial file
+        tmp_fname = "{}.{}.tmp".format( cache_fname, os.getpid() )
+        try:
+            model.save( tmp_fname, { "db_identity": db_identity, "run_id": str( run_id ), "creation_time": creation_time } )
+            os.replace( tmp_fname, cache_fname )
+        finally:
+            if os.path.exists( tmp_fname ):
+                os.remove( tmp_fname )
+        self.evict( keep=cache_fname )
+        return model
 
-        all_args.append( (src_fname, src_line, dst_fname, dst_line, cdf_vals1, cdf_vals2, dist_mat, normalize) )
-    emd_scores = proc_pool.map( do_emd, all_args )
-    return emd_scores
+    def invalidate( self, conn, run_id: int ):
+        """Drop run_id's cached model"""
+        try:
+            os.remove( self.get_cache_fname( get_db_identity( conn ), run_id ) )
+        except FileNotFoundError:
+            pass
+
+    def clear( self ):
+        for cache_fname in glob.glob( os.path.join( self.cache_dir, "*.npz" ) ):
+            os.remove( cache_fname )
+
+    def evict( self, keep: str = None ):
+        """Remove the least recently used models until the cache fits in max_bytes, never removing keep"""
+        entries = []
+        for cache_fname in glob.glob( os.path.join( self.cache_dir, "*.npz" ) ):
+            try:
+                st = os.stat( cache_fname )
+            except FileNotFoundError:
+                continue
+            entries.append( ( st.st_mtime, st.st_size, cache_fname ) )
+        total_bytes = sum( size for mtime, size, cache_fname in entries )
+        for mtime, size, cache_fname in sorted( entries ):
+            if total_bytes <= self.max_bytes:
+                break
+            if cache_fname == keep:
+                continue
+            try:
+                os.remove( cache_fname )
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+
+def get_paired_model_cdfs( model1: RunModel, model2: RunModel, min_transition_count=1000 ) -> Tuple[List[Tuple[str,int,str,int]], np.ndarray, np.ndarray]:
+    """Pair the CDFs of every transition that has a CDF in both runs and occurred more than min_transition_count
+    times in either of them, as get_paired_cdfs does in the database. Returns the transitions and the two runs'
+    (n_transitions x n_percentiles) percentile values."""
+    cdf_index1 = model1.get_cdf_index()
+    cdf_index2 = model2.get_cdf_index()
+    frequent = model1.get_frequent_transitions( min_transition_count ) | model2.get_frequent_transitions( min_transition_count )
+    paired = [ ( key, cdf_index1[key], cdf_index2[key] ) for key in cdf_index1 if key in cdf_index2 and key in frequent ]
+    transitions = [ ( event_interner.get_location( src ).fname, event_interner.get_location( src ).line_number,
+                      event_interner.get_location( dst ).fname, event_interner.get_location( dst ).line_number ) for ( src, dst ), i, j in paired ]
+    rows1 = np.array( [ i for key, i, j in paired ], dtype=np.int64 )
+    rows2 = np.array( [ j for key, i, j in paired ], dtype=np.int64 )
+    return transitions, model1.cdf_values[rows1], model2.cdf_values[rows2]
+
+def get_emd_scores_for_run_models( model1: RunModel, model2: RunModel, normalize=True, procs=1, backend="pyemd", min_transition_count=1000 ):
+    """Compute the same EMD scores as get_emd_scores_for_transitions from two runs' models instead of the database"""
+    transitions, cdf_vals1, cdf_vals2 = get_paired_model_cdfs( model1, model2, min_transition_count )
+    if backend == "closed_form":
+        scores = emd_closed_form_batch( cdf_vals1, cdf_vals2, CDF_PERCENTILES, normalize ) if transitions else []
+        return [ ( float( score ), ) + transition for score, transition in zip( scores, transitions ) ]
+
+    if backend != "pyemd":
+        raise ValueError( "Unknown EMD backend: {}".format( backend ) )
+
+    dist_mat = generate_distance_matrix( CDF_PERCENTILES )
+    emd_args = [ transition + ( vals1, vals2, dist_mat, normalize ) for transition, vals1, vals2 in zip( transitions, cdf_vals1, cdf_vals2 ) ]
+    with multiprocessing.Pool( procs ) as proc_pool:
+        return proc_pool.map( do_emd, emd_args, chunksize=64 )
+
+def get_run_score_vectors( models: List[RunModel] ) -> Tuple[Any, Any, np.ndarray, np.ndarray, np.ndarray]:
+    """Flatten each run's transition scores (event probability * transition probability) into row i of a sparse
+    (n_runs x n_events^2) matrix S, keyed by (src id * n_events + dst id) over interned event ids. Returns S,
+    the part B of S whose destination is not an event of the run, the squared norms of S - B, the per destination
+    event sums of the squares of B, and an (n_runs x n_events) indicator of each run's events."""
+    loc_ids = [ model.get_loc_ids() for model in models ]
+    num_events = len( event_interner )
+    score_rows = []
+    dangling_rows = []
+    own_sq_norms = np.zeros( len( models ) )
+    dangling_sq_sums = np.zeros( ( len( models ), num_events ) )
+    has_event = np.zeros( ( len( models ), num_events ), dtype=bool )
+    for i, ( model, ids ) in enumerate( zip( models, loc_ids ) ):
+        event_ids = ids[ model.event_locs ]
+        event_probs = np.zeros( num_events )
+        event_probs[ event_ids ] = model.event_probs
+        has_event[ i, event_ids ] = True
+
+        srcs = ids[ model.transition_srcs ]
+        dsts = ids[ model.transition_dsts ]
+        # Only transitions from the run's events count, and the last row for a transition wins, as in get_data
+        keep = has_event[ i, srcs ]
+        keys = ( srcs * num_events + dsts )[keep][::-1]
+        scores = ( event_probs[ srcs ] * model.transition_probs )[keep][::-1]
+        keys, first = np.unique( keys, return_index=True )
+        scores = scores[first]
+
+        dangling = ~has_event[ i, keys % num_events ]
+        score_rows.append( ( keys, scores ) )
+        dangling_rows.append( ( keys[dangling], scores[dangling] ) )
+        own_sq_norms[i] = np.sum( scores[~dangling] ** 2 )
+        np.add.at( dangling_sq_sums[i], keys[dangling] % num_events, scores[dangling] ** 2 )
+
+    def to_csr( rows: List[Tuple[np.ndarray, np.ndarray]] ):
+        indptr = np.concatenate( [ [0], np.cumsum( [ len( keys ) for keys, scores in rows ] ) ] )
+        indices = np.concatenate( [ keys for keys, scores in rows ] ) if rows else np.zeros( 0, dtype=np.int64 )
+        data = np.concatenate( [ scores for keys, scores in rows ] ) if rows else np.zeros( 0 )
+        return scipy.sparse.csr_matrix( ( data, indices, indptr ), shape=( len( rows ), max( num_events * num_events, 1 ) ) )
+
+    return to_csr( score_rows ), to_csr( dangling_rows ), own_sq_norms, dangling_sq_sums, has_event
+
+def compute_aggregate_score_matrix( models: List[RunModel] ) -> np.ndarray:
+    """Compute compute_difference's aggregate score between every pair of runs at once.
+
+    The aggregate score of runs i and j is |s_i - s_j|^2 over their transition score vectors, except that a
+    transition only counts if its destination is an event of run i or run j. Splitting s_i into the transitions to
+    run i's own events a_i and the rest b_i, that is |a_i|^2 + |b_i restricted to j's events|^2 + (the same for j)
+    - 2 (s_i . s_j - b_i . b_j), so every pair comes from a couple of sparse matrix products."""
+    scores, dangling, own_sq_norms, dangling_sq_sums, has_event = get_run_score_vectors( models )
+    restricted_sq_norms = dangling_sq_sums @ has_event.T.astype( np.float64 )
+    dots = ( scores @ scores.T - dangling @ dangling.T ).toarray()
+    agg_scores = own_sq_norms[:,None] + own_sq_norms[None,:] + restricted_sq_norms + restricted_sq_norms.T - 2 * dots
+    # Cancellation can leave tiny negative values where the runs agree
+    np.maximum( agg_scores, 0., out=agg_scores )
+    np.fill_diagonal( agg_scores, 0. )
+    return agg_scores
+
+pairwise_emd_state = {} # type: Dict[str, Any]
+
+def init_pairwise_emd_worker( models: List[RunModel], normalize: bool, backend: str, min_transition_count: int ):
+    """Index every run's CDFs once per worker process"""
+    pairwise_emd_state['models'] = models
+    pairwise_emd_state['cdf_indexes'] = [ model.get_cdf_index() for model in models ]
+    pairwise_emd_state['frequent'] = [ model.get_frequent_transitions( min_transition_count ) for model in models ]
+    pairwise_emd_state['normalize'] = normalize
+    pairwise_emd_state['backend'] = backend
+    pairwise_emd_state['dist_mat'] = generate_distance_matrix( CDF_PERCENTILES )
+
+def compute_pairwise_emd_total( pair: Tuple[int,int] ) -> float:
+    """Sum the EMD scores of the CDFs of runs i and j, as get_emd_scores_for_run_models scores them"""
+    i, j = pair
+    models = pairwise_emd_state['models']
+    cdf_index1 = pairwise_emd_state['cdf_indexes'][i]
+    cdf_index2 = pairwise_emd_state['cdf_indexes'][j]
+    frequent = pairwise_emd_state['frequent'][i] | pairwise_emd_state['frequent'][j]
+    rows1 = []
+    rows2 = []
+    for key, row1 in cdf_index1.items():
+        row2 = cdf_index2.get( key )
+        if row2 is not None and key in frequent:
+            rows1.append( row1 )
+            rows2.append( row2 )
+    if not rows1:
+        return 0.
+    cdf_vals1 = models[i].cdf_values[rows1]
+    cdf_vals2 = models[j].cdf_values[rows2]
+    if pairwise_emd_state['backend'] == "closed_form":
+        return float( np.sum( emd_closed_form_batch( cdf_vals1, cdf_vals2, CDF_PERCENTILES, pairwise_emd_state['normalize'] ) ) )
+    dist_mat = pairwise_emd_state['dist_mat']
+    return float( sum( do_emd( ( None, None, None, None, vals1, vals2, dist_mat, pairwise_emd_state['normalize'] ) )[0]
+                       for vals1, vals2 in zip( cdf_vals1, cdf_vals2 ) ) )
+
+def compute_emd_total_matrix( models: List[RunModel], normalize=True, procs=1, backend="closed_form", min_transition_count=1000 ) -> np.ndarray:
+    """Compute the total EMD between the CDFs of every pair of runs, spreading the pairs over procs processes.
+    Each worker receives the models once rather than with every pair."""
+    if backend not in [ "pyemd", "closed_form" ]:
+        raise ValueError( "Unknown EMD backend: {}".format( backend ) )
+    pairs = [ ( i, j ) for i in range( len( models ) ) for j in range( i + 1, len( models ) ) ]
+    init_args = ( models, normalize, backend, min_transition_count )
+    if procs > 1:
+        with multiprocessing.Pool( procs, initializer=init_pairwise_emd_worker, initargs=init_args ) as proc_pool:
+            totals = proc_pool.map( compute_pairwise_emd_total, pairs, chunksize=max( 1, len( pairs ) // ( procs * 4 ) ) )
+    else:
+        init_pairwise_emd_worker( *init_args )
+        totals = [ compute_pairwise_emd_total( pair ) for pair in pairs ]
+
+    emd_totals = np.zeros( ( len( models ), len( models ) ) )
+    for ( i, j ), total in zip( pairs, totals ):
+        emd_totals[i, j] = total
+        emd_totals[j, i] = total
+    return emd_totals
 
 ### Variable Order Stuff.
 class VariableOrderTransition:
-    """Variable Order Transition (s-k,...,s) - > s'"""
-    def __init__( self, prior_events: List[FileLocation], next_event: FileLocation ):
+    """Variable Order Transition (s-k,...,s) - > s', over interned event ids"""
+    def __init__( self, prior_events: List[int], next_event: int ):
         self.prior_events = prior_events
         self.next_event = next_event
     def __repr__( self ) -> str:
-        return "({})->{}".format( ",".join([ str(ev) for ev in self.prior_events ]), self.next_event )
+        return "({})->{}".format( ",".join([ event_interner.get_name( ev ) for ev in self.prior_events ]), event_interner.get_name( self.next_event ) )
     def __eq__( self, obj ) -> bool:
         return isinstance( obj, VariableOrderTransition) and self.prior_events == obj.prior_events and self.next_event == obj.next_event
     def __ne__( self, obj ) -> bool:
@@ -603,7 +1500,7 @@ class VariableOrderTransitionIndex:
     """An index from a tuple of prior events (s-k,...,s) to a list of transitions."""
 
     def __init__( self ):
-        self.vot_prior_index = {} # type: Dict[Tuple[FileLocation, ...], List[VariableOrderTransition]]
+        self.vot_prior_index = {} # type: Dict[Tuple[int, ...], List[VariableOrderTransition]]
 
     def add_transition( self, vo_transition: VariableOrderTransition ):
         key = tuple(vo_transition.prior_events)
@@ -611,7 +1508,7 @@ class VariableOrderTransitionIndex:
             self.vot_prior_index[key] = []
         self.vot_prior_index[ key ].append( vo_transition )
 
-    def find_all_transitions( self, prior_events: Tuple[FileLocation, ...] ) -> List[VariableOrderTransition]:
+    def find_all_transitions( self, prior_events: Tuple[int, ...] ) -> List[VariableOrderTransition]:
         key = prior_events
         while len(key) > 0:
             if key in self.vot_prior_index:
@@ -619,7 +1516,7 @@ class VariableOrderTransitionIndex:
             key = key[1:] # chop first element
         return []
 
-    def is_in_index( self, event_sequence: Tuple[FileLocation, ...] ) -> bool:
+    def is_in_index( self, event_sequence: Tuple[int, ...] ) -> bool:
         return event_sequence in self.vot_prior_index
 
 def build_vot_prior_index( vo_transitions: Iterable[VariableOrderTransition] ) -> VariableOrderTransitionIndex:
@@ -763,11 +1660,41 @@ def compute_vot_diff( vo_transitions1: Dict[VariableOrderTransition, int], vo_tr
 class InvalidModelException(Exception):
     pass
 
+class IncrementalModelValidator:
+    """Checks that transitions added over time form a valid variable order markov model, i.e. that no prior event
+    sequence (s_k,...,s) is in the model along with one of its proper suffixes (s_k-m,...,s). Every prior event sequence
+    seen so far and every proper suffix of one are kept, so each add only checks the sequences it introduces."""
+
+    def __init__( self ):
+        self.prior_seqs = set([]) # type: Set[Tuple[int, ...]]
+        # Map from a proper suffix to a prior event sequence that ends with it
+        self.proper_suffixes = {} # type: Dict[Tuple[int, ...], Tuple[int, ...]]
+
+    def add_transitions( self, vo_transitions: Iterable[VariableOrderTransition] ):
+        for vo_transition in vo_transitions:
+            prior_event_seq = tuple( vo_transition.prior_events )
+            if prior_event_seq in self.prior_seqs:
+                continue
+            if prior_event_seq in self.proper_suffixes:
+                self.raise_invalid( prior_event_seq, self.proper_suffixes[ prior_event_seq ] )
+            for i in range( 1, len( prior_event_seq ) ):
+                prior_event_subseq = prior_event_seq[i:]
+                if prior_event_subseq in self.prior_seqs:
+                    self.raise_invalid( prior_event_subseq, prior_event_seq )
+            self.prior_seqs.add( prior_event_seq )
+            for i in range( 1, len( prior_event_seq ) ):
+                self.proper_suffixes.setdefault( prior_event_seq[i:], prior_event_seq )
+
+    @staticmethod
+    def raise_invalid( prior_event_subseq: Tuple[int, ...], prior_event_seq: Tuple[int, ...] ):
+        raise InvalidModelException( "{} in model, but so is {}".format( [ event_interner.get_name( ev ) for ev in prior_event_subseq ],
+                                                                         [ event_interner.get_name( ev ) for ev in prior_event_seq ] ) )
+
 class VariableOrderMarkovGraph:
     """A Markov Graph where the transitions between nodes may rely on a variable number of previous nodes.
     A traditional MarkovGraph uses P(s'|s), but this Markov Graph is P(s'|s,s-1,s-2...s-k) AND k is variable depending on s'"""
 
-    def __init__( self, events: Dict[FileLocation, EventRecord], transitions: Dict[VariableOrderTransition, int] ):
+    def __init__( self, events: Dict[int, EventRecord], transitions: Dict[VariableOrderTransition, int] ):
         self.events = events
         self.transitions = transitions
 
@@ -776,7 +1703,21 @@ class VariableOrderMarkovGraph:
 
     @staticmethod
     def deserialize( data ):
+        """Load a serialized model. Event ids are only valid in the session that interned them,
+        so they are remapped to this session's ids using the locations stored in the events."""
         model = pickle.loads( data )
+        id_remap = {} # type: Dict[Any, int]
+        events = {} # type: Dict[int, EventRecord]
+        for old_id, event in model.events.items():
+            event.event_id = event_interner.get_id( event.event_loc.fname, event.event_loc.line_number )
+            id_remap[old_id] = event.event_id
+            events[event.event_id] = event
+        transitions = {} # type: Dict[VariableOrderTransition, int]
+        for transition, count in model.transitions.items():
+            remapped = VariableOrderTransition( [ id_remap[ev] for ev in transition.prior_events ], id_remap[ transition.next_event ] )
+            transitions[remapped] = count
+        model.events = events
+        model.transitions = transitions
         model.check_valid_model()
         return model
 
@@ -789,16 +1730,7 @@ class VariableOrderMarkovGraph:
         """Confirm that this variable order markov model is valid. That is,
         if it contains a transitions from (s_k,...,s), it does not contain transitions from
         (s_k-m,...s) for all m."""
-
-        prior_vot_index = build_vot_prior_index( self.transitions )
-
-        for transition in self.transitions.keys():
-            prior_event_seq = transition.prior_events
-            while len(prior_event_seq) > 1:
-                prior_event_subseq = prior_event_seq[1:]
-                if prior_vot_index.is_in_index( tuple(prior_event_subseq) ):
-                    raise InvalidModelException( "{} in model, but so is {}".format( prior_event_subseq, transition.prior_events ) )
-                prior_event_seq = prior_event_subseq
+        IncrementalModelValidator().add_transitions( self.transitions )
 
     def merge_in( self, other_vom: 'VariableOrderMarkovGraph' ):
         pass
@@ -806,18 +1738,18 @@ class VariableOrderMarkovGraph:
 # This is redundant. I could just use VariableOrderMarkovModel now.
 class FileEventSummary:
     """A summary of all the events (counts, transitions) that have occurred in one Sentinel output file."""
-    def __init__( self, known_locs: List[ FileLocation ], event_count_map: Dict[FileLocation, int], event_transition_map: Dict[VariableOrderTransition, int] ):
+    def __init__( self, known_locs: Iterable[int], event_count_map: Dict[int, int], event_transition_map: Dict[VariableOrderTransition, int] ):
 
-        # Known Locs
-        self.known_locs = known_locs
+        # Known Locs, as interned event ids. Kept as the keys of a dict so that it is an ordered set.
+        self.known_locs = dict.fromkeys( known_locs ) # type: Dict[int, None]
 
-        # Map from locs to counts
+        # Map from event ids to counts
         self.event_count_map = event_count_map
 
         # Map from (PriorEvents->Transition) -> Count
         self.event_transition_map = event_transition_map
 
-        self.msg_map = {} # type: Dict[FileLocation, str]
+        self.msg_map = {} # type: Dict[int, str]
 
     def untranslate( self, cur_key ):
         for k, translated_k in self.event_id_translation_map.items():
@@ -826,48 +1758,57 @@ class FileEventSummary:
         raise LookupError( "{} not found!".format( cur_key ) )
 
     def merge_count_dicts( self, out_dict: Dict[Any, int], other_dict: Dict[Any, int] ):
-        """ Given two dictionaries that track counts over objects, sum them together in out_dict"""
-        for k in out_dict.keys():
-            if k in other_dict.keys():
-                out_dict[k] += other_dict[k]
-        
-        for k in other_dict.keys():
-            if not k in out_dict.keys():
-                out_dict[k] = other_dict[k]
+        """ Given two dictionaries that track counts over objects, sum them together in out_dict.
+        Keys new to out_dict are added in other_dict's order."""
+        if not out_dict:
+            out_dict.update( other_dict )
+            return
+        out_dict_get = out_dict.get
+        for k, count in other_dict.items():
+            out_dict[k] = out_dict_get( k, 0 ) + count
 
     def merge_in( self, other_summary: 'FileEventSummary' ):
         # Merge in the event_ids we don't know about
-        for known_loc in other_summary.known_locs:
-            if known_loc not in self.known_locs:
-                self.known_locs.append( known_loc )
+        self.known_locs.update( other_summary.known_locs )
         
         self.merge_count_dicts( self.event_count_map, other_summary.event_count_map )
         self.merge_count_dicts( self.event_transition_map, other_summary.event_transition_map )
 
+    def remap_event_ids( self, id_map: Dict[int, int] ) -> 'FileEventSummary':
+        """Get a copy of this summary with every event id replaced by id_map[event id]"""
+        event_transition_map = {} # type: Dict[VariableOrderTransition, int]
+        for transition, count in self.event_transition_map.items():
+            remapped = VariableOrderTransition( [ id_map[ev] for ev in transition.prior_events ], id_map[ transition.next_event ] )
+            event_transition_map[remapped] = count
+        return FileEventSummary( [ id_map[event_id] for event_id in self.known_locs ],
+                                 { id_map[event_id]: count for event_id, count in self.event_count_map.items() },
+                                 event_transition_map )
+
     def as_variable_order_markov_graph( self ) -> VariableOrderMarkovGraph:
         total_event_count = 0.
         for event_loc, count in self.event_count_map.items():
             total_event_count += count
-        event_records = {} # type: Dict[FileLocation, EventRecord]
-        for event_loc, count in self.event_count_map.items():
+        event_records = {} # type: Dict[int, EventRecord]
+        for event_id, count in self.event_count_map.items():
+            event_loc = event_interner.get_location( event_id )
             record = EventRecord( event_loc.fname, event_loc.line_number, float(count)/total_event_count )
-            event_records[ event_loc ] = record
+            event_records[ event_id ] = record
 
         return VariableOrderMarkovGraph( event_records, self.event_transition_map )
 
-def process_event_line( line, file_map: Dict[int, FileLocation], count_map: Dict[FileLocation,int] ):
-    """Process a line like "pg.c:1 = 1, 10" and add the filelocation and count to the right maps"""
+def process_event_line( line, file_map: Dict[int, int], count_map: Dict[int,int] ):
+    """Process a line like "pg.c:1 = 1, 10" and add the interned event id and count to the right maps"""
     left, right = line.split("=")
     fname, line_number = left.split(":")
-    loc = FileLocation( fname, int( line_number.strip() ) )
+    event_id = event_interner.get_id( fname, int( line_number.strip() ) )
     identifier, count = right.lstrip().split(",")
     identifier = int( identifier )
     count = int( count.strip() )
     assert identifier not in file_map
-    file_map[identifier] = loc
-    count_map[loc] = count
+    file_map[identifier] = event_id
+    count_map[event_id] = count
 
-def process_transition_line( line, file_map: Dict[int,FileLocation], transition_map: Dict[VariableOrderTransition, int] ):
+def process_transition_line( line, file_map: Dict[int,int], transition_map: Dict[VariableOrderTransition, int] ):
     """Process a line like "(1,2)->1: 2" and add the transition and count to the right maps"""
     left, right = line.split("->")
     
@@ -883,60 +1824,106 @@ def process_transition_line( line, file_map: Dict[int,FileLocation], transition_
     transition_id = int( transition.lstrip() )
     count = int( count.lstrip() )
 
-    prior_event_locs = [ file_map[ prior_event_id ] for prior_event_id in prior_event_ids ]
-    right_loc = file_map[ transition_id ]
+    prior_events = [ file_map[ prior_event_id ] for prior_event_id in prior_event_ids ]
+    next_event = file_map[ transition_id ]
 
-    transition = VariableOrderTransition( prior_event_locs, right_loc )
+    transition = VariableOrderTransition( prior_events, next_event )
     transition_map[transition] = count
 
-def process_dump_lines( lines )-> FileEventSummary:
-    """ Read all the lines in a file and convert them into a FileEventSummary"""
-    i = 0
-    event_file_map = {} # type: Dict[int, FileLocation]
-    event_count_map = {} # type: Dict[FileLocation, int]
+def process_dump_lines( lines: Iterable[str] ) -> FileEventSummary:
+    """ Convert the lines of a dump into a FileEventSummary in a single pass. lines may be any iterable of lines,
+    such as an open file, so the dump never needs to be held in memory"""
+    event_file_map = {} # type: Dict[int, int]
+    event_count_map = {} # type: Dict[int, int]
     event_transition_map = {} # type: Dict[VariableOrderTransition, int]
-    while i < len(lines):
-        # This is a transition line, break into transition processing
-        if "->" in lines[i]:
-            break
-        # This is still an event count line
-        process_event_line( lines[i], event_file_map, event_count_map )
-        i += 1
-
-    while i < len(lines):
-        process_transition_line( lines[i], event_file_map, event_transition_map )
-        i += 1
+    in_transitions = False
+    for line in lines:
+        # Event count lines come first, the first transition line starts the transitions
+        if in_transitions or "->" in line:
+            in_transitions = True
+            process_transition_line( line, event_file_map, event_transition_map )
+        else:
+            process_event_line( line, event_file_map, event_count_map )
 
     return FileEventSummary( [ v for k,v in event_file_map.items() ], event_count_map, event_transition_map )
         
+def binary_im_dump_to_summary( im_dump: BinaryIMDump ) -> FileEventSummary:
+    """Convert a binary im dump into a FileEventSummary. The tracer only records first order transitions, which
+    process_transition_line skips in text dumps, so they are left out here too and both formats give the same summary."""
+    event_file_map = {} # type: Dict[int, int]
+    event_count_map = {} # type: Dict[int, int]
+    for identifier, fname, line_number, count in zip( im_dump.event_ids.tolist(), im_dump.get_fnames(),
+                                                      im_dump.line_numbers.tolist(), im_dump.event_counts.tolist() ):
+        event_id = event_interner.get_id( fname, line_number )
+        event_file_map[identifier] = event_id
+        event_count_map[event_id] = count
+
+    return FileEventSummary( event_file_map.values(), event_count_map, {} )
+
 def read_single_im_dump( filename: str ) -> FileEventSummary:
+    """Read a text or binary im dump, telling them apart by the binary format's magic number"""
+    if is_binary_im_dump( filename ):
+        return binary_im_dump_to_summary( read_binary_im_dump( filename ) )
     with open( filename, "r" ) as f:
-        f_lines = f.readlines()
-        f_event_summary = process_dump_lines( f_lines )
-        return( f_event_summary )
-
-def read_all_im_dumps( im_dir: str ) -> FileEventSummary:
-    f_event_summary = FileEventSummary( [], {}, {} )
-    for fname in glob.iglob( "{}/*.im.out*".format( im_dir ) ):
-        next_f_event_summary = read_single_im_dump( fname )
-
-        # TODO: for debugging, can turn off if we want
-        per_thread_vom = next_f_event_summary.as_variable_order_markov_graph()
-        per_thread_vom.check_valid_model()
-
-        f_event_summary.merge_in( next_f_event_summary )
-
-        # TODO: for debugging, can turn off if we want
-        merged_vom = f_event_summary.as_variable_order_markov_graph()
-        merged_vom.check_valid_model()
-
+        return process_dump_lines( f )
+
+VALIDATION_MODES = [ "incremental", "final", "off" ]
+
+def read_im_dump_chunk( fnames: List[str] ) -> Tuple[FileEventSummary, List[FileLocation]]:
+    """Parse and merge a contiguous chunk of dumps in a worker process. Event ids are interned by the worker's
+    own event_interner, so the location of every id in the summary is returned alongside it, in known_locs order."""
+    f_event_summary = merge_file_event_summaries( ( read_single_im_dump( fname ) for fname in fnames ), FileEventSummary( [], {}, {} ) )
+    return f_event_summary, [ event_interner.get_location( event_id ) for event_id in f_event_summary.known_locs ]
+
+def read_all_im_dumps( im_dir: str, procs=1, validate="incremental" ) -> FileEventSummary:
+    """Read and merge every dump in im_dir. If procs > 1, contiguous chunks of dumps are parsed over a pool of
+    procs processes and the partial summaries are combined pairwise in a tree reduction. Since chunks are contiguous
+    and each merge keeps the left summary's order, the result is identical to the serial merge.
+    validate is one of:
+        incremental: check each dump's transitions against those merged so far as it is merged in
+        final: check the merged model once at the end
+        off: skip validation
+    Models only gain transitions as they are merged, so all three modes accept the same dumps when validating."""
+    if validate not in VALIDATION_MODES:
+        raise ValueError( "Unknown validation mode: {}".format( validate ) )
+    validator = IncrementalModelValidator() if validate == "incremental" else None
+
+    fnames = list( glob.iglob( "{}/*.im.out*".format( im_dir ) ) )
+    if procs > 1 and len( fnames ) > 1:
+        # Several chunks per process to even out differences in dump sizes
+        num_chunks = min( len( fnames ), procs * 4 )
+        chunk_bounds = np.linspace( 0, len( fnames ), num_chunks + 1 ).astype( int )
+        chunks = [ fnames[ chunk_bounds[i]:chunk_bounds[i+1] ] for i in range( num_chunks ) ]
+        with multiprocessing.Pool( procs ) as proc_pool:
+            partial_results = proc_pool.map( read_im_dump_chunk, chunks )
+
+        # Move the partials onto this process's event ids, in chunk order so ids are interned in the same order as serially
+        partial_summaries = [] # type: List[FileEventSummary]
+        for partial_summary, partial_locs in partial_results:
+            id_map = { event_id: event_interner.get_id( loc.fname, loc.line_number ) for event_id, loc in zip( partial_summary.known_locs, partial_locs ) }
+            partial_summaries.append( partial_summary.remap_event_ids( id_map ) )
+            if validator is not None:
+                validator.add_transitions( partial_summaries[-1].event_transition_map )
+
+        f_event_summary = tree_merge_file_event_summaries( partial_summaries )
+    else:
+        def read_validated_im_dumps() -> Iterable[FileEventSummary]:
+            for fname in fnames:
+                next_f_event_summary = read_single_im_dump( fname )
+                if validator is not None:
+                    validator.add_transitions( next_f_event_summary.event_transition_map )
+                yield next_f_event_summary
+        f_event_summary = merge_file_event_summaries( read_validated_im_dumps(), FileEventSummary( [], {}, {} ) )
+
+    if validate == "final":
+        f_event_summary.as_variable_order_markov_graph().check_valid_model()
     return f_event_summary
 
 def get_log_line_from_location( file_loc: FileLocation, postgres_src_dir: str ) -> str:
     return "macro, can't tell"
 
 def get_log_lines_for_im_dumps( merged_summaries: FileEventSummary, postgres_src_dir: str ):
-    msg_map = {} # type: Dict[FileLocation, str]
-    for loc in merged_summaries.known_locs:
-        msg_map[loc] = get_log_line_from_location( loc, postgres_src_dir )
+    msg_map = {} # type: Dict[int, str]
+    for event_id in merged_summaries.known_locs:
+        msg_map[event_id] = get_log_line_from_location( event_interner.get_location( event_id ), postgres_src_dir )
     merged_summaries.msg_map = msg_map
@@ -220,20 +220,33 @@ static void record_elapsed_ticks( int last_event_id, int cur_event_id, double no
 /*
  * write_to_file
  * Given a file descriptor and a buffer, write wrlen bytes from the buffer
- * to the fd, looping as necessary until it is done.
+ * to the fd, looping as necessary until it is done. write() may write less
+ * than asked (Linux caps each call just under 2 GiB), so binary dump columns
+ * of any size are written in as many calls as it takes.
  */
-static void write_to_file( int fd, char *buff, int wrlen ) {
-    int wr_thus_far = 0;
-    if( wrlen > 0 ) { 
-        int write_ret = 0; 
-        while( wr_thus_far < wrlen ) {
-            write_ret = write( fd, buff+wr_thus_far, wrlen-wr_thus_far );
-            if( write_ret == -1 ) {
-                printf( "Could not write to file. Got error code: %d\n", errno );
-                return;
+static void write_to_file( int fd, char *buff, size_t wrlen ) {
+    size_t wr_thus_far = 0;
+    while( wr_thus_far < wrlen ) {
+        ssize_t write_ret = write( fd, buff+wr_thus_far, wrlen-wr_thus_far );
+        if( write_ret == -1 ) {
+            if( errno == EINTR ) {
+                continue;
             }
-            wr_thus_far += write_ret;
+            printf( "Could not write to file. Got error code: %d\n", errno );
+            return;
         }
+        wr_thus_far += (size_t) write_ret;
+    }
+}
+
+/*
+ * write_text_to_file
+ * Write the wrlen bytes snprintf reported formatting into buff, skipping
+ * formatting errors (a negative wrlen) rather than writing them as a huge size_t.
+ */
+static void write_text_to_file( int fd, char *buff, int wrlen ) {
+    if( wrlen > 0 ) {
+        write_to_file( fd, buff, (size_t) wrlen );
     }
 }
 
@@ -667,10 +680,139 @@ static void write_reservoir_to_file( int fd, Reservoir *reservoir ) {
     char buff[512];
     for( int i = 0; i < reservoir->next_slot; i++ ) {
         int wrlen = snprintf( buff, 512, "%f\n", reservoir->value_pool[i]);
-        write_to_file( fd, buff, wrlen );
+        write_text_to_file( fd, buff, wrlen );
     }
 }
 
+/*
+ * use_binary_dump
+ * Check if the SENTINEL_BINARY_DUMP environment variable asks for the binary dump format.
+ */
+static int use_binary_dump() {
+    const char *val = getenv( "SENTINEL_BINARY_DUMP" );
+    return val != NULL && val[0] != '\0' && strcmp( val, "0" ) != 0;
+}
+
+/*
+ * write_column
+ * Write a length prefixed column of nbytes bytes to fd, zero padded to a multiple of 8 bytes.
+ */
+static void write_column( int fd, const void *data, uint64_t nbytes ) {
+    char zeros[8] = { 0 };
+    write_to_file( fd, (char *) &nbytes, sizeof( nbytes ) );
+    write_to_file( fd, (char *) data, nbytes );
+    write_to_file( fd, zeros, ( 8 - nbytes % 8 ) % 8 );
+}
+
+/*
+ * dump_im_tracing_binary()
+ * Dump all in memory tracing information, including the reservoirs, to fd in the binary columnar format.
+ */
+static void dump_im_tracing_binary( int fd ) {
+    BinaryDumpHeader header;
+    uint64_t num_values = 0;
+    uint64_t fname_bytes = 0;
+    uint64_t e = 0, t = 0, r = 0;
+    int i;
+
+    memset( &header, '\0', sizeof( header ) );
+    memcpy( header.magic, BINARY_DUMP_MAGIC, sizeof( header.magic ) );
+    header.version = BINARY_DUMP_VERSION;
+    header.num_columns = BINARY_DUMP_NUM_COLUMNS;
+
+    // Size up the columns
+    for( i = 0; i < NEVENTS; i++ ) {
+        if( event_info[i].filename != NULL ) {
+            header.num_events++;
+            fname_bytes += strlen( event_info[i].filename );
+            for( TransitionCount *transition = event_info[i].transition_ptr; transition != NULL; transition = transition->next ) {
+                header.num_transitions++;
+            }
+            for( Reservoir *reservoir = event_info[i].reservoir_ptr; reservoir != NULL; reservoir = reservoir->next ) {
+                header.num_reservoirs++;
+                num_values += reservoir->next_slot;
+            }
+        }
+    }
+
+    int32_t *event_ids = (int32_t *) malloc( sizeof( int32_t ) * header.num_events );
+    int32_t *line_numbers = (int32_t *) malloc( sizeof( int32_t ) * header.num_events );
+    uint64_t *event_counts = (uint64_t *) malloc( sizeof( uint64_t ) * header.num_events );
+    uint64_t *fname_offsets = (uint64_t *) malloc( sizeof( uint64_t ) * ( header.num_events + 1 ) );
+    char *fname_data = (char *) malloc( fname_bytes + 1 );
+    int32_t *transition_srcs = (int32_t *) malloc( sizeof( int32_t ) * header.num_transitions );
+    int32_t *transition_dsts = (int32_t *) malloc( sizeof( int32_t ) * header.num_transitions );
+    uint64_t *transition_counts = (uint64_t *) malloc( sizeof( uint64_t ) * header.num_transitions );
+    int32_t *reservoir_srcs = (int32_t *) malloc( sizeof( int32_t ) * header.num_reservoirs );
+    int32_t *reservoir_dsts = (int32_t *) malloc( sizeof( int32_t ) * header.num_reservoirs );
+    uint64_t *reservoir_offsets = (uint64_t *) malloc( sizeof( uint64_t ) * ( header.num_reservoirs + 1 ) );
+    double *reservoir_values = (double *) malloc( sizeof( double ) * ( num_values + 1 ) );
+
+    if( event_ids == NULL || line_numbers == NULL || event_counts == NULL || fname_offsets == NULL ||
+        fname_data == NULL || transition_srcs == NULL || transition_dsts == NULL || transition_counts == NULL ||
+        reservoir_srcs == NULL || reservoir_dsts == NULL || reservoir_offsets == NULL || reservoir_values == NULL ) {
+        printf( "ERROR: could not allocate binary dump columns\n" );
+        goto cleanup;
+    }
+
+    // Fill the columns
+    fname_offsets[0] = 0;
+    reservoir_offsets[0] = 0;
+    for( i = 0; i < NEVENTS; i++ ) {
+        if( event_info[i].filename != NULL ) {
+            uint64_t fname_len = strlen( event_info[i].filename );
+            event_ids[e] = i;
+            line_numbers[e] = event_info[i].line_number;
+            event_counts[e] = event_info[i].count;
+            memcpy( fname_data + fname_offsets[e], event_info[i].filename, fname_len );
+            fname_offsets[e+1] = fname_offsets[e] + fname_len;
+            e++;
+
+            for( TransitionCount *transition = event_info[i].transition_ptr; transition != NULL; transition = transition->next ) {
+                transition_srcs[t] = i;
+                transition_dsts[t] = transition->event_id;
+                transition_counts[t] = transition->count;
+                t++;
+            }
+            for( Reservoir *reservoir = event_info[i].reservoir_ptr; reservoir != NULL; reservoir = reservoir->next ) {
+                reservoir_srcs[r] = i;
+                reservoir_dsts[r] = reservoir->event_id;
+                memcpy( reservoir_values + reservoir_offsets[r], reservoir->value_pool, sizeof( double ) * reservoir->next_slot );
+                reservoir_offsets[r+1] = reservoir_offsets[r] + reservoir->next_slot;
+                r++;
+            }
+        }
+    }
+
+    write_to_file( fd, (char *) &header, sizeof( header ) );
+    write_column( fd, event_ids, sizeof( int32_t ) * header.num_events );
+    write_column( fd, line_numbers, sizeof( int32_t ) * header.num_events );
+    write_column( fd, event_counts, sizeof( uint64_t ) * header.num_events );
+    write_column( fd, fname_offsets, sizeof( uint64_t ) * ( header.num_events + 1 ) );
+    write_column( fd, fname_data, fname_bytes );
+    write_column( fd, transition_srcs, sizeof( int32_t ) * header.num_transitions );
+    write_column( fd, transition_dsts, sizeof( int32_t ) * header.num_transitions );
+    write_column( fd, transition_counts, sizeof( uint64_t ) * header.num_transitions );
+    write_column( fd, reservoir_srcs, sizeof( int32_t ) * header.num_reservoirs );
+    write_column( fd, reservoir_dsts, sizeof( int32_t ) * header.num_reservoirs );
+    write_column( fd, reservoir_offsets, sizeof( uint64_t ) * ( header.num_reservoirs + 1 ) );
+    write_column( fd, reservoir_values, sizeof( double ) * num_values );
+
+cleanup:
+    free( event_ids );
+    free( line_numbers );
+    free( event_counts );
+    free( fname_offsets );
+    free( fname_data );
+    free( transition_srcs );
+    free( transition_dsts );
+    free( transition_counts );
+    free( reservoir_srcs );
+    free( reservoir_dsts );
+    free( reservoir_offsets );
+    free( reservoir_values );
+}
+
 /*
  * dump_im_tracing()
  * Dump all in memory tracing information to per-thread files for offline analysis.
@@ -685,13 +827,20 @@ void dump_im_tracing() {
         return;
     }
 
+    if( use_binary_dump() ) {
+        dump_im_tracing_binary( out_fd );
+        close( out_fd );
+        out_fd = -2; // don't dump more than once.
+        return;
+    }
+
     pid_t my_pid = getpid();
     pid_t my_tid = syscall( __NR_gettid );
     for( i = 0; i < NEVENTS; i++ ) {
         if( event_info[i].filename != NULL ) {
             memset( buff, '\0', sizeof( buff ) );
             wrlen = snprintf( buff, 512, "%s:%d = %d, %ld\n", event_info[i].filename, event_info[i].line_number, i, event_info[i].count);
-            write_to_file( out_fd, buff, wrlen );
+            write_text_to_file( out_fd, buff, wrlen );
         }
     }
 
@@ -701,7 +850,7 @@ void dump_im_tracing() {
             while( transition != NULL ) {
                 memset( buff, '\0', sizeof( buff ) );
                 wrlen = snprintf( buff, 512, "%d -> %d: %ld\n", i, transition->event_id, transition->count );
-                write_to_file( out_fd, buff, wrlen );
+                write_text_to_file( out_fd, buff, wrlen );
                 transition = transition->next;
             }
         }
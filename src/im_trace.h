@@ -53,6 +53,40 @@ typedef struct EventRegInfo {
     Reservoir           *reservoir_ptr;
 } EventRegInfo;
 
+/*
+ * Binary dump format
+ * Written in place of the text dump (and the per-transition event-flat files) when the
+ * SENTINEL_BINARY_DUMP environment variable is set to anything other than "" or "0".
+ * The file starts with a BinaryDumpHeader, followed by BINARY_DUMP_NUM_COLUMNS columns.
+ * Each column is a uint64_t byte length followed by that many bytes of data, zero padded
+ * to a multiple of 8 bytes so every column can be mapped in place. Values are native
+ * endian. Columns, in order:
+ *  event_ids          int32_t[num_events]
+ *  line_numbers       int32_t[num_events]
+ *  event_counts       uint64_t[num_events]
+ *  fname_offsets      uint64_t[num_events+1], event i's file name is fname_data[offsets[i]:offsets[i+1]]
+ *  fname_data         char[fname_offsets[num_events]]
+ *  transition_srcs    int32_t[num_transitions]
+ *  transition_dsts    int32_t[num_transitions]
+ *  transition_counts  uint64_t[num_transitions]
+ *  reservoir_srcs     int32_t[num_reservoirs]
+ *  reservoir_dsts     int32_t[num_reservoirs]
+ *  reservoir_offsets  uint64_t[num_reservoirs+1], reservoir i is values[offsets[i]:offsets[i+1]]
+ *  reservoir_values   double[reservoir_offsets[num_reservoirs]]
+ */
+#define BINARY_DUMP_MAGIC "SNTLDMP1"
+#define BINARY_DUMP_VERSION 1
+#define BINARY_DUMP_NUM_COLUMNS 12
+
+typedef struct BinaryDumpHeader {
+    char        magic[8];
+    uint32_t    version;
+    uint32_t    num_columns;
+    uint64_t    num_events;
+    uint64_t    num_transitions;
+    uint64_t    num_reservoirs;
+} BinaryDumpHeader;
+
 /*
  * init_im_tracing()
  * Initialize in memory tracing. When called, initializes all of the memory allocated for 